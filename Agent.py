@@ -1,28 +1,191 @@
 # 博弈高手
-from tqdm import tqdm, trange
 from Data_Handling import DataHandler
 from Performance_Analysis import PerformanceAnalysis  # 导入绩效分析类
 import pandas as pd
 import numpy as np
 import logging
+import copy
+import json
+import os
 from datetime import datetime
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log = logging.getLogger(__name__)
+
+# 价值表存档格式版本，格式变化时递增
+AGENT_FILE_VERSION = 2
+
+# 默认状态特征：(特征名, 基于指数数据列的表达式)
+DEFAULT_STATE_FEATURES = (
+    ('high_low_ratio', '(high - low) / high'),
+    ('close_open_volume', '(close - open) / vol'),
+    ('amount', 'amount'),
+)
+
+# 状态空间超过该数量时价值函数改用稀疏存储
+MAX_DENSE_STATES = 100000
+
+
+# 可配置的N维状态离散化器
+class StateDiscretizer:
+    def __init__(self, features=DEFAULT_STATE_FEATURES, edges=None, quantile_levels=(0.2, 0.4, 0.6, 0.8)):
+        """
+        参数:
+        features: [(特征名, 表达式)]，表达式为DataFrame.eval字符串或接收DataFrame返回数组的函数
+        edges: {特征名: 分箱边界}，显式给定的边界不会被fit覆盖
+        quantile_levels: 未给定边界的特征在基准数据上取的分位点，可为序列或{特征名: 序列}
+        """
+        self.features = list(features)
+        self.names = [name for name, _ in self.features]
+        self.edges = {name: np.asarray(values, dtype=np.float64) for name, values in (edges or {}).items()}
+        self.quantile_levels = quantile_levels
+
+    def evaluate(self, df):
+        """向量化计算全部特征，返回(天数, 特征数)数组"""
+        columns = []
+        for name, expression in self.features:
+            values = expression(df) if callable(expression) else df.eval(expression)
+            columns.append(np.asarray(values, dtype=np.float64))
+        return np.column_stack(columns)
+
+    def fit(self, baseline_df):
+        """在基准数据上计算尚未给定边界的特征分位点"""
+        values = self.evaluate(baseline_df)
+        for k, name in enumerate(self.names):
+            if name in self.edges:
+                continue
+            levels = self.quantile_levels
+            if isinstance(levels, dict):
+                levels = levels[name]
+            self.edges[name] = np.nanquantile(values[:, k], levels)
+        return self
+
+    def transform(self, df):
+        """
+        离散化全部记录，返回(天数, 特征数)档位数组，取值1~分箱数
+        right=True即"value <= 边界"归入较低档；NaN落在最高档
+        """
+        values = self.evaluate(df)
+        ranks = np.column_stack([
+            np.digitize(values[:, k], self.edges[name], right=True) + 1 for k, name in enumerate(self.names)
+        ])
+        return ranks.astype(np.int8 if max(self.shape) < 127 else np.int16)
+
+    @property
+    def shape(self):
+        """状态空间形状（每个特征的分箱数）"""
+        return tuple(len(self.edges[name]) + 1 for name in self.names)
+
+    def with_edges(self, edges):
+        """返回使用给定分箱边界的副本"""
+        discretizer = copy.copy(self)
+        discretizer.edges = {name: np.asarray(values, dtype=np.float64) for name, values in edges.items()}
+        return discretizer
+
+
+# 稠密价值表：状态空间较小时使用
+class DenseValueTable:
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.array = np.zeros(self.shape)
+
+    @property
+    def size(self):
+        return self.array.size
+
+    def __getitem__(self, state):
+        return self.array[tuple(state)]
+
+    def __setitem__(self, state, value):
+        self.array[tuple(state)] = value
+
+    def take(self, flat_states):
+        """按扁平状态下标批量读取价值"""
+        return self.array.reshape(-1)[flat_states]
+
+    def put(self, flat_states, values):
+        """按扁平状态下标批量写入价值"""
+        self.array.reshape(-1)[flat_states] = values
+
+    def items(self):
+        """返回(扁平下标数组, 价值数组)，只包含非零状态"""
+        flat = self.array.reshape(-1)
+        index = np.flatnonzero(flat)
+        return index, flat[index]
+
+    def min(self):
+        return float(self.array.min())
+
+    def max(self):
+        return float(self.array.max())
+
+
+# 稀疏价值表：状态空间很大时使用，内存和查询开销只与访问过的状态数量有关
+class SparseValueTable:
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.data = {}  # 扁平状态下标 -> 价值
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.float64))
+
+    def __getitem__(self, state):
+        return self.data.get(int(np.ravel_multi_index(tuple(state), self.shape)), 0.0)
+
+    def __setitem__(self, state, value):
+        self.data[int(np.ravel_multi_index(tuple(state), self.shape))] = float(value)
+
+    def take(self, flat_states):
+        get = self.data.get
+        return np.fromiter((get(k, 0.0) for k in np.asarray(flat_states).tolist()), dtype=np.float64,
+                           count=len(flat_states))
+
+    def put(self, flat_states, values):
+        self.data.update(zip(np.asarray(flat_states).tolist(), np.asarray(values, dtype=np.float64).tolist()))
+
+    def items(self):
+        index = np.fromiter(self.data.keys(), dtype=np.int64, count=len(self.data))
+        values = np.fromiter(self.data.values(), dtype=np.float64, count=len(self.data))
+        nonzero = values != 0
+        return index[nonzero], values[nonzero]
+
+    def min(self):
+        # 未访问的状态价值为0
+        values = self.items()[1]
+        return float(min(values.min(), 0.0)) if len(values) else 0.0
+
+    def max(self):
+        values = self.items()[1]
+        return float(max(values.max(), 0.0)) if len(values) else 0.0
+
+
+def make_value_table(shape, max_dense_states=MAX_DENSE_STATES):
+    """按状态空间大小选择稠密或稀疏价值表"""
+    if np.prod(shape, dtype=np.float64) > max_dense_states:
+        return SparseValueTable(shape)
+    return DenseValueTable(shape)
 
 
 # 离散简化智能体环境
 class DiscreteIndexEnvironment:
-    def __init__(self, file_path):
+    def __init__(self, file_path=None, df=None, discretizer=None):
         """
         初始化离散化智能体环境
 
         参数:
         file_path: CSV文件路径
+        df: 已加载的指数数据（含trade_date、open、high、low、close、vol、amount列），给定时不再读取文件；
+            需要额外特征（如成分股涨跌家数）时可先把对应列并入df
+        discretizer: StateDiscretizer实例，默认使用三个指数特征的五分位离散化
         """
-        # 读取CSV文件
-        self.df = pd.read_csv(file_path)
-        self.df['trade_date'] = pd.to_datetime(self.df['trade_date'], format='%Y%m%d')
+        if df is not None:
+            self.df = df
+        else:
+            # 读取CSV文件
+            self.df = pd.read_csv(file_path)
+            self.df['trade_date'] = pd.to_datetime(self.df['trade_date'], format='%Y%m%d')
+
+        self.discretizer = discretizer if discretizer is not None else StateDiscretizer()
 
         # 获取基准数据（使用文件中的可用数据范围）
         # 由于数据从2018年开始，调整基准期间为2018-2020
@@ -33,23 +196,84 @@ class DiscreteIndexEnvironment:
             (self.df['trade_date'] <= end_date)
             ].copy()
 
-        print(f"基准数据期间: {self.baseline_df['trade_date'].min()} 到 {self.baseline_df['trade_date'].max()}")
-        print(f"基准交易日数: {len(self.baseline_df)}")
+        log.info("基准数据期间: %s 到 %s", self.baseline_df['trade_date'].min(), self.baseline_df['trade_date'].max())
+        log.info("基准交易日数: %s", len(self.baseline_df))
 
-        # 在基准数据上计算指标
-        self.baseline_df['high_low_ratio'] = (self.baseline_df['high'] - self.baseline_df['low']) / self.baseline_df[
-            'high']
-        self.baseline_df['close_open_volume'] = (self.baseline_df['close'] - self.baseline_df['open']) / \
-                                                self.baseline_df['vol']
+        # 在基准数据上计算各特征的分位点（显式给定分箱边界的特征保持不变）
+        self.discretizer.fit(self.baseline_df)
 
-        # 计算基准数据的分位点
-        self.quantiles = {
-            'high_low_ratio': self.baseline_df['high_low_ratio'].quantile([0.2, 0.4, 0.6, 0.8]).values,
-            'close_open_volume': self.baseline_df['close_open_volume'].quantile([0.2, 0.4, 0.6, 0.8]).values,
-            'amount': self.baseline_df['amount'].quantile([0.2, 0.4, 0.6, 0.8]).values
-        }
+        log.info("分位点计算完成")
+
+        # 一次性计算全部交易日的离散化状态，之后的查询都是数组下标访问
+        self._build_state_table()
 
-        print("分位点计算完成")
+    @property
+    def quantiles(self):
+        """各特征的分箱边界 {特征名: 边界数组}"""
+        return self.discretizer.edges
+
+    def _build_state_table(self):
+        """
+        在全部历史上向量化计算特征并离散化，得到按日期索引的状态表
+        每列对应离散化器的一个特征，取值1~分箱数
+        """
+        df = self.df.sort_values('trade_date').reset_index(drop=True)
+        self.dates = pd.DatetimeIndex(df['trade_date'])
+        self.open = df['open'].to_numpy(dtype=np.float64)
+        self.high = df['high'].to_numpy(dtype=np.float64)
+        self.low = df['low'].to_numpy(dtype=np.float64)
+        self.close = df['close'].to_numpy(dtype=np.float64)
+        self.vol = df['vol'].to_numpy(dtype=np.float64)
+        self.amount = df['amount'].to_numpy(dtype=np.float64)
+
+        self.state_table = self.discretizer.transform(df)
+        self.state_shape = self.discretizer.shape
+
+    @classmethod
+    def from_data_handler(cls, data_handler):
+        """
+        基于DataHandler预加载的指数数据构造环境，不再重复读取指数文件
+        同一个DataHandler只构造一次，所有Agent共享（环境构造后只读）
+        """
+        env = getattr(data_handler, '_index_environment', None)
+        if env is None:
+            df = data_handler.index_data.reset_index()
+            df['trade_date'] = pd.to_datetime(df['trade_date'])
+            env = cls(df=df)
+            data_handler._index_environment = env
+        return env
+
+    def with_quantiles(self, quantiles):
+        """
+        返回使用给定分位点的环境副本（原环境不变）
+        分位点与当前一致时直接返回自身
+        """
+        if set(quantiles) == set(self.quantiles) and all(
+                np.array_equal(self.quantiles[name], quantiles[name]) for name in self.quantiles):
+            return self
+        env = copy.copy(self)
+        env.discretizer = self.discretizer.with_edges(quantiles)
+        env._build_state_table()
+        return env
+
+    def _locate(self, target_date):
+        """返回目标日期在状态表中的位置，不存在时返回-1"""
+        if isinstance(target_date, str):
+            target_date = pd.to_datetime(target_date, format='%Y%m%d')
+        pos = self.dates.searchsorted(target_date)
+        if pos < len(self.dates) and self.dates[pos] == target_date:
+            return pos
+        return -1
+
+    def get_state(self, target_date):
+        """
+        获取指定日期的离散化状态数组
+
+        返回:
+        np.ndarray: 各特征（discretizer.names）的档位，未找到日期时返回None
+        """
+        pos = self._locate(target_date)
+        return None if pos < 0 else self.state_table[pos]
 
     def get_discrete_data(self, target_date):
         """
@@ -59,45 +283,13 @@ class DiscreteIndexEnvironment:
         target_date: 目标日期，格式可以是字符串'YYYYMMDD'或datetime对象
 
         返回:
-        dict: 包含离散化后的指标数据
+        dict: {特征名: 档位}，特征为discretizer.names
         """
-        # 转换日期格式
-        if isinstance(target_date, str):
-            target_date = pd.to_datetime(target_date, format='%Y%m%d')
-
-        # 查找目标日期的数据
-        target_data = self.df[self.df['trade_date'] == target_date]
-
-        if target_data.empty:
+        state = self.get_state(target_date)
+        if state is None:
             return {"error": f"未找到日期 {target_date} 的数据"}
 
-        row = target_data.iloc[0]
-
-        # 计算目标日期的指标
-        high_low_ratio = (row['high'] - row['low']) / row['high']
-        close_open_volume = (row['close'] - row['open']) / row['vol']
-        amount = row['amount']
-
-        # 使用基准分位点进行离散化
-        def discretize_value(value, quantiles):
-            if value <= quantiles[0]:
-                return 1
-            elif value <= quantiles[1]:
-                return 2
-            elif value <= quantiles[2]:
-                return 3
-            elif value <= quantiles[3]:
-                return 4
-            else:
-                return 5
-
-        result = {
-            'high_low_rank': discretize_value(high_low_ratio, self.quantiles['high_low_ratio']),
-            'close_open_volume_rank': discretize_value(close_open_volume, self.quantiles['close_open_volume']),
-            'amount_rank': discretize_value(amount, self.quantiles['amount']),
-        }
-
-        return result
+        return {name: int(value) for name, value in zip(self.discretizer.names, state)}
 
     def get_date_range_data(self, start_date, end_date):
         """
@@ -107,7 +299,7 @@ class DiscreteIndexEnvironment:
         start_date, end_date: 开始和结束日期，格式可以是字符串'YYYYMMDD'或datetime对象
 
         返回:
-        DataFrame: 包含离散化后的指标数据
+        DataFrame: trade_date列及每个特征（discretizer.names）的档位列
         """
         # 转换日期格式
         if isinstance(start_date, str):
@@ -115,37 +307,92 @@ class DiscreteIndexEnvironment:
         if isinstance(end_date, str):
             end_date = pd.to_datetime(end_date, format='%Y%m%d')
 
-        # 获取日期范围内的数据
-        date_range_df = self.df[
-            (self.df['trade_date'] >= start_date) &
-            (self.df['trade_date'] <= end_date)
-            ].copy()
-
-        results = []
-        for _, row in date_range_df.iterrows():
-            result = self.get_discrete_data(row['trade_date'])
-            if 'error' not in result:
-                results.append({
-                    'trade_date': row['trade_date'],
-                    'high_low_rank': result['high_low_rank'],
-                    'close_open_volume_rank': result['close_open_volume_rank'],
-                    'amount_rank': result['amount_rank']
-                })
-
-        return pd.DataFrame(results)
+        lo = self.dates.searchsorted(start_date, side='left')
+        hi = self.dates.searchsorted(end_date, side='right')
+        states = self.state_table[lo:hi]
+        data = pd.DataFrame(states, columns=self.discretizer.names)
+        data.insert(0, 'trade_date', self.dates[lo:hi])
+        return data
+
+
+def _flat_states(ranks, shape):
+    """将(天数, 特征数)的档位表（取值从1开始）转换为价值函数的扁平下标"""
+    clipped = np.clip(ranks.astype(np.int64) - 1, 0, np.array(shape) - 1)
+    return np.ravel_multi_index(tuple(clipped.T), shape)
+
+
+def _epsilon_greedy(values, states, epsilons, rng):
+    """
+    向量化ε-贪心决策（价值为0时随机选择）
+
+    参数:
+    values: (配置数, 状态数) 价值函数
+    states: (天数,) 扁平状态下标
+    epsilons: (配置数,) 探索率
+    rng: np.random.Generator
+
+    返回:
+    (配置数, 天数) 动作数组（1=看多，0=看空）
+    """
+    n_configs, n_days = values.shape[0], len(states)
+    explore = rng.random((n_configs, n_days)) < epsilons[:, None]
+    random_actions = rng.integers(0, 2, size=(n_configs, n_days))
+    state_values = values[:, states]
+    greedy = np.where(state_values == 0, random_actions, (state_values > 0).astype(random_actions.dtype))
+    return np.where(explore, random_actions, greedy)
+
+
+def _td_sequence_update(values, states, rewards, alphas):
+    """
+    按时间顺序对访问过的状态执行 v[s] <- v[s] + α(r - v[s])，以闭式解一次完成
+
+    状态s依次被访问K次、奖励为r_1..r_K时，结果为
+    (1-α)^K * v0[s] + Σ_j α(1-α)^(K-j) * r_j，
+    因此只需计算每次访问之后同一状态还会被访问的次数，再按状态做加权求和。
+
+    参数:
+    values: (配置数, 状态数) 初始价值函数
+    states: (天数,) 每次更新的扁平状态下标
+    rewards: (配置数, 天数) 每次更新的奖励
+    alphas: (配置数,) 学习率
+
+    返回:
+    (配置数, 状态数) 更新后的价值函数
+    """
+    n_configs, n_states = values.shape
+    counts = np.bincount(states, minlength=n_states)
+
+    # 每次访问在同一状态的访问序列中的名次 -> 之后还剩余的访问次数
+    order = np.argsort(states, kind='stable')
+    group_start = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.empty(len(states), dtype=np.int64)
+    rank[order] = np.arange(len(states)) - group_start[states[order]]
+    remaining = counts[states] - rank - 1
+
+    keep = 1.0 - alphas[:, None]
+    weights = alphas[:, None] * keep ** remaining[None, :]
+    flat = (np.arange(n_configs)[:, None] * n_states + states[None, :]).ravel()
+    contribution = np.bincount(flat, weights=(weights * rewards).ravel(), minlength=n_configs * n_states)
+    return keep ** counts[None, :] * values + contribution.reshape(n_configs, n_states)
 
 
 # 马尔可夫环境下的判断机器
 class Agent():
-    def __init__(self, account, data_handler, Epsilon=0.1, Alpha=0.1):
-        # 使用与DataHandler相同的指数文件路径
-        file_path1 = r"D:\read\task\中证500指数_201801-202506.csv"
-        self.env = DiscreteIndexEnvironment(file_path1)
+    def __init__(self, account, data_handler, Epsilon=0.1, Alpha=0.1, seed=None):
+        if data_handler is not None and getattr(data_handler, 'index_data', None) is not None:
+            # 复用DataHandler预加载的指数数据，构造Agent不再产生文件读取
+            self.env = DiscreteIndexEnvironment.from_data_handler(data_handler)
+        else:
+            # 使用与DataHandler相同的指数文件路径
+            file_path1 = r"D:\read\task\中证500指数_201801-202506.csv"
+            self.env = DiscreteIndexEnvironment(file_path1)
         self.data_handler = data_handler
         self.account = account
-        self.value = np.zeros((5, 5, 5))  # 状态价值函数
+        self.value = make_value_table(self.env.state_shape)  # 状态价值函数（状态空间大时为稀疏表）
         self.Epsilon = Epsilon
         self.Alpha = Alpha
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)  # 独立随机数生成器，便于复现和并行
         self.pre_state = None
         self.pre_action = None
         self.current_state = None
@@ -158,125 +405,189 @@ class Agent():
         # 离线学习标记
         self.offline_learned = False
 
-    def offline_learn(self, start_date='20160102', end_date='20180101'):
+    @staticmethod
+    def model_file_name(start_date, end_date, epsilon, alpha, epochs=1, seed=None):
+        """按训练区间和学习参数生成价值表存档文件名"""
+        return f"agent_{start_date}_{end_date}_eps{epsilon}_alpha{alpha}_epochs{epochs}_seed{seed}.npz"
+
+    def save(self, file_path, **metadata):
+        """
+        保存价值表、学习计数、分位点和随机数状态到压缩的npz文件
+        先写临时文件再原子替换，多个进程同时保存同一文件也不会读到半截内容
+
+        参数:
+        file_path: 存档路径
+        metadata: 额外记录的元信息（如训练区间、学习参数）
+        """
+        metadata = dict(metadata, Epsilon=self.Epsilon, Alpha=self.Alpha, seed=self.seed)
+        directory = os.path.dirname(os.path.abspath(file_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        value_index, value_values = self.value.items()  # 只保存非零状态，稀疏表与稠密表格式一致
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                version=np.array(AGENT_FILE_VERSION),
+                value_shape=np.array(self.value.shape),
+                value_index=value_index,
+                value_values=value_values,
+                learning_updates=np.array(self.learning_updates),
+                total_reward=np.array(self.total_reward),
+                offline_learned=np.array(self.offline_learned),
+                rng_state=np.array(json.dumps(self.rng.bit_generator.state)),
+                metadata=np.array(json.dumps(metadata, default=str)),
+                **{f"quantile_{name}": values for name, values in self.env.quantiles.items()}
+            )
+        os.replace(tmp_path, file_path)
+        self.log.info("价值表已保存: %s", file_path)
+
+    def load(self, file_path):
+        """
+        从存档恢复价值表、学习计数、分位点和随机数状态
+
+        返回:
+        dict: 存档中的元信息
+        """
+        with np.load(file_path, allow_pickle=False) as data:
+            version = int(data['version'])
+            if version > AGENT_FILE_VERSION:
+                raise ValueError(f"价值表存档版本 {version} 高于当前支持的版本 {AGENT_FILE_VERSION}")
+
+            quantiles = {key[len('quantile_'):]: data[key] for key in data.files if key.startswith('quantile_')}
+            if version == 1:
+                # 第1版存档直接保存稠密的(5, 5, 5)价值数组
+                dense = data['value']
+                value_shape = dense.shape
+                value_index = np.flatnonzero(dense)
+                value_values = dense.reshape(-1)[value_index]
+            else:
+                value_shape = tuple(int(n) for n in data['value_shape'])
+                value_index = data['value_index']
+                value_values = data['value_values']
+
+            # 存档须与当前环境的状态特征一致：特征名相同，价值表形状与各特征的分箱数一致
+            names = self.env.discretizer.names
+            if set(quantiles) != set(names):
+                raise ValueError(f"价值表存档的状态特征 {sorted(quantiles)} 与当前环境的 {sorted(names)} 不一致")
+            expected_shape = tuple(len(quantiles[name]) + 1 for name in names)
+            if tuple(value_shape) != expected_shape:
+                raise ValueError(f"价值表存档的形状 {tuple(value_shape)} 与分位点对应的状态空间 {expected_shape} 不一致")
+
+            # 价值表只在相同的离散化分位点下有意义，分位点不同时切换到对应的环境副本
+            self.env = self.env.with_quantiles(quantiles)
+            self.value = make_value_table(value_shape)
+            self.value.put(value_index, value_values)
+            self.learning_updates = int(data['learning_updates'])
+            self.total_reward = float(data['total_reward'])
+            self.offline_learned = bool(data['offline_learned'])
+
+            rng = np.random.default_rng()
+            rng.bit_generator.state = json.loads(str(data['rng_state']))
+            self.rng = rng
+            metadata = json.loads(str(data['metadata']))
+
+        self.log.info("已加载价值表: %s", file_path)
+        return metadata
+
+    def warm_start(self, model_dir, start_date='20160102', end_date='20180101', epochs=1, epsilon=0.3, alpha=0.2):
+        """
+        从预训练价值表热启动：存档存在时直接加载，否则离线学习后保存
+        存档按训练区间和学习参数命名，不同参数互不覆盖
+        """
+        file_path = os.path.join(model_dir, self.model_file_name(start_date, end_date, epsilon, alpha, epochs,
+                                                                 self.seed))
+        if os.path.exists(file_path):
+            try:
+                self.load(file_path)
+                return
+            except Exception as e:
+                # 含存档与当前状态特征不一致（load抛出的ValueError）
+                self.log.warning("价值表存档加载失败，重新训练: %s", e)
+
+        self.offline_learn(start_date, end_date, epochs=epochs, epsilon=epsilon, alpha=alpha)
+        if self.offline_learned:
+            self.save(file_path, start_date=start_date, end_date=end_date, epochs=epochs,
+                      offline_epsilon=epsilon, offline_alpha=alpha)
+
+    def offline_learn(self, start_date='20160102', end_date='20180101', epochs=1, epsilon=0.3, alpha=0.2):
         """
         执行离线学习，使用指定日期范围内的历史数据训练价值函数
+        直接在预计算的状态表和指数收益率数组上运算，不再逐日查询DataFrame
+
+        参数:
+        start_date, end_date: 训练区间，格式'YYYYMMDD'
+        epochs: 在历史数据上重复训练的轮数，每轮的探索决策基于上一轮得到的价值函数
+        epsilon, alpha: 离线学习使用的探索率和学习率（高于在线学习）
         """
         if self.offline_learned:
             self.log.info("已完成离线学习，无需重复执行")
             return
 
-        self.log.info(f"开始离线学习，时间范围: {start_date} 至 {end_date}")
+        self.log.info("开始离线学习，时间范围: %s 至 %s", start_date, end_date)
 
         try:
-            # 转换日期格式
             start = pd.to_datetime(start_date, format='%Y%m%d')
             end = pd.to_datetime(end_date, format='%Y%m%d')
+            lo = self.env.dates.searchsorted(start, side='left')
+            hi = self.env.dates.searchsorted(end, side='right')
 
-            # 获取日期范围内的所有交易日
-            date_range = pd.date_range(start=start, end=end)
-            trading_dates = [date for date in date_range if date in self.env.df['trade_date'].values]
-
-            if not trading_dates:
+            if hi - lo < 2:
                 self.log.warning("离线学习期间没有找到有效的交易日期")
                 return
 
-            self.log.info(f"离线学习将使用 {len(trading_dates)} 个交易日数据")
-
-            # 初始化离线学习状态
-            self.pre_state = None
-            self.pre_action = None
-            temp_value = np.zeros_like(self.value)  # 临时价值函数，避免影响原始值
-            original_epsilon = self.Epsilon
-            original_alpha = self.Alpha
-
-            # 离线学习使用更高的探索率和学习率
-            self.Epsilon = 0.3  # 提高探索率
-            self.Alpha = 0.2  # 提高学习率
-
-            # 遍历每个交易日进行学习
-            for i in tqdm(range(len(trading_dates)), desc="离线学习进度"):
-                date = trading_dates[i]
-
-                # 获取当前状态
-                state = self.receive(date)
-                if state is None:
-                    continue
-
-                # 做出决策
-                action = self.decide(state)
-
-                # 如果不是第一个交易日，计算奖励并更新
-                if i > 0:
-                    # 获取前一天和当前天的指数数据计算奖励
-                    prev_date = trading_dates[i - 1]
-                    prev_index_data = self._get_index_data(prev_date)
-                    curr_index_data = self._get_index_data(date)
-
-                    if prev_index_data is None or curr_index_data is None:
-                        continue
-
-                    # 计算指数收益率作为奖励（简化版）
-                    index_return = (curr_index_data['close'] - prev_index_data['close']) / prev_index_data['close']
-
-                    # 基于动作调整奖励
-                    adjusted_reward = index_return if action == 1 else -index_return
-
-                    # 更新临时价值函数
-                    if self.pre_state is not None:
-                        pre_state_tuple = tuple(self.pre_state)
-                        current_value = temp_value[pre_state_tuple]
-                        new_value = current_value + self.Alpha * (adjusted_reward - current_value)
-                        temp_value[pre_state_tuple] = new_value
-                        self.learning_updates += 1
-                        self.total_reward += adjusted_reward
-
-                # 更新状态和动作
-                self.pre_state = state
-                self.pre_action = action
+            self.log.info("离线学习将使用 %s 个交易日数据，训练 %s 轮", hi - lo, epochs)
+
+            # 第i日的状态对应第i+1日的指数收益率
+            states = _flat_states(self.env.state_table[lo:hi], self.value.shape)
+            close = self.env.close[lo:hi]
+            index_returns = close[1:] / close[:-1] - 1
+
+            # 只在访问过的状态上运算，开销与状态空间大小无关
+            visited, states = np.unique(states, return_inverse=True)
+            states = states.reshape(-1)
+            policy = self.value.take(visited)  # 决策依据的价值函数（与原逐日实现一致，本轮内不变）
+            temp_value = np.zeros((1, len(visited)))  # 临时价值函数，避免影响原始值
+            alphas = np.array([alpha])
+            for _ in range(epochs):
+                # 向量化ε-贪心决策：第i+1日的动作决定第i日状态获得的奖励符号
+                actions = _epsilon_greedy(policy[None, :], states[1:], np.array([epsilon]), self.rng)[0]
+                rewards = np.where(actions == 1, index_returns, -index_returns)
+                temp_value = _td_sequence_update(temp_value, states[:-1], rewards[None, :], alphas)
+                policy = temp_value[0]
+
+                self.learning_updates += len(rewards)
+                self.total_reward += float(rewards.sum())
 
             # 离线学习完成，将临时价值函数赋值给正式价值函数
-            self.value = temp_value
+            value = make_value_table(self.value.shape)
+            value.put(visited, temp_value[0])
+            self.value = value
             self.offline_learned = True
 
-            # 恢复原始参数
-            self.Epsilon = original_epsilon
-            self.Alpha = original_alpha
-
             self.log.info("离线学习完成")
             self.print_learning_status()
 
         except Exception as e:
-            self.log.error(f"离线学习失败: {e}")
-        finally:
-            # 确保参数恢复
-            self.Epsilon = original_epsilon
-            self.Alpha = original_alpha
+            self.log.error("离线学习失败: %s", e)
 
     def _get_index_data(self, date):
         """获取指定日期的指数数据（辅助离线学习）"""
         try:
-            date_str = date.strftime('%Y%m%d')
-            data = self.env.get_discrete_data(date_str)
-            if 'error' in data:
-                return None
-
-            # 查找原始价格数据
-            target_data = self.env.df[self.env.df['trade_date'] == date]
-            if target_data.empty:
+            pos = self.env._locate(date)
+            if pos < 0:
                 return None
 
-            row = target_data.iloc[0]
+            env = self.env
             return {
-                'open': row['open'],
-                'high': row['high'],
-                'low': row['low'],
-                'close': row['close'],
-                'vol': row['vol'],
-                'amount': row['amount']
+                'open': float(env.open[pos]),
+                'high': float(env.high[pos]),
+                'low': float(env.low[pos]),
+                'close': float(env.close[pos]),
+                'vol': float(env.vol[pos]),
+                'amount': float(env.amount[pos])
             }
         except Exception as e:
-            self.log.error(f"获取指数数据失败: {e}")
+            self.log.error("获取指数数据失败: %s", e)
             return None
 
     def decide(self, state):
@@ -286,10 +597,10 @@ class Agent():
             return 1
 
         try:
-            if np.random.binomial(1, self.Epsilon):
+            if self.rng.random() < self.Epsilon:
                 # 探索：随机选择动作
-                action = np.random.randint(0, 2)
-                self.log.debug(f"探索决策: 状态{state} -> 动作{action}")
+                action = int(self.rng.integers(0, 2))
+                self.log.debug("探索决策: 状态%s -> 动作%s", state, action)
                 return action
             else:
                 # 利用：根据价值函数选择动作
@@ -298,37 +609,37 @@ class Agent():
 
                 # 如果价值相等，随机选择；否则选择价值高的动作
                 if state_value == 0:
-                    action = np.random.randint(0, 2)
+                    action = int(self.rng.integers(0, 2))
                 else:
                     action = 1 if state_value > 0 else 0
 
-                self.log.debug(f"利用决策: 状态{state} -> 价值{state_value:.4f} -> 动作{action}")
+                self.log.debug("利用决策: 状态%s -> 价值%.4f -> 动作%s", state, state_value, action)
                 return action
         except Exception as e:
-            self.log.error(f"决策错误: {e}")
+            self.log.error("决策错误: %s", e)
             return 1
 
     def receive(self, date):
         """接收环境状态 - 修复状态获取"""
         try:
-            # 获取离散化状态
-            result = self.env.get_discrete_data(date)
-            if 'error' not in result:
+            # 获取离散化状态（预计算状态表的数组查询）
+            ranks = self.env.get_state(date)
+            if ranks is not None:
                 # 确保状态值在有效范围内
-                state = [
-                    max(0, min(4, result['high_low_rank'] - 1)),
-                    max(0, min(4, result['close_open_volume_rank'] - 1)),
-                    max(0, min(4, result['amount_rank'] - 1))
-                ]
+                state = np.clip(ranks.astype(np.int64) - 1, 0, np.array(self.value.shape) - 1).tolist()
                 self.current_state = state
-                self.log.info(f"接收状态: 日期{date} -> 状态{state}")
+                self.log.info("接收状态: 日期%s -> 状态%s", date, state)
                 return state
             else:
-                self.log.warning(f"获取状态失败: {result['error']}, 使用中性状态")
-                return [2, 2, 2]  # 返回中性状态
+                self.log.warning("获取状态失败: 未找到日期 %s 的数据, 使用中性状态", date)
+                return self._neutral_state()  # 返回中性状态
         except Exception as e:
-            self.log.error(f"接收状态错误: {e}")
-            return [2, 2, 2]
+            self.log.error("接收状态错误: %s", e)
+            return self._neutral_state()
+
+    def _neutral_state(self):
+        """各特征取中间档位的中性状态"""
+        return [n // 2 for n in self.value.shape]
 
     def feedback(self, reward):
         """根据奖励更新价值函数 - 根据动作调整奖励"""
@@ -351,10 +662,11 @@ class Agent():
                 self.total_reward += adjusted_reward
 
                 self.log.info(
-                    f"学习更新: 状态{self.pre_state} 动作{self.pre_action} 原始奖励:{reward:.6f} 调整后奖励:{adjusted_reward:.6f} 价值{current_value:.6f} -> {new_value:.6f}")
+                    "学习更新: 状态%s 动作%s 原始奖励:%.6f 调整后奖励:%.6f 价值%.6f -> %.6f",
+                    self.pre_state, self.pre_action, reward, adjusted_reward, current_value, new_value)
 
             except Exception as e:
-                self.log.error(f"学习更新错误: {e}")
+                self.log.error("学习更新错误: %s", e)
         else:
             self.log.debug("没有先前状态，跳过学习")
 
@@ -364,27 +676,160 @@ class Agent():
     def get_learning_progress(self):
         """获取学习进度"""
         # 使用绝对值阈值来判断是否学习过
-        learned_states = np.sum(np.abs(self.value) > 1e-8)
+        learned_states = self._learned_states()[0].size
         total_states = self.value.size
         progress = learned_states / total_states
         return progress
 
+    def _learned_states(self):
+        """返回已学习状态的(扁平下标, 价值)"""
+        index, values = self.value.items()
+        learned = np.abs(values) > 1e-8
+        return index[learned], values[learned]
+
+    def get_learning_status(self, n_examples=3):
+        """
+        学习状态摘要
+        :param n_examples: 返回的已学习状态示例数
+        :return: dict，progress、learned_states、total_states、value_min、value_max、learning_updates、total_reward、examples
+        """
+        learned_index, learned_values = self._learned_states()
+        order = np.argsort(learned_index)[:n_examples]
+        return {
+            'progress': float(self.get_learning_progress()),
+            'learned_states': int(learned_index.size),
+            'total_states': int(self.value.size),
+            'value_min': float(self.value.min()),
+            'value_max': float(self.value.max()),
+            'learning_updates': int(self.learning_updates),
+            'total_reward': float(self.total_reward),
+            'examples': [
+                {'state': [int(n) for n in np.unravel_index(learned_index[i], self.value.shape)],
+                 'value': float(learned_values[i])}
+                for i in order
+            ],
+        }
+
     def print_learning_status(self):
         """打印学习状态"""
-        progress = self.get_learning_progress()
-        learned_states = np.sum(np.abs(self.value) > 1e-8)
-        total_states = self.value.size
+        status = self.get_learning_status()
 
-        print(f"学习进度: {progress:.2%} ({learned_states}/{total_states} 状态已学习)")
-        print(f"价值函数范围: [{self.value.min():.6f}, {self.value.max():.6f}]")
-        print(f"学习更新次数: {self.learning_updates}")
-        print(f"累计奖励: {self.total_reward:.6f}")
+        log.info("学习进度: %.2f%% (%s/%s 状态已学习)", status['progress'] * 100, status['learned_states'],
+                 status['total_states'])
+        log.info("价值函数范围: [%.6f, %.6f]", status['value_min'], status['value_max'])
+        log.info("学习更新次数: %s", status['learning_updates'])
+        log.info("累计奖励: %.6f", status['total_reward'])
 
         # 打印一些学习示例
-        non_zero_indices = np.where(np.abs(self.value) > 1e-8)
-        if len(non_zero_indices[0]) > 0:
-            print("学习示例:")
-            for i in range(min(3, len(non_zero_indices[0]))):
-                state = [non_zero_indices[0][i], non_zero_indices[1][i], non_zero_indices[2][i]]
-                value = self.value[tuple(state)]
-                print(f"  状态{state}: 价值{value:.6f}")
\ No newline at end of file
+        if status['examples']:
+            log.info("学习示例:")
+            for example in status['examples']:
+                log.info("  状态%s: 价值%.6f", example['state'], example['value'])
+
+
+# 超参数批量训练的判断机器
+class BatchedAgent:
+    def __init__(self, env, epsilons, alphas, seeds=0):
+        """
+        批量智能体：价值张量带前置配置维，所有(ε, α, seed)配置同时训练
+        价值张量为稠密存储，适用于状态空间较小的离散化配置
+
+        参数:
+        env: DiscreteIndexEnvironment实例（所有配置共享）
+        epsilons, alphas, seeds: 每个配置的探索率、学习率和随机种子，标量会广播到全部配置
+        """
+        self.env = env
+        self.epsilons, self.alphas, self.seeds = np.broadcast_arrays(
+            np.asarray(epsilons, dtype=np.float64),
+            np.asarray(alphas, dtype=np.float64),
+            np.asarray(seeds, dtype=np.int64)
+        )
+        self.epsilons = np.atleast_1d(self.epsilons).copy()
+        self.alphas = np.atleast_1d(self.alphas).copy()
+        self.seeds = np.atleast_1d(self.seeds).copy()
+        self.n_configs = len(self.epsilons)
+        self.value = np.zeros((self.n_configs,) + tuple(env.state_shape))  # 每个配置一张稠密状态价值表
+        self.learning_updates = 0
+        self.total_reward = np.zeros(self.n_configs)
+        self.log = logging.getLogger(__name__)
+
+        # 相同种子的配置共用一个随机数流（公共随机数），不同ε/α之间的比较更稳定
+        self._seed_groups = {int(seed): np.flatnonzero(self.seeds == seed) for seed in np.unique(self.seeds)}
+        self._rngs = {seed: np.random.default_rng(seed) for seed in self._seed_groups}
+
+    @classmethod
+    def from_grid(cls, env, epsilons, alphas, seeds=(0,)):
+        """由ε、α、seed网格的笛卡尔积构造批量智能体"""
+        grid_eps, grid_alpha, grid_seed = np.meshgrid(epsilons, alphas, seeds, indexing='ij')
+        return cls(env, grid_eps.ravel(), grid_alpha.ravel(), grid_seed.ravel())
+
+    def _window(self, start_date, end_date):
+        """取训练/评估区间内的扁平状态和次日指数收益率"""
+        start = pd.to_datetime(start_date, format='%Y%m%d')
+        end = pd.to_datetime(end_date, format='%Y%m%d')
+        lo = self.env.dates.searchsorted(start, side='left')
+        hi = self.env.dates.searchsorted(end, side='right')
+        states = _flat_states(self.env.state_table[lo:hi], self.value.shape[1:])
+        close = self.env.close[lo:hi]
+        return states, close[1:] / close[:-1] - 1
+
+    def _decide(self, values, states):
+        """按种子分组做向量化ε-贪心决策"""
+        actions = np.empty((self.n_configs, len(states)), dtype=np.int64)
+        for seed, members in self._seed_groups.items():
+            actions[members] = _epsilon_greedy(values[members], states, self.epsilons[members], self._rngs[seed])
+        return actions
+
+    def offline_learn(self, start_date='20160102', end_date='20180101', epochs=1):
+        """
+        所有配置同时执行离线学习（与Agent.offline_learn的更新规则一致）
+
+        参数:
+        start_date, end_date: 训练区间，格式'YYYYMMDD'
+        epochs: 在历史数据上重复训练的轮数
+        """
+        states, index_returns = self._window(start_date, end_date)
+        if len(index_returns) == 0:
+            self.log.warning("离线学习期间没有找到有效的交易日期")
+            return
+
+        values = self.value.reshape(self.n_configs, -1)
+        for _ in range(epochs):
+            actions = self._decide(values, states[1:])
+            rewards = np.where(actions == 1, index_returns[None, :], -index_returns[None, :])
+            values = _td_sequence_update(values, states[:-1], rewards, self.alphas)
+            self.learning_updates += rewards.shape[1]
+            self.total_reward += rewards.sum(axis=1)
+
+        self.value = values.reshape(self.value.shape)
+        self.log.info("批量离线学习完成: %s 个配置, %s 个交易日, %s 轮", self.n_configs, len(states), epochs)
+
+    def evaluate(self, start_date, end_date):
+        """
+        在指定区间评估每个配置的贪心策略（价值为0时默认看多）
+
+        返回:
+        np.ndarray: (配置数,) 按动作调整后的累计指数收益（看多取正、看空取负）
+        """
+        states, index_returns = self._window(start_date, end_date)
+        greedy = self.value.reshape(self.n_configs, -1)[:, states[:-1]] >= 0
+        return np.where(greedy, index_returns[None, :], -index_returns[None, :]).sum(axis=1)
+
+    def summary(self, start_date=None, end_date=None):
+        """
+        汇总所有配置的学习结果，给定区间时附带该区间的评估收益
+
+        返回:
+        DataFrame: 每行一个配置
+        """
+        flat_values = self.value.reshape(self.n_configs, -1)
+        result = pd.DataFrame({
+            'epsilon': self.epsilons,
+            'alpha': self.alphas,
+            'seed': self.seeds,
+            'learned_states': np.sum(np.abs(flat_values) > 1e-8, axis=1),
+            'total_reward': self.total_reward,
+        })
+        if start_date is not None and end_date is not None:
+            result['eval_reward'] = self.evaluate(start_date, end_date)
+        return result
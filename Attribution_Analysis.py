@@ -0,0 +1,216 @@
+import pandas as pd
+import numpy as np
+
+
+class HoldingsRecorder:
+    def __init__(self):
+        """
+        逐日记录持仓，结束后整理为紧凑的日期×股票int32矩阵
+        每日只保存持仓股票的列号和数量，股票列号在首次出现时分配
+        """
+        self.dates = []
+        self.securities = []
+        self._columns = {}
+        self._rows = []
+
+    def record(self, date, positions):
+        """记录当日收盘后的持仓 {股票代码: 数量}"""
+        columns = np.fromiter((self._column(code) for code in positions), dtype=np.int32, count=len(positions))
+        amounts = np.fromiter(positions.values(), dtype=np.int32, count=len(positions))
+        self.dates.append(pd.to_datetime(date))
+        self._rows.append((columns, amounts))
+
+    def _column(self, code):
+        """股票代码对应的列号"""
+        column = self._columns.get(code)
+        if column is None:
+            column = self._columns[code] = len(self.securities)
+            self.securities.append(code)
+        return column
+
+    def matrix(self):
+        """持仓矩阵 (天数, 股票数) int32"""
+        holdings = np.zeros((len(self._rows), len(self.securities)), dtype=np.int32)
+        if self._rows:
+            lengths = np.array([len(columns) for columns, _ in self._rows])
+            rows = np.repeat(np.arange(len(self._rows)), lengths)
+            holdings[rows, np.concatenate([c for c, _ in self._rows])] = np.concatenate([a for _, a in self._rows])
+        return holdings
+
+    def to_frame(self):
+        """持仓矩阵的DataFrame形式（行为日期，列为股票代码）"""
+        return pd.DataFrame(self.matrix(), index=pd.DatetimeIndex(self.dates), columns=list(self.securities))
+
+
+def daily_turnover(traded_value, total_assets, initial_cash):
+    """
+    每日换手率：当日成交额 / 昨日总资产（首日用初始资金）
+
+    参数:
+    traded_value: 每日成交额Series（按日期索引）
+    total_assets: 每日收盘总资产Series（按日期索引）
+    initial_cash: 初始资金
+    """
+    prev_assets = total_assets.shift(1).fillna(initial_cash)
+    return traded_value.reindex(total_assets.index).fillna(0) / prev_assets
+
+
+class PositionAttribution:
+    def __init__(self, holdings, close, trade_history, initial_cash, base_holdings=None, base_prices=None,
+                 benchmark_returns=None, benchmark_weights=None):
+        """
+        基于持仓矩阵的逐股票收益归因（全部为矩阵运算，不逐股票循环）
+
+        每日每只股票的盈亏 = 昨日持仓×收盘价变动 + 当日成交数量(买正卖负)×(收盘价-成交价)，
+        全部股票求和恰好等于总资产的日变动（不计手续费）。
+
+        参数:
+        holdings: 日期×股票的收盘持仓（HoldingsRecorder.to_frame()）
+        close: 与holdings同形状的收盘价面板
+        trade_history: Account.trade_history
+        initial_cash: 初始资金
+        base_holdings: 底仓 {股票代码: 数量}，用于区分底仓与做T的贡献
+        base_prices: 底仓建仓价格 {股票代码: 价格}
+        benchmark_returns: 基准日收益率Series（用于超额收益）
+        benchmark_weights: 基准成分股权重 {股票代码: 权重}（用于主动贡献）
+        """
+        self.dates = pd.DatetimeIndex(holdings.index)
+        self.securities = list(holdings.columns)
+        self.holdings = holdings.to_numpy(dtype=np.int64)
+        self.close = close.reindex(index=self.dates, columns=self.securities).to_numpy(dtype=np.float64)
+        self.initial_cash = initial_cash
+        self.benchmark_returns = benchmark_returns
+        self.benchmark_weights = benchmark_weights
+
+        self.traded_amount, self.traded_cost, self.traded_value = self._trade_panels(trade_history)
+        self.base = self._base_vector(base_holdings)
+        self.base_prices = self._base_vector(base_prices, dtype=np.float64)
+
+        self._pnl = None
+
+    def _trade_panels(self, trade_history):
+        """把成交记录汇总为日期×股票的净成交数量、净成交金额和成交额矩阵"""
+        shape = (len(self.dates), len(self.securities))
+        amount, cost, value = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        if not trade_history:
+            return amount, cost, value
+
+        trades = pd.DataFrame(trade_history)
+        rows = self.dates.get_indexer(pd.to_datetime(trades['date']))
+        cols = pd.Index(self.securities).get_indexer(trades['stock_code'])
+        valid = (rows >= 0) & (cols >= 0)
+        sign = np.where(trades['action'].to_numpy() == 'buy', 1.0, -1.0)
+        signed = (sign * trades['amount'].to_numpy(dtype=np.float64))[valid]
+        price = trades['price'].to_numpy(dtype=np.float64)[valid]
+
+        np.add.at(amount, (rows[valid], cols[valid]), signed)
+        np.add.at(cost, (rows[valid], cols[valid]), signed * price)
+        np.add.at(value, (rows[valid], cols[valid]), np.abs(signed) * price)
+        return amount, cost, value
+
+    def _base_vector(self, mapping, dtype=np.int64):
+        """把 {股票代码: 值} 映射为按列排列的向量"""
+        if not mapping:
+            return np.zeros(len(self.securities), dtype=dtype)
+        return pd.Series(mapping, dtype='float64').reindex(self.securities).fillna(0).to_numpy().astype(dtype)
+
+    def _previous(self, matrix, first_row):
+        """矩阵整体下移一行（昨日值），首行用first_row填充"""
+        return np.vstack([first_row[None, :], matrix[:-1]])
+
+    def get_pnl(self):
+        """每日每只股票的盈亏（日期×股票DataFrame）"""
+        if self._pnl is None:
+            close = np.nan_to_num(self.close)
+            prev_holdings = self._previous(self.holdings, np.zeros(len(self.securities), dtype=np.int64))
+            prev_close = self._previous(close, close[0] if len(close) else close)
+            pnl = prev_holdings * (close - prev_close) + self.traded_amount * close - self.traded_cost
+            self._pnl = pd.DataFrame(pnl, index=self.dates, columns=self.securities)
+        return self._pnl
+
+    def get_base_pnl(self):
+        """底仓贡献：持有底仓数量不动的盈亏（含建仓日相对建仓价的盈亏）"""
+        close = np.nan_to_num(self.close)
+        pnl = np.zeros_like(close)
+        if len(close) and self.base.any():
+            pnl[1:] = self.base * np.diff(close, axis=0)
+            pnl[0] = self.base * (close[0] - self.base_prices)
+        return pd.DataFrame(pnl, index=self.dates, columns=self.securities)
+
+    def get_t_pnl(self):
+        """做T贡献：总盈亏减去底仓贡献"""
+        return self.get_pnl() - self.get_base_pnl()
+
+    def get_total_assets(self):
+        """由盈亏还原的每日总资产"""
+        return self.initial_cash + self.get_pnl().sum(axis=1).cumsum()
+
+    def get_contribution(self):
+        """每日每只股票对组合收益率的贡献（盈亏/昨日总资产），各列之和为组合日收益率"""
+        assets = self.get_total_assets()
+        prev_assets = assets.shift(1).fillna(self.initial_cash)
+        return self.get_pnl().div(prev_assets, axis=0)
+
+    def get_active_contribution(self):
+        """
+        相对基准成分权重的主动贡献：组合贡献 - 基准权重×个股收益率
+        基准权重缺失时返回None
+        """
+        if not self.benchmark_weights:
+            return None
+        weights = pd.Series(self.benchmark_weights, dtype='float64').reindex(self.securities).fillna(0)
+        weights = weights / weights.sum() if weights.sum() > 0 else weights
+        close = pd.DataFrame(self.close, index=self.dates, columns=self.securities)
+        stock_returns = close.pct_change().fillna(0)
+        return self.get_contribution() - stock_returns * weights.to_numpy()
+
+    def get_turnover(self):
+        """每日换手率（成交额/昨日总资产）"""
+        return daily_turnover(pd.Series(self.traded_value.sum(axis=1), index=self.dates),
+                              self.get_total_assets(), self.initial_cash)
+
+    def get_excess_returns(self):
+        """组合相对基准的日超额收益率"""
+        if self.benchmark_returns is None:
+            return None
+        portfolio = self.get_contribution().sum(axis=1)
+        return portfolio - self.benchmark_returns.reindex(self.dates).fillna(0)
+
+    def get_security_summary(self):
+        """
+        逐股票汇总
+        :return: DataFrame，列为total_pnl、base_pnl、t_pnl、contribution、traded_value、avg_holding
+        """
+        pnl = self.get_pnl()
+        base = self.get_base_pnl()
+        summary = pd.DataFrame({
+            'total_pnl': pnl.sum(),
+            'base_pnl': base.sum(),
+            't_pnl': pnl.sum() - base.sum(),
+            'contribution': self.get_contribution().sum(),
+            'traded_value': pd.Series(self.traded_value.sum(axis=0), index=self.securities),
+            'avg_holding': pd.Series(self.holdings.mean(axis=0), index=self.securities),
+        })
+        active = self.get_active_contribution()
+        if active is not None:
+            summary['active_contribution'] = active.sum()
+        return summary.sort_values('total_pnl', ascending=False)
+
+    def get_daily_summary(self):
+        """
+        逐日汇总
+        :return: DataFrame，列为pnl、base_pnl、t_pnl、return、turnover（有基准时含excess_return）
+        """
+        pnl = self.get_pnl().sum(axis=1)
+        base = self.get_base_pnl().sum(axis=1)
+        summary = pd.DataFrame({
+            'pnl': pnl,
+            'base_pnl': base,
+            't_pnl': pnl - base,
+            'return': self.get_contribution().sum(axis=1),
+            'turnover': self.get_turnover(),
+        })
+        excess = self.get_excess_returns()
+        if excess is not None:
+            summary['excess_return'] = excess
+        return summary
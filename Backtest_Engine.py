@@ -1,15 +1,15 @@
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from Performance_Analysis import PerformanceAnalysis
+from Performance_Analysis import PerformanceAnalysis, StreamingMetrics
 from Visualization import BacktestVisualization
 from tqdm import tqdm
 import logging
 from Data_Handling import get_index_price, get_weight
+from trading_function import TradingFunctions
+from Attribution_Analysis import HoldingsRecorder, PositionAttribution
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-log = logging.getLogger(__name__)
+log = logging.getLogger(__name__)  # 日志由主程序通过Utilities.setup_logging统一配置
 
 
 class Account:
@@ -49,13 +49,13 @@ class Account:
             # log.info(f"[{date}] 买入 {stock_code}: {amount}股 @ {price:.2f}, 成本{total_cost:.2f}")
             return True
         else:
-            log.warning(f"[{date}] 买入失败: 资金不足 {self.cash:.2f} < {total_cost:.2f}")
+            log.warning("[%s] 买入失败: 资金不足 %.2f < %.2f", date, self.cash, total_cost)
             return False
 
     def sell(self, date, stock_code, price, amount):
         """卖出股票"""
         if stock_code not in self.positions or self.positions[stock_code] < amount:
-            log.warning(f"[{date}] 卖出失败: 持仓不足 {stock_code}")
+            log.warning("[%s] 卖出失败: 持仓不足 %s", date, stock_code)
             return False
 
         revenue = price * amount
@@ -84,16 +84,17 @@ class Account:
     def calculate_total_assets(self, date, stock_prices):
         """计算总资产（现金+持仓市值）"""
         position_value = 0
-        position_details = []
+        position_details = [] if log.isEnabledFor(logging.DEBUG) else None  # 只在DEBUG时拼接持仓明细
 
         for stock_code, amount in self.positions.items():
             if stock_code in stock_prices:
                 price = stock_prices[stock_code]
                 value = price * amount
                 position_value += value
-                position_details.append(f"{stock_code}:{amount}×{price:.2f}={value:.2f}")
+                if position_details is not None:
+                    position_details.append(f"{stock_code}:{amount}×{price:.2f}={value:.2f}")
             else:
-                log.warning(f"[{date}] 未获取到 {stock_code} 的价格数据，无法计算该股票市值")
+                log.warning("[%s] 未获取到 %s 的价格数据，无法计算该股票市值", date, stock_code)
 
         total = self.cash + position_value
         self.total_assets.append(total)
@@ -107,9 +108,9 @@ class Account:
         else:
             self.daily_returns.append(0.0)
 
-        log.info(f"[{date}] 总资产: {total:.2f} (现金: {self.cash:.2f}, 持仓: {position_value:.2f})")
+        log.info("[%s] 总资产: %.2f (现金: %.2f, 持仓: %.2f)", date, total, self.cash, position_value)
         if position_details:
-            log.debug(f"[{date}] 持仓明细: {', '.join(position_details)}")
+            log.debug("[%s] 持仓明细: %s", date, ', '.join(position_details))
 
         return total
 
@@ -118,14 +119,48 @@ class Account:
         return self.total_assets[-1] if self.total_assets else self.initial_cash
 
 
+class BacktestResult:
+    def __init__(self, params, dates, total_assets, metrics, trade_count, stopped_early=False, learning_status=None):
+        """
+        回测结果容器（只含可序列化的数据，便于在进程间传递和缓存）
+
+        参数:
+        params: 本次回测的策略参数
+        dates: 交易日列表
+        total_assets: 每日总资产
+        metrics: 绩效指标字典（StreamingMetrics.snapshot()，收益类指标为小数）
+        trade_count: 成交笔数
+        stopped_early: 是否因提前终止条件停止
+        learning_status: Agent学习状态
+        """
+        self.params = dict(params or {})
+        self.dates = pd.DatetimeIndex(dates)
+        self.total_assets = np.asarray(total_assets, dtype=np.float64)
+        self.metrics = dict(metrics)
+        self.trade_count = trade_count
+        self.stopped_early = stopped_early
+        self.learning_status = learning_status
+
+    def get_nav(self):
+        """总资产序列"""
+        return pd.Series(self.total_assets, index=self.dates)
+
+    def to_row(self):
+        """参数与指标合并为一行（用于汇总成结果表）"""
+        return {**self.params, **self.metrics, 'trade_count': self.trade_count, 'stopped_early': self.stopped_early}
+
+
 class BacktestEngine:
-    def __init__(self, data_handler, strategy_class, initial_cash=100000, max_stock_holdings=None):
+    def __init__(self, data_handler, strategy_class, initial_cash=100000, max_stock_holdings=None,
+                 strategy_params=None, record_holdings=False):
         """
         初始化回测引擎
         :param data_handler: 数据处理器
         :param strategy_class: 策略类
         :param initial_cash: 初始资金
         :param max_stock_holdings: 最大持股数量限制
+        :param strategy_params: 传给策略构造函数的关键字参数
+        :param record_holdings: 是否逐日记录持仓（用于逐股票收益归因）
         """
         self.data_handler = data_handler
         self.strategy_class = strategy_class
@@ -153,9 +188,18 @@ class BacktestEngine:
             }
         }
 
-        self.strategy = self.strategy_class(self.context)
+        # 每个引擎持有独立的下单接口（订单ID计数器互不共享）
+        self.trading_functions = TradingFunctions(self.context)
+        self.context['trading_functions'] = self.trading_functions
+
+        self.strategy_params = strategy_params or {}
+        self.strategy = self.strategy_class(self.context, **self.strategy_params)
         self.performance = None
         self.visualization = None
+        self.live_metrics = StreamingMetrics()  # 运行中逐日更新的绩效指标
+        self.stopped_early = False
+        self.last_date = None  # 最后处理的交易日（续跑起点）
+        self.holdings_recorder = HoldingsRecorder() if record_holdings else None
 
     def check_holding_limit(self):
         """检查是否达到最大持股数量限制"""
@@ -202,16 +246,16 @@ class BacktestEngine:
                         if not recent_data.empty:
                             stock_prices[stock_code] = recent_data[price_field].iloc[-1]
                         else:
-                            log.warning(f"[{date}] 无法获取 {stock_code} 的{price_type}价格，使用0计算")
+                            log.warning("[%s] 无法获取 %s 的%s价格，使用0计算", date, stock_code, price_type)
                             stock_prices[stock_code] = 0
                     except Exception as e:
-                        log.warning(f"[{date}] 获取 {stock_code} {price_type}价格失败: {e}")
+                        log.warning("[%s] 获取 %s %s价格失败: %s", date, stock_code, price_type, e)
                         stock_prices[stock_code] = 0
 
             return stock_prices
 
         except Exception as e:
-            log.error(f"[{date}] 获取股票{price_type}价格失败: {e}")
+            log.error("[%s] 获取股票%s价格失败: %s", date, price_type, e)
             return {}
 
     def _get_daily_open_prices(self, date):
@@ -219,8 +263,19 @@ class BacktestEngine:
         return self._get_daily_stock_prices(date, price_type='open')
 
     def _get_index_data(self, date):
-        """获取指数数据（开盘、最高、最低、收盘）- 复用策略类的指数表现获取逻辑"""
+        """获取指数数据（开盘、最高、最低、收盘）- 优先使用DataHandler预加载的指数数据"""
         try:
+            # 直接读取预加载指数数据中当日的记录（与Agent共享同一份数据）
+            index_frame = getattr(self.data_handler, 'index_data', None)
+            if index_frame is not None and date in index_frame.index:
+                row = index_frame.loc[date]
+                return {
+                    'open': float(row['open']),
+                    'high': float(row['high']),
+                    'low': float(row['low']),
+                    'close': float(row['close'])
+                }
+
             # 调用策略类中的 _get_index_performance 方法获取核心数据
             # 先获取策略实例中的指数高开低数据
             high_increase, low_decrease = self.strategy._get_index_performance(date)
@@ -251,17 +306,26 @@ class BacktestEngine:
                     }
 
             # 若所有方法均失败，返回默认值并记录警告
-            log.warning(f"[{date}] 无法获取指数数据（已尝试策略类的指数表现逻辑）")
+            log.warning("[%s] 无法获取指数数据（已尝试策略类的指数表现逻辑）", date)
             return {'open': 0, 'high': 0, 'low': 0, 'close': 0}
 
         except Exception as e:
-            log.error(f"[{date}] 获取指数数据失败: {e}")
+            log.error("[%s] 获取指数数据失败: %s", date, e)
             return {'open': 0, 'high': 0, 'low': 0, 'close': 0}
 
-    def run(self, start_date=None, end_date=None):
-        """运行回测"""
+    def run(self, start_date=None, end_date=None, stop_condition=None, report_path=None, analyze=True,
+            progress=True):
+        """
+        运行回测
+        :param start_date: 开始日期
+        :param end_date: 结束日期
+        :param stop_condition: 提前终止条件，接收StreamingMetrics，返回True时停止回测（如参数优化中淘汰明显差的参数）
+        :param report_path: 传入时把多面板报告写入该文件（PNG/SVG），不弹出图形窗口（适用于无界面服务器）
+        :param analyze: 是否在结束后做绩效分析、绘图和打印学习总结（批量回测时关闭，改用get_result()）
+        :param progress: 是否显示进度条
+        """
         log.info("开始回测...")
-        print(f"原始数据日期范围: {self.dates.min()} 至 {self.dates.max()}")
+        log.info("原始数据日期范围: %s 至 %s", self.dates.min(), self.dates.max())
 
         # 筛选交易日期
         if start_date and end_date:
@@ -269,8 +333,8 @@ class BacktestEngine:
             end_date = pd.to_datetime(end_date)
             mask = (self.dates >= start_date) & (self.dates <= end_date)
             trade_dates = self.dates[mask]
-            print(f"筛选后日期范围: {start_date} 至 {end_date}")
-            print(f"有效交易日数量: {len(trade_dates)}")
+            log.info("筛选后日期范围: %s 至 %s", start_date, end_date)
+            log.info("有效交易日数量: %s", len(trade_dates))
         else:
             trade_dates = self.dates
 
@@ -278,20 +342,40 @@ class BacktestEngine:
             raise ValueError("没有找到符合条件的交易日期，请检查日期范围是否在数据范围内")
 
         # 打印配置信息
-        print(f"初始资金: {self.account.initial_cash:,.2f}")
+        log.info("初始资金: %.2f", self.account.initial_cash)
         if self.max_stock_holdings:
-            print(f"最大持股数量限制: {self.max_stock_holdings}只")
+            log.info("最大持股数量限制: %s只", self.max_stock_holdings)
         else:
-            print("未设置最大持股数量限制")
+            log.info("未设置最大持股数量限制")
 
         # 初始化策略
         self.strategy.initialize()
-        print(f"回测开始日期: {trade_dates[0].strftime('%Y-%m-%d')}")
-        print(f"回测结束日期: {trade_dates[-1].strftime('%Y-%m-%d')}")
+        log.info("回测开始日期: %s", trade_dates[0].strftime('%Y-%m-%d'))
+        log.info("回测结束日期: %s", trade_dates[-1].strftime('%Y-%m-%d'))
 
         # 主回测循环
-        for i, date in enumerate(tqdm(trade_dates, desc="回测进度")):
-            log.info(f"\n=== 交易日 {i + 1}/{len(trade_dates)}: {date.strftime('%Y-%m-%d')} ===")
+        self._run_loop(trade_dates, stop_condition, progress)
+
+        log.info("回测完成!")
+        if not analyze:
+            return
+
+        # 性能分析
+        self._perform_analysis()
+
+        # 可视化结果
+        self._visualize_results(report_path)
+
+        # 打印学习总结
+        self._print_learning_summary()
+
+    def _run_loop(self, trade_dates, stop_condition=None, progress=True):
+        """逐日执行回测主循环"""
+        self.stopped_early = False
+        bar = tqdm(trade_dates, desc="回测进度", disable=not progress)
+        for i, date in enumerate(bar):
+            log.info("=== 交易日 %s/%s: %s ===", i + 1, len(trade_dates), date.strftime('%Y-%m-%d'))
+            self.last_date = date
 
             # 更新上下文
             self.context['current_dt'] = date
@@ -299,6 +383,12 @@ class BacktestEngine:
             self.context['portfolio']['current_holdings_count'] = len(self.account.positions)
 
             try:
+                # 0. 当日全市场截面（下单接口按此取价），并撮合此前挂入的开盘/限价/止损单
+                bars = self.data_handler.get_daily_bars(date)
+                self.context['current_bars'] = bars
+                if self.trading_functions.has_pending_orders():
+                    self.trading_functions.match_pending_orders(date, bars)
+
                 # 1. 开盘前：Agent接收状态并决策
                 self.strategy.before_market_open(date)
 
@@ -314,66 +404,141 @@ class BacktestEngine:
                 # 4. 获取当日收盘价并计算资产
                 close_prices = self._get_daily_stock_prices(date, price_type='close')
                 current_assets = self.account.calculate_total_assets(date, close_prices)
+                if self.holdings_recorder is not None:
+                    self.holdings_recorder.record(date, self.account.positions)
 
                 # 5. 为策略提供指数数据
                 index_data = self._get_index_data(date)
                 self.context['index_data'] = index_data
 
+                # 6. 在线更新绩效指标，进度条实时显示
+                self.live_metrics.update(date, current_assets, index_data.get('close'))
+                bar.set_postfix(sharpe=f"{self.live_metrics.sharpe_ratio:.2f}",
+                                mdd=f"{self.live_metrics.max_drawdown:.2%}", refresh=False)
+
                 # 打印当日总结
-                log.info(f"[{date}] 当日总结: 总资产={current_assets:,.2f}, 现金={self.account.cash:,.2f}, "
-                         f"持仓数量={len(self.account.positions)}, 当日收益率={self.account.daily_returns[-1]:.4f}")
+                log.info("[%s] 当日总结: 总资产=%.2f, 现金=%.2f, 持仓数量=%s, 当日收益率=%.4f", date, current_assets,
+                         self.account.cash, len(self.account.positions), self.account.daily_returns[-1])
 
             except Exception as e:
-                log.error(f"[{date}] 回测执行错误: {e}")
+                log.error("[%s] 回测执行错误: %s", date, e)
                 continue
 
-        print("回测完成!")
+            if stop_condition is not None and stop_condition(self.live_metrics):
+                log.warning("[%s] 满足提前终止条件，停止回测", date)
+                self.stopped_early = True
+                break
 
-        # 性能分析
-        self._perform_analysis()
+    def extend(self, end_date, stop_condition=None, report_path=None, analyze=False, progress=True):
+        """
+        从上次运行停止处续跑到更晚的结束日期（不重新初始化策略，账户、持仓和Agent学习状态延续）
+        :param end_date: 新的结束日期
+        :param stop_condition: 提前终止条件，同run()
+        :param report_path: 同run()
+        :param analyze: 是否在结束后做绩效分析、绘图和打印学习总结
+        :param progress: 是否显示进度条
+        """
+        if self.last_date is None:
+            raise RuntimeError("回测尚未运行，请先调用run()")
 
-        # 可视化结果
-        self._visualize_results()
+        end_date = pd.to_datetime(end_date)
+        trade_dates = self.dates[(self.dates > self.last_date) & (self.dates <= end_date)]
+        if len(trade_dates) == 0:
+            log.warning("%s 至 %s 之间没有新的交易日", self.last_date, end_date)
+            return
 
-        # 打印学习总结
-        self._print_learning_summary()
+        self._run_loop(trade_dates, stop_condition, progress)
+        if analyze:
+            self._perform_analysis()
+            self._visualize_results(report_path)
+            self._print_learning_summary()
 
     def _perform_analysis(self):
         """执行性能分析"""
         try:
             self.performance = PerformanceAnalysis(self.account)
-            print("\n=== 回测性能分析 ===")
-            print(f"最终资产: {self.account.get_current_assets():,.2f}")
-            print(f"总收益率: {self.performance.total_return:.2%}")
-            print(f"年化收益率: {self.performance.annual_return:.2%}")
-            print(f"最大回撤: {self.performance.max_drawdown:.2%}")
-            print(f"夏普比率: {self.performance.sharpe_ratio:.2f}")
+            log.info("=== 回测性能分析 ===")
+            log.info("最终资产: %.2f", self.account.get_current_assets())
+            log.info("总收益率: %.2f%%", self.performance.total_return * 100)
+            log.info("年化收益率: %.2f%%", self.performance.annual_return * 100)
+            log.info("最大回撤: %.2f%%", self.performance.max_drawdown * 100)
+            log.info("夏普比率: %.2f", self.performance.sharpe_ratio)
         except Exception as e:
-            log.error(f"性能分析失败: {e}")
+            log.error("性能分析失败: %s", e)
 
-    def _visualize_results(self):
+    def _visualize_results(self, report_path=None):
         """可视化回测结果"""
         try:
             self.visualization = BacktestVisualization(
                 self.account,
-                self.performance.strategy_returns if self.performance else []
+                self.performance.strategy_returns if self.performance else [],
+                performance=self.performance
             )
-            self.visualization.plot_results()
+            self.visualization.plot_results(save_path=report_path)
             self.visualization.print_performance()
         except Exception as e:
-            log.error(f"可视化失败: {e}")
+            log.error("可视化失败: %s", e)
 
     def _print_learning_summary(self):
         """打印学习总结"""
         try:
             if hasattr(self.strategy, 'print_learning_summary'):
-                print("\n=== Agent学习总结 ===")
+                log.info("=== Agent学习总结 ===")
                 self.strategy.print_learning_summary()
             else:
-                print("\n=== 策略执行完成 ===")
-                print("注意: 策略未提供学习总结功能")
+                log.info("=== 策略执行完成 ===")
+                log.info("注意: 策略未提供学习总结功能")
         except Exception as e:
-            log.error(f"打印学习总结失败: {e}")
+            log.error("打印学习总结失败: %s", e)
+
+    def get_result(self):
+        """
+        获取本次回测的结果容器
+        :return: BacktestResult
+        """
+        agent = getattr(self.strategy, 'agent', None)
+        return BacktestResult(
+            params=getattr(self.strategy, 'params', self.strategy_params),
+            dates=self.account.dates,
+            total_assets=self.account.total_assets,
+            metrics=self.live_metrics.snapshot(),
+            trade_count=len(self.account.trade_history),
+            stopped_early=self.stopped_early,
+            learning_status=agent.get_learning_status() if hasattr(agent, 'get_learning_status') else None,
+        )
+
+    def get_attribution(self, benchmark_returns=None, benchmark_weights=None):
+        """
+        逐股票收益归因（需以record_holdings=True运行回测）
+        :param benchmark_returns: 基准日收益率，默认使用预加载的指数数据
+        :param benchmark_weights: 基准成分股权重 {股票代码: 权重}，默认使用预加载的权重数据
+        :return: PositionAttribution
+        """
+        if self.holdings_recorder is None:
+            raise RuntimeError("未记录持仓，请以record_holdings=True创建回测引擎")
+
+        holdings = self.holdings_recorder.to_frame()
+        # 当日买入又全部卖出的股票不会出现在收盘持仓中，补齐列以保留其成交盈亏
+        traded = pd.Index([t['stock_code'] for t in self.account.trade_history]).unique()
+        holdings = holdings.reindex(columns=holdings.columns.append(traded.difference(holdings.columns)),
+                                    fill_value=0)
+        close = self.data_handler.get_price_panel(holdings.columns, holdings.index, field='close')
+
+        if benchmark_returns is None:
+            index_frame = getattr(self.data_handler, 'index_data', None)
+            if index_frame is not None:
+                benchmark_returns = index_frame['close'].pct_change()
+        if benchmark_weights is None:
+            benchmark_weights = getattr(self.data_handler, 'weights_data', None)
+
+        g = getattr(self.strategy, 'g', None)
+        return PositionAttribution(
+            holdings, close, self.account.trade_history, self.account.initial_cash,
+            base_holdings=getattr(g, 'initial_half_pos', None),
+            base_prices=getattr(g, 'initial_prices', None),
+            benchmark_returns=benchmark_returns,
+            benchmark_weights=benchmark_weights,
+        )
 
     def get_trade_history(self):
         """获取交易历史"""
@@ -398,9 +563,9 @@ class BacktestEngine:
             portfolio_df = self.get_portfolio_history()
             portfolio_df.to_csv(f"{file_path}_portfolio.csv", index=False)
 
-            log.info(f"回测结果已保存到: {file_path}_*.csv")
+            log.info("回测结果已保存到: %s_*.csv", file_path)
         except Exception as e:
-            log.error(f"保存结果失败: {e}")
+            log.error("保存结果失败: %s", e)
 
 
 
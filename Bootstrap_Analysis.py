@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from Performance_Analysis import underwater_curve
+
+
+def stationary_bootstrap_indices(n, n_resamples, mean_block=20, rng=None):
+    """
+    平稳自助法(Politis-Romano)重采样下标矩阵，一次生成全部样本
+    每个位置以1/mean_block的概率开始新区块（起点随机），否则延续上一位置+1（循环）
+
+    返回:
+    (n_resamples, n) 整数下标矩阵
+    """
+    rng = np.random.default_rng(rng)
+    positions = np.arange(n)
+    new_block = rng.random((n_resamples, n)) < 1.0 / mean_block
+    new_block[:, 0] = True
+    starts = rng.integers(0, n, size=(n_resamples, n))
+    block_origin = np.maximum.accumulate(np.where(new_block, positions[None, :], 0), axis=1)
+    origin_start = np.take_along_axis(starts, block_origin, axis=1)
+    return (origin_start + positions[None, :] - block_origin) % n
+
+
+def block_bootstrap_indices(n, n_resamples, block_size=20, rng=None):
+    """
+    固定长度的循环区块自助法重采样下标矩阵
+
+    返回:
+    (n_resamples, n) 整数下标矩阵
+    """
+    rng = np.random.default_rng(rng)
+    positions = np.arange(n)
+    n_blocks = -(-n // block_size)
+    starts = rng.integers(0, n, size=(n_resamples, n_blocks))
+    return (starts[:, positions // block_size] + positions % block_size) % n
+
+
+def resampled_metrics(returns, periods_per_year=252):
+    """
+    对重采样后的收益率矩阵向量化计算指标
+    :param returns: (样本数, 天数) 日收益率
+    :return: dict，sharpe、annual_return、max_drawdown（小数）
+    """
+    n_days = returns.shape[1]
+    std = returns.std(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.nan_to_num(returns.mean(axis=1) / std * np.sqrt(periods_per_year))
+    nav = np.cumprod(1 + returns, axis=1)
+    annual_return = nav[:, -1] ** (periods_per_year / n_days) - 1
+    # 回撤从初始净值1算起，首日亏损也计入
+    nav = np.concatenate([np.ones((len(nav), 1)), nav], axis=1)
+    max_drawdown = -np.minimum(underwater_curve(nav).min(axis=1), 0)
+    return {'sharpe': sharpe, 'annual_return': annual_return, 'max_drawdown': max_drawdown}
+
+
+def _bootstrap_chunk(strategy, benchmark, n_resamples, seed, method, block_size, periods_per_year):
+    """生成一批重采样并计算指标（进程池任务）"""
+    rng = np.random.default_rng(seed)
+    if method == 'stationary':
+        index = stationary_bootstrap_indices(len(strategy), n_resamples, block_size, rng)
+    else:
+        index = block_bootstrap_indices(len(strategy), n_resamples, block_size, rng)
+
+    result = resampled_metrics(strategy[index], periods_per_year)
+    if benchmark is not None:
+        # 策略与基准使用同一组下标，保留两者的同期相关性
+        benchmark_metrics = resampled_metrics(benchmark[index], periods_per_year)
+        result['benchmark_sharpe'] = benchmark_metrics['sharpe']
+        result['benchmark_annual_return'] = benchmark_metrics['annual_return']
+        result['sharpe_diff'] = result['sharpe'] - benchmark_metrics['sharpe']
+        result['excess_annual_return'] = result['annual_return'] - benchmark_metrics['annual_return']
+    return result
+
+
+class BootstrapAnalysis:
+    def __init__(self, strategy_returns, benchmark_returns=None, method='stationary', block_size=20,
+                 periods_per_year=252):
+        """
+        策略指标的区块自助法置信区间与显著性检验
+
+        参数:
+        strategy_returns: 策略日收益率Series或数组
+        benchmark_returns: 基准日收益率（可选，Series时按日期与策略对齐）
+        method: 'stationary'平稳自助法（几何分布区块长度）或'block'固定区块
+        block_size: 平均/固定区块长度（交易日），用于保留收益率的自相关
+        periods_per_year: 年化使用的交易日数
+        """
+        if isinstance(strategy_returns, pd.Series) and isinstance(benchmark_returns, pd.Series):
+            strategy_returns, benchmark_returns = strategy_returns.align(benchmark_returns, join='inner')
+        self.strategy = np.asarray(strategy_returns, dtype=np.float64)
+        self.benchmark = None if benchmark_returns is None else np.asarray(benchmark_returns, dtype=np.float64)
+        self.method = method
+        self.block_size = block_size
+        self.periods_per_year = periods_per_year
+        self.samples = None
+
+    def run(self, n_resamples=5000, seed=None, n_workers=None, chunk_size=1000):
+        """
+        生成重采样并计算全部指标
+        :param n_resamples: 重采样次数
+        :param seed: 随机种子（各分块的种子由其派生，结果与n_workers无关）
+        :param n_workers: 进程数，None或1时在当前进程计算
+        :param chunk_size: 每块的重采样数量，控制下标矩阵的内存占用
+        :return: DataFrame，每行一个重采样样本的指标
+        """
+        sizes = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        args = (self.strategy, self.benchmark)
+        options = (self.method, self.block_size, self.periods_per_year)
+
+        if n_workers and n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = [pool.submit(_bootstrap_chunk, *args, size, child, *options)
+                           for size, child in zip(sizes, seeds)]
+                parts = [future.result() for future in futures]
+        else:
+            parts = [_bootstrap_chunk(*args, size, child, *options) for size, child in zip(sizes, seeds)]
+
+        self.samples = pd.DataFrame({key: np.concatenate([part[key] for part in parts]) for key in parts[0]})
+        return self.samples
+
+    def point_estimates(self):
+        """原始序列上的指标"""
+        returns = self.strategy[None, :]
+        result = {key: float(value[0]) for key, value in resampled_metrics(returns, self.periods_per_year).items()}
+        if self.benchmark is not None:
+            benchmark = resampled_metrics(self.benchmark[None, :], self.periods_per_year)
+            result['benchmark_sharpe'] = float(benchmark['sharpe'][0])
+            result['benchmark_annual_return'] = float(benchmark['annual_return'][0])
+            result['sharpe_diff'] = result['sharpe'] - result['benchmark_sharpe']
+            result['excess_annual_return'] = result['annual_return'] - result['benchmark_annual_return']
+        return result
+
+    def confidence_intervals(self, level=0.95):
+        """
+        百分位置信区间
+        :param level: 置信水平
+        :return: DataFrame，行为指标，列为point、lower、upper
+        """
+        if self.samples is None:
+            self.run()
+        tail = (1 - level) / 2
+        quantiles = self.samples.quantile([tail, 1 - tail])
+        return pd.DataFrame({
+            'point': pd.Series(self.point_estimates()),
+            'lower': quantiles.iloc[0],
+            'upper': quantiles.iloc[1],
+        })
+
+    def p_values(self):
+        """
+        单侧检验 H0: 差值=0，H1: 策略优于基准（差值>0）
+        把重采样差值减去原始序列上的差值，得到以0为中心的零假设分布，
+        p值为零假设分布中不小于原始差值的比例（分子分母各加1，避免p值为0）
+        :return: dict，sharpe_diff和excess_annual_return的p值
+        """
+        if self.benchmark is None:
+            raise ValueError("未提供基准收益率，无法进行显著性检验")
+        if self.samples is None:
+            self.run()
+        point = self.point_estimates()
+        result = {}
+        for key in ('sharpe_diff', 'excess_annual_return'):
+            null = self.samples[key].to_numpy() - point[key]
+            result[key] = float((1 + np.sum(null >= point[key])) / (1 + len(null)))
+        return result
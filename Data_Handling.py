@@ -1,12 +1,28 @@
 # file:D:\read\task\Data_Handling.py
 import pandas as pd
 import os
+import logging
 import numpy as np
 from datetime import datetime
 
+log = logging.getLogger(__name__)
+
 # 全局数据处理器实例，避免重复加载
 _data_handler_instance = None
 
+# CSMAR字段名与tushare字段名的对应关系（价格数据统一存储为tushare字段名）
+CSMAR_TO_TUSHARE_FIELDS = {
+    'Opnprc': 'open',  # 开盘价
+    'Hiprc': 'high',  # 最高价
+    'Loprc': 'low',  # 最低价
+    'Clsprc': 'close',  # 收盘价
+}
+
+
+def resolve_field(field):
+    """将CSMAR字段名转换为tushare字段名，其他字段名原样返回"""
+    return CSMAR_TO_TUSHARE_FIELDS.get(field, field)
+
 
 def get_data_handler(file_path=None, index_file_path=None):
     """获取全局数据处理器实例"""
@@ -16,6 +32,12 @@ def get_data_handler(file_path=None, index_file_path=None):
     return _data_handler_instance
 
 
+def set_data_handler(data_handler):
+    """把已创建的DataHandler设为全局实例（如参数优化中供各试验和子进程共享）"""
+    global _data_handler_instance
+    _data_handler_instance = data_handler
+
+
 # 对外提供的查询接口，内部使用全局数据处理器
 def get_price(security, start_date=None, end_date=None, fields=None, count=None):
     dh = get_data_handler()
@@ -70,6 +92,16 @@ class DataHandler:
         self.index_data = None  # 预加载的指数数据
         self._preload_data()  # 初始化时预加载所有数据
 
+    def __reduce__(self):
+        """
+        全局实例序列化为对进程内全局实例的引用，不复制预加载数据
+        （回测引擎等对象在进程间传递时，由接收进程的全局实例提供数据；
+        接收进程尚无全局实例时按相同的文件路径加载一次并设为全局实例）
+        """
+        if self is _data_handler_instance:
+            return get_data_handler, (self.file_path, self.index_file_path)
+        return super().__reduce__()
+
     def _preload_data(self):
         """预加载所有股票数据和权重数据到内存"""
         # 加载股票价格数据
@@ -118,7 +150,7 @@ class DataHandler:
                 df['con_code'] = df['con_code'].astype(str)
                 self.weights_data = df.set_index('con_code')['weight'].to_dict()
             except Exception as e:
-                print(f"权重数据加载警告: {str(e)}")
+                log.warning("权重数据加载警告: %s", e)
                 self.weights_data = {}
         else:
             self.weights_data = {}
@@ -126,44 +158,41 @@ class DataHandler:
     def _preload_index_data(self):
         """预加载指数数据到内存"""
         if not os.path.exists(self.index_file_path):
-            print(f"指数数据文件不存在: {self.index_file_path}")
+            log.warning("指数数据文件不存在: %s", self.index_file_path)
             self.index_data = None
             return
 
         try:
             # 读取CSV文件
             df = pd.read_csv(self.index_file_path)
-            print(f"原始指数数据列: {df.columns.tolist()}")
+            log.info("原始指数数据列: %s", df.columns.tolist())
 
             # 处理日期列 - 根据实际数据格式
             if 'trade_date' in df.columns:
                 # 将YYYYMMDD格式的日期转换为datetime
                 df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d')
                 df = df.set_index('trade_date').sort_index()
-                print(f"预加载指数数据成功，日期范围: {df.index.min()} 至 {df.index.max()}")
+                log.info("预加载指数数据成功，日期范围: %s 至 %s", df.index.min(), df.index.max())
             else:
-                print("警告: 指数数据文件中没有找到'trade_date'列")
-                print(f"可用列: {df.columns.tolist()}")
+                log.warning("指数数据文件中没有找到'trade_date'列，可用列: %s", df.columns.tolist())
                 self.index_data = None
                 return
 
             self.index_data = df
-            print(f"预加载指数数据成功，共 {len(df)} 条记录")
-            print(f"指数数据列: {df.columns.tolist()}")
+            log.info("预加载指数数据成功，共 %s 条记录", len(df))
+            log.info("指数数据列: %s", df.columns.tolist())
 
             # 检查是否有2022-09-08的数据
             target_date = pd.to_datetime('2022-09-08')
             if target_date in self.index_data.index:
-                print(f"找到目标日期 {target_date} 的指数数据")
+                log.info("找到目标日期 %s 的指数数据", target_date)
             else:
-                print(f"警告: 未找到目标日期 {target_date} 的指数数据")
-                print(
-                    f"最接近的日期: {self.index_data.index[self.index_data.index <= target_date][-1] if len(self.index_data.index[self.index_data.index <= target_date]) > 0 else '无'}")
+                previous_dates = self.index_data.index[self.index_data.index <= target_date]
+                log.warning("未找到目标日期 %s 的指数数据，最接近的日期: %s", target_date,
+                            previous_dates[-1] if len(previous_dates) > 0 else '无')
 
         except Exception as e:
-            print(f"指数数据加载错误: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("指数数据加载错误: %s", e)
             self.index_data = None
 
     def get_previous_trading_day(self, current_date):
@@ -192,6 +221,33 @@ class DataHandler:
         except KeyError:
             return pd.Series([np.nan], index=[None])
 
+    def get_daily_bars(self, date):
+        """获取某一天所有股票的完整K线截面（索引为股票代码）"""
+        date = pd.to_datetime(date)
+        try:
+            return self.all_stock_data.loc[date]
+        except KeyError:
+            return self.all_stock_data.iloc[0:0].reset_index(level='trade_date', drop=True)
+
+    def get_price_panel(self, securities, dates, field='close', fill=True):
+        """
+        获取日期×股票的价格面板（用于向量化计算）
+        :param securities: 股票代码列表（面板列顺序）
+        :param dates: 交易日列表（面板行顺序）
+        :param field: 价格字段，支持CSMAR字段名
+        :param fill: 是否用此前最近的价格填充停牌缺失值
+        :return: DataFrame，行为日期，列为股票代码
+        """
+        dates = pd.DatetimeIndex(dates)
+        column = self.all_stock_data[resolve_field(field)]
+        column = column[column.index.get_level_values('ts_code').isin(list(securities))]
+        if len(dates):
+            column = column.loc[:dates.max()]
+        panel = column.unstack('ts_code').reindex(columns=list(securities))
+        if fill:
+            panel = panel.ffill()
+        return panel.reindex(dates)
+
     def get_price(self, security, start_date=None, end_date=None, fields=None, count=None):
         """
         从内存中查询股票价格数据
@@ -216,11 +272,12 @@ class DataHandler:
         if end_date:
             filtered = filtered[filtered.index.get_level_values('trade_date') <= end_date]
 
-        # 字段过滤
+        # 字段过滤（CSMAR字段名映射为tushare字段名，返回时保留调用方使用的名称）
         available_fields = ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount']
         if fields:
-            valid_fields = [f for f in fields if f in available_fields]
-            filtered = filtered[valid_fields]
+            valid_fields = [f for f in fields if resolve_field(f) in available_fields]
+            filtered = filtered[[resolve_field(f) for f in valid_fields]]
+            filtered.columns = valid_fields
 
         # 限制返回数量
         if count and count > 0:
@@ -238,21 +295,26 @@ class DataHandler:
 
     def get_index_price(self, start_date, end_date, fields):
         """获取中证500指数价格数据"""
-        # 读取CSV文件
-        df = pd.read_csv(r"C:\Users\chanpi\Desktop\task\中证500指数_201601-202506.csv")
-
-        # 关键修复1：使用实际日期列名'trade_date'
-        if 'trade_date' in df.columns:
-            # 关键修复2：显式指定格式为'YYYYMMDD'，确保解析正确
-            df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d', errors='coerce')
-            # 移除解析失败的无效日期
-            df = df.dropna(subset=['trade_date'])
-
-            # 按日期筛选（使用正确的列名）
-            start = pd.to_datetime(start_date)
-            end = pd.to_datetime(end_date)
-            mask = (df['trade_date'] >= start) & (df['trade_date'] <= end)
-            df = df.loc[mask]
+        start = pd.to_datetime(start_date)
+        end = pd.to_datetime(end_date)
+        # 预加载的指数数据完整覆盖查询区间（起止日期都在范围内）时直接使用，避免每次重新读取文件
+        if (self.index_data is not None and start is not None and end is not None
+                and self.index_data.index.min() <= start and end <= self.index_data.index.max()):
+            df = self.index_data.loc[start:end].reset_index()
+        else:
+            # 读取CSV文件
+            df = pd.read_csv(r"C:\Users\chanpi\Desktop\task\中证500指数_201601-202506.csv")
+
+            # 关键修复1：使用实际日期列名'trade_date'
+            if 'trade_date' in df.columns:
+                # 关键修复2：显式指定格式为'YYYYMMDD'，确保解析正确
+                df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d', errors='coerce')
+                # 移除解析失败的无效日期
+                df = df.dropna(subset=['trade_date'])
+
+                # 按日期筛选（使用正确的列名）
+                mask = (df['trade_date'] >= start) & (df['trade_date'] <= end)
+                df = df.loc[mask]
 
         # 字段筛选（保持不变）
         if fields and len(fields) > 0:
@@ -262,8 +324,7 @@ class DataHandler:
 
         # 若筛选后无数据，打印警告（便于调试）
         if df.empty:
-            import logging
-            logging.warning(f"[{start_date}] 无法获取指数数据（日期范围或格式错误）")
+            log.warning("[%s] 无法获取指数数据（日期范围或格式错误）", start_date)
 
         return df
     def get_index_data_for_date(self, date):
@@ -275,7 +336,7 @@ class DataHandler:
             date = pd.to_datetime(date)
 
             if self.index_data is None:
-                print(f"警告: 指数数据未加载，无法获取 {date} 的数据")
+                log.warning("指数数据未加载，无法获取 %s 的数据", date)
                 return {'open': 0, 'high': 0, 'low': 0, 'close': 0}
 
             # 直接使用索引获取单日数据
@@ -298,20 +359,18 @@ class DataHandler:
 
                 return result
             else:
-                print(f"警告: 未找到日期 {date} 的指数数据")
+                log.warning("未找到日期 %s 的指数数据", date)
                 # 尝试找到最接近的日期
                 previous_dates = self.index_data.index[self.index_data.index <= date]
                 if len(previous_dates) > 0:
                     closest_date = previous_dates[-1]
-                    print(f"使用最接近的日期: {closest_date}")
+                    log.info("使用最接近的日期: %s", closest_date)
                     return self.get_index_data_for_date(closest_date)
                 else:
                     return {'open': 0, 'high': 0, 'low': 0, 'close': 0}
 
         except Exception as e:
-            print(f"获取指定日期指数数据错误: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("获取指定日期指数数据错误: %s", e)
             return {'open': 0, 'high': 0, 'low': 0, 'close': 0}
 
     def get_index_close_price(self, date):
@@ -322,5 +381,5 @@ class DataHandler:
             index_data = self.get_index_data_for_date(date)
             return index_data.get('close', 0)
         except Exception as e:
-            print(f"获取指数收盘价错误: {e}")
+            log.error("获取指数收盘价错误: %s", e)
             return 0
\ No newline at end of file
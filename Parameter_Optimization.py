@@ -1,2 +1,462 @@
-Epsilon=0.1
-Alpha=0.5
\ No newline at end of file
+import os
+import sys
+import time
+import atexit
+import logging
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from Data_Handling import get_data_handler, set_data_handler
+from Backtest_Engine import BacktestEngine
+from Strategy_Core import WeightBasedStrategy, DEFAULT_PARAMS
+from Result_Cache import ResultCache
+from Work_Queue import WorkQueue
+
+log = logging.getLogger(__name__)
+
+# Agent学习参数（模块原有常量，保持不变；策略的默认值见DEFAULT_PARAMS，其中alpha为0.1）
+Epsilon = 0.1
+Alpha = 0.5
+
+
+class Uniform:
+    def __init__(self, low, high, log=False, grid_points=5):
+        """
+        连续参数的取值范围
+        :param low, high: 上下界
+        :param log: 是否在对数尺度上均匀采样（适用于学习率等跨数量级的参数）
+        :param grid_points: 网格搜索时在区间内取的点数
+        """
+        self.low = low
+        self.high = high
+        self.log = log
+        self.grid_points = grid_points
+
+    def sample(self, rng, size):
+        """随机采样size个值"""
+        if self.log:
+            return np.exp(rng.uniform(np.log(self.low), np.log(self.high), size))
+        return rng.uniform(self.low, self.high, size)
+
+    def grid(self):
+        """网格取值"""
+        if self.log:
+            return np.geomspace(self.low, self.high, self.grid_points)
+        return np.linspace(self.low, self.high, self.grid_points)
+
+
+class ParameterSpace:
+    def __init__(self, **dimensions):
+        """
+        策略参数的搜索空间
+        每个维度为取值列表（离散）或Uniform（连续）；参数名须为DEFAULT_PARAMS中的键，未列出的参数取默认值
+
+        示例:
+        ParameterSpace(high_trigger=[0.003, 0.005, 0.008], alpha=Uniform(0.01, 0.5, log=True))
+        """
+        unknown = set(dimensions) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise ValueError(f"未知的策略参数: {sorted(unknown)}")
+        self.dimensions = dimensions
+
+    def grid(self):
+        """全部网格组合（连续维度按Uniform.grid取点）"""
+        names = list(self.dimensions)
+        values = [list(d.grid()) if isinstance(d, Uniform) else list(d) for d in self.dimensions.values()]
+        return [{name: _scalar(v) for name, v in zip(names, combo)} for combo in itertools.product(*values)]
+
+    def sample(self, n_trials, seed=0):
+        """随机采样n_trials组参数（相同seed结果相同）"""
+        rng = np.random.default_rng(seed)
+        columns = {}
+        for name, dimension in self.dimensions.items():
+            if isinstance(dimension, Uniform):
+                columns[name] = dimension.sample(rng, n_trials)
+            else:
+                choices = list(dimension)
+                columns[name] = [choices[i] for i in rng.integers(0, len(choices), n_trials)]
+        return [{name: _scalar(columns[name][i]) for name in columns} for i in range(n_trials)]
+
+
+def _scalar(value):
+    """numpy标量转为Python标量（参数字典可读、可序列化）"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# 对全部硬编码常数的默认搜索空间
+DEFAULT_SEARCH_SPACE = ParameterSpace(
+    high_trigger=[0.003, 0.005, 0.008, 0.01],
+    low_trigger=[0.003, 0.005, 0.008, 0.01],
+    sell_markup=[1.003, 1.005, 1.008],
+    buy_markdown=[0.992, 0.995, 0.997],
+    half_ratio=[0.3, 0.5, 0.7],
+    epsilon=Uniform(0.01, 0.3, log=True),
+    alpha=Uniform(0.01, 0.5, log=True),
+    reward_scale=[1, 10, 100],
+)
+
+
+def trial_seeds(n_trials, seed=0):
+    """每个试验的随机种子：由基础种子派生，与试验分配到哪个进程无关"""
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_trials)]
+
+
+def _init_worker(file_path, index_file_path, quiet):
+    """
+    工作进程初始化：共享预加载数据
+    fork启动时直接继承父进程已加载的全局DataHandler（写时复制，不重复读取）；
+    其他启动方式下在每个进程内加载一次
+    """
+    if quiet:
+        devnull = open(os.devnull, 'w')
+        atexit.register(devnull.close)
+        sys.stdout = devnull
+        logging.disable(logging.WARNING)
+    if get_data_handler() is None:
+        get_data_handler(file_path, index_file_path)
+
+
+# 进程内复用的结果缓存 {(缓存目录, 容量): ResultCache}，使缓存大小的增量统计跨试验保留
+_caches = {}
+
+
+def _get_cache(cache_dir, max_bytes):
+    """当前进程中该缓存目录对应的ResultCache（首次使用时创建）"""
+    key = (os.path.abspath(cache_dir), max_bytes)
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = ResultCache(cache_dir, max_bytes)
+    return cache
+
+
+def run_trial(trial, start_date, end_date, initial_cash=100000, strategy_kwargs=None, cache_dir=None,
+              cache_max_bytes=1 << 30):
+    """
+    在当前进程中运行一次回测试验
+    :param trial: dict，含trial_id、params、seed
+    :param cache_dir: 结果缓存目录，设置后相同参数、种子、区间、代码和数据的试验直接读取缓存
+    :param cache_max_bytes: 缓存容量上限
+    :return: dict，试验编号、种子、参数、指标和耗时（出错时含error）
+    """
+    started = time.time()
+    row = {'trial_id': trial['trial_id'], 'seed': trial['seed']}
+    try:
+        strategy_params = {**(strategy_kwargs or {}), 'params': trial['params'], 'seed': trial['seed']}
+
+        def backtest():
+            engine = BacktestEngine(get_data_handler(), WeightBasedStrategy, initial_cash=initial_cash,
+                                    strategy_params=strategy_params)
+            engine.run(start_date, end_date, analyze=False, progress=False)
+            return engine.get_result()
+
+        if cache_dir:
+            cache = _get_cache(cache_dir, cache_max_bytes)
+            full_params = {**DEFAULT_PARAMS, **trial['params']}
+            key = cache.make_key(full_params, start_date, end_date, get_data_handler(), seed=trial['seed'],
+                                 initial_cash=initial_cash, strategy_kwargs=strategy_kwargs or {})
+            result = cache.get(key)
+            row['cached'] = result is not None
+            if result is None:
+                result = backtest()
+                cache.put(key, result)
+        else:
+            result = backtest()
+        row.update(result.to_row())
+    except Exception as e:
+        row.update(trial['params'])
+        row['error'] = str(e)
+    row['elapsed'] = time.time() - started
+    return row
+
+
+class ParameterOptimizer:
+    def __init__(self, data_handler, start_date, end_date, space=None, initial_cash=100000, n_workers=None,
+                 seed=0, strategy_kwargs=None, quiet=True, cache_dir=None, cache_max_bytes=1 << 30):
+        """
+        基于进程池的参数网格/随机搜索
+
+        参数:
+        data_handler: 已预加载数据的DataHandler（作为进程内全局实例供各试验共享）
+        start_date, end_date: 回测区间
+        space: ParameterSpace，默认DEFAULT_SEARCH_SPACE
+        initial_cash: 初始资金
+        n_workers: 进程数，None或1时在当前进程顺序运行
+        seed: 基础随机种子（随机采样和每个试验的Agent种子都由它派生）
+        strategy_kwargs: 传给WeightBasedStrategy的其他参数（如agent_model_dir）
+        quiet: 是否屏蔽工作进程的打印和日志输出
+        cache_dir: 结果缓存目录（ResultCache），重复运行时只计算新的参数点
+        cache_max_bytes: 缓存容量上限（字节），超过后按LRU淘汰
+        """
+        self.data_handler = data_handler
+        self.start_date = start_date
+        self.end_date = end_date
+        self.space = space or DEFAULT_SEARCH_SPACE
+        self.initial_cash = initial_cash
+        self.n_workers = n_workers
+        self.seed = seed
+        self.strategy_kwargs = strategy_kwargs or {}
+        self.quiet = quiet
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.results = None
+
+        # 试验在子进程中通过get_data_handler()取数据，确保全局实例就是传入的这一个
+        set_data_handler(data_handler)
+
+    def make_trials(self, param_list):
+        """为参数列表编号并分配确定性种子"""
+        seeds = trial_seeds(len(param_list), self.seed)
+        return [{'trial_id': i, 'params': params, 'seed': seed}
+                for i, (params, seed) in enumerate(zip(param_list, seeds))]
+
+    def grid_search(self, objective='sharpe_ratio'):
+        """遍历搜索空间的全部网格组合"""
+        return self.run_trials(self.space.grid(), objective)
+
+    def random_search(self, n_trials, objective='sharpe_ratio'):
+        """在搜索空间中随机采样n_trials组参数"""
+        return self.run_trials(self.space.sample(n_trials, self.seed), objective)
+
+    def run_trials(self, param_list, objective='sharpe_ratio'):
+        """
+        运行一批参数试验并汇总成结果表
+        :param param_list: 参数字典列表
+        :param objective: 结果表的排序指标（降序）
+        :return: DataFrame，每行一次试验（参数+指标）
+        """
+        trials = self.make_trials(param_list)
+        args = (self.start_date, self.end_date, self.initial_cash, self.strategy_kwargs, self.cache_dir,
+                self.cache_max_bytes)
+
+        if self.n_workers and self.n_workers > 1:
+            # 优先fork，子进程直接继承已加载的数据
+            methods = multiprocessing.get_all_start_methods()
+            mp_context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            initargs = (self.data_handler.file_path, self.data_handler.index_file_path, self.quiet)
+            with ProcessPoolExecutor(max_workers=self.n_workers, mp_context=mp_context,
+                                     initializer=_init_worker, initargs=initargs) as pool:
+                futures = [pool.submit(run_trial, trial, *args) for trial in trials]
+                rows = [future.result() for future in futures]
+        else:
+            rows = [run_trial(trial, *args) for trial in trials]
+        return self._summarize(rows, objective)
+
+    def _summarize(self, rows, objective):
+        """试验结果行 -> 按目标指标排序的结果表"""
+        results = pd.DataFrame(rows).set_index('trial_id').sort_index()
+        if objective in results.columns:
+            results = results.sort_values(objective, ascending=False)
+        self.results = results
+        return results
+
+    def shard(self, param_list, queue_dir, lease_seconds=300, max_attempts=3):
+        """
+        把试验写入共享目录的工作队列，由任意多台机器上的工作进程运行（python Work_Queue.py 队列目录 --workers N）
+        工作进程按数据文件路径各自加载数据，多机运行时数据文件需在各机器上位于相同路径
+        :param param_list: 参数字典列表
+        :param queue_dir: 队列目录（共享文件系统）
+        :param lease_seconds: 租约时长，工作进程超过该时间没有心跳则任务重新入队
+        :param max_attempts: 每个试验最多尝试次数
+        :return: WorkQueue
+        任务编号取试验内容的哈希（同ResultCache.make_key：参数、种子、区间、初始资金、代码和数据），
+        向同一队列再次写入相同的试验会被跳过，不同的试验即使trial_id相同也会作为新任务加入
+        """
+        queue = WorkQueue(queue_dir, lease_seconds, max_attempts)
+        queue.set_setup(_init_worker, (os.path.abspath(self.data_handler.file_path),
+                                       os.path.abspath(self.data_handler.index_file_path), self.quiet))
+        args = (self.start_date, self.end_date, self.initial_cash, self.strategy_kwargs, self.cache_dir,
+                self.cache_max_bytes)
+        added = sum(queue.put(self._task_id(trial), run_trial, (trial,) + args)
+                    for trial in self.make_trials(param_list))
+        log.info("已写入%s个试验到队列 %s", added, queue_dir)
+        return queue
+
+    def _task_id(self, trial):
+        """试验在工作队列中的编号：试验内容的哈希"""
+        return ResultCache.make_key({**DEFAULT_PARAMS, **trial['params']}, self.start_date, self.end_date,
+                                    self.data_handler, seed=trial['seed'], initial_cash=self.initial_cash,
+                                    strategy_kwargs=self.strategy_kwargs or {})
+
+    def collect(self, queue_dir, objective='sharpe_ratio', wait=True, poll_interval=5.0, timeout=None):
+        """
+        汇总工作队列中的试验结果（失败的试验以error列记录）
+        同一队列目录写入过多批试验时返回全部批次，trial_id为各批内的编号，可用task_id列区分
+        :param wait: 是否等待全部试验结束（等待期间回收过期租约）
+        :param timeout: 最长等待秒数，超时后只汇总已完成的部分
+        :return: DataFrame，同run_trials，另含task_id列
+        """
+        queue = WorkQueue(queue_dir)
+        if wait and not queue.wait(poll_interval, timeout):
+            log.warning("等待超时，队列状态: %s", queue.status())
+        results = queue.results()
+        rows = [{**row, 'task_id': task_id} for task_id, row in results.items()]
+        # 租约过期后原进程仍完成了的试验，以结果为准
+        for task_id, (error, args) in queue.failures(with_args=True).items():
+            if task_id in results:
+                continue
+            trial = args[0] if args else {}
+            rows.append({'trial_id': trial.get('trial_id'), 'seed': trial.get('seed'), **trial.get('params', {}),
+                         'task_id': task_id, 'error': error})
+        if not rows:
+            return None
+        return self._summarize(rows, objective)
+
+    def best(self, objective='sharpe_ratio'):
+        """结果表中目标指标最优的参数"""
+        if self.results is None or self.results.empty:
+            return None
+        row = self.results.sort_values(objective, ascending=False).iloc[0]
+        return {name: _scalar(row[name]) for name in DEFAULT_PARAMS if name in row.index}
+
+
+# 越小越好的指标（淘汰时按升序排序）
+LOWER_IS_BETTER = {'max_drawdown', 'volatility', 'drawdown'}
+
+
+class DrawdownStop:
+    def __init__(self, limit):
+        """回撤超过limit（小数）时提前终止回测的条件（可序列化，可传入工作进程）"""
+        self.limit = limit
+
+    def __call__(self, metrics):
+        return metrics.max_drawdown > self.limit
+
+
+def advance_candidate(candidate, start_date, end_date, initial_cash=100000, strategy_kwargs=None,
+                      stop_condition=None):
+    """
+    把一个候选参数的回测推进到end_date：首轮新建引擎运行，之后在原引擎上续跑
+    :param candidate: dict，含trial_id、params、seed，以及上一轮的engine（首轮为None）
+    :return: (candidate, row)，candidate中engine已更新，row为当前的参数+指标
+    """
+    started = time.time()
+    row = {'trial_id': candidate['trial_id'], 'seed': candidate['seed']}
+    try:
+        engine = candidate.get('engine')
+        if engine is None:
+            strategy_params = {**(strategy_kwargs or {}), 'params': candidate['params'], 'seed': candidate['seed']}
+            engine = BacktestEngine(get_data_handler(), WeightBasedStrategy, initial_cash=initial_cash,
+                                    strategy_params=strategy_params)
+            engine.run(start_date, end_date, stop_condition=stop_condition, analyze=False, progress=False)
+        else:
+            engine.extend(end_date, stop_condition=stop_condition, progress=False)
+        candidate['engine'] = engine
+        row.update(engine.get_result().to_row())
+    except Exception as e:
+        candidate['engine'] = None
+        row.update(candidate['params'])
+        row['error'] = str(e)
+    row['elapsed'] = time.time() - started
+    return candidate, row
+
+
+class SuccessiveHalving(ParameterOptimizer):
+    def __init__(self, data_handler, start_date, rung_end_dates, space=None, initial_cash=100000, n_workers=None,
+                 seed=0, strategy_kwargs=None, quiet=True, keep_fraction=0.5, objective='excess_return',
+                 max_drawdown=None):
+        """
+        逐轮淘汰（successive halving）的参数搜索：全部候选先跑最短区间，按中期指标淘汰后段，
+        存活者在原回测上续跑到下一轮的结束日期，直到最后一轮
+
+        参数:
+        rung_end_dates: 各轮的结束日期（递增），最后一个即完整回测的结束日期
+        keep_fraction: 每轮保留的比例
+        objective: 淘汰依据的指标（StreamingMetrics.snapshot()中的键，如excess_return、sharpe_ratio、max_drawdown）
+        max_drawdown: 回撤上限（小数），运行中超过即提前终止并淘汰
+        其余参数同ParameterOptimizer
+        """
+        super().__init__(data_handler, start_date, rung_end_dates[-1], space=space, initial_cash=initial_cash,
+                         n_workers=n_workers, seed=seed, strategy_kwargs=strategy_kwargs, quiet=quiet)
+        self.rung_end_dates = list(rung_end_dates)
+        self.keep_fraction = keep_fraction
+        self.objective = objective
+        self.stop_condition = DrawdownStop(max_drawdown) if max_drawdown is not None else None
+        self.history = []  # 每轮的结果表
+        self.survivors = []  # 最后一轮存活的候选（含回测引擎）
+
+    def grid_search(self, objective=None):
+        """对网格全部组合做逐轮淘汰"""
+        return self.run_trials(self.space.grid(), objective)
+
+    def random_search(self, n_trials, objective=None):
+        """对n_trials组随机参数做逐轮淘汰"""
+        return self.run_trials(self.space.sample(n_trials, self.seed), objective)
+
+    def run_trials(self, param_list, objective=None):
+        """
+        逐轮运行并淘汰
+        :param param_list: 参数字典列表
+        :param objective: 淘汰依据的指标，默认使用构造时的objective
+        :return: DataFrame，每个候选最后到达的轮次（rung）及当时的参数+指标
+        """
+        objective = objective or self.objective
+        candidates = [dict(trial, engine=None) for trial in self.make_trials(param_list)]
+        final_rows = {}
+        self.history = []
+
+        pool = None
+        if self.n_workers and self.n_workers > 1:
+            methods = multiprocessing.get_all_start_methods()
+            mp_context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            initargs = (self.data_handler.file_path, self.data_handler.index_file_path, self.quiet)
+            pool = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=mp_context,
+                                       initializer=_init_worker, initargs=initargs)
+        try:
+            for rung, end_date in enumerate(self.rung_end_dates):
+                args = (self.start_date, end_date, self.initial_cash, self.strategy_kwargs, self.stop_condition)
+                if pool is not None:
+                    # 引擎在进程间传递时DataHandler只序列化为对全局实例的引用
+                    futures = [pool.submit(advance_candidate, candidate, *args) for candidate in candidates]
+                    outcomes = [future.result() for future in futures]
+                else:
+                    outcomes = [advance_candidate(candidate, *args) for candidate in candidates]
+
+                candidates = [candidate for candidate, _ in outcomes]
+                rows = pd.DataFrame([row for _, row in outcomes]).set_index('trial_id')
+                rows['rung'] = rung
+                rows['end_date'] = pd.to_datetime(end_date)
+                self.history.append(rows)
+                for trial_id, row in rows.iterrows():
+                    final_rows[trial_id] = row
+
+                if rung == len(self.rung_end_dates) - 1:
+                    break
+                candidates = self._select(candidates, rows, objective)
+                log.info("第%s轮(%s)结束，保留%s/%s个候选", rung + 1, end_date, len(candidates), len(rows))
+                if not candidates:
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.survivors = candidates
+        results = pd.DataFrame.from_dict(final_rows, orient='index')
+        results.index.name = 'trial_id'
+        ascending = objective in LOWER_IS_BETTER
+        if objective in results.columns:
+            results = results.sort_values(['rung', objective], ascending=[False, ascending])
+        self.results = results
+        return results
+
+    def _select(self, candidates, rows, objective):
+        """淘汰出错和提前终止的候选，再按指标保留前keep_fraction"""
+        valid = pd.Series(True, index=rows.index)
+        if 'stopped_early' in rows.columns:
+            valid &= ~rows['stopped_early'].fillna(True).astype(bool)  # 出错的行没有该字段，同样淘汰
+        if 'error' in rows.columns:
+            valid &= rows['error'].isna()
+        scores = rows.loc[valid, objective]
+        n_keep = max(1, int(np.ceil(len(rows) * self.keep_fraction)))
+        keep = set(scores.sort_values(ascending=objective in LOWER_IS_BETTER).index[:n_keep])
+        return [candidate for candidate in candidates if candidate['trial_id'] in keep]
+
+    def best(self, objective=None):
+        """最后一轮中指标最优的参数"""
+        objective = objective or self.objective
+        if self.results is None or self.results.empty:
+            return None
+        last = self.results[self.results['rung'] == self.results['rung'].max()]
+        row = last.sort_values(objective, ascending=objective in LOWER_IS_BETTER).iloc[0]
+        return {name: _scalar(row[name]) for name in DEFAULT_PARAMS if name in row.index}
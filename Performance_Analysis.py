@@ -1,10 +1,141 @@
+import logging
 import pandas as pd
 import numpy as np
 
+log = logging.getLogger(__name__)
+
+
+def underwater_curve(nav):
+    """
+    计算水下曲线（相对历史最高净值的回撤，取值<=0）
+    支持一维净值序列，也支持(曲线数, 天数)的二维数组，沿最后一维计算
+    """
+    nav = np.asarray(nav, dtype=np.float64)
+    peak = np.maximum.accumulate(nav, axis=-1)
+    return nav / peak - 1
+
+
+def drawdown_details(nav):
+    """
+    一次性计算回撤的全部统计量（基于运行最大值的数组运算）
+
+    参数:
+    nav: 一维净值数组
+
+    返回:
+    dict: max_drawdown（小数）、peak/trough/recovery位置（未恢复时recovery为None）、
+          最长水下期的长度和起止位置、underwater水下曲线
+    """
+    nav = np.asarray(nav, dtype=np.float64)
+    underwater = underwater_curve(nav)
+    trough = int(np.argmin(underwater))
+    peak = int(np.argmax(nav[:trough + 1]))
+    recovered = np.flatnonzero(nav[trough:] >= nav[peak])
+    recovery = trough + int(recovered[0]) if len(recovered) else None
+
+    # 最长水下期：连续underwater<0的最长区间
+    below = np.concatenate([[False], underwater < 0, [False]])
+    edges = np.flatnonzero(np.diff(below.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]  # 区间为[start, end)
+    if len(starts):
+        longest = int(np.argmax(ends - starts))
+        underwater_start, underwater_end = int(starts[longest]), int(ends[longest])
+    else:
+        underwater_start = underwater_end = 0
+
+    return {
+        'max_drawdown': float(-underwater[trough]),
+        'peak': peak,
+        'trough': trough,
+        'recovery': recovery,
+        'longest_underwater': underwater_end - underwater_start,
+        'longest_underwater_start': underwater_start,
+        'longest_underwater_end': underwater_end,
+        'underwater': underwater,
+    }
+
+
+def rolling_sum(x, window):
+    """
+    沿最后一维计算滑动窗口和（基于累加和，一次完成所有窗口）
+    返回与x等长的数组，前window-1个位置为NaN
+    """
+    x = np.asarray(x, dtype=np.float64)
+    csum = np.cumsum(x, axis=-1)
+    result = np.full(x.shape, np.nan)
+    result[..., window - 1] = csum[..., window - 1]
+    result[..., window:] = csum[..., window:] - csum[..., :-window]
+    return result
+
+
+def rolling_metrics(strategy_returns, benchmark_returns, window, periods_per_year=252):
+    """
+    基于累加和向量化计算相对基准的滚动风险指标
+
+    参数:
+    strategy_returns: 策略日收益率Series
+    benchmark_returns: 基准日收益率Series（按日期与策略对齐，只保留共同日期）
+    window: 滚动窗口长度（交易日）
+    periods_per_year: 年化使用的交易日数
+
+    返回:
+    DataFrame: 按日期索引，列为sharpe、volatility、beta、alpha、tracking_error、
+               information_ratio、up_capture、down_capture（年化指标均为小数）
+    """
+    strategy_returns, benchmark_returns = strategy_returns.align(benchmark_returns, join='inner')
+    index = strategy_returns.index
+    s = strategy_returns.to_numpy(dtype=np.float64)
+    b = benchmark_returns.to_numpy(dtype=np.float64)
+    if len(s) < window or window < 2:
+        return pd.DataFrame(index=index, columns=['sharpe', 'volatility', 'beta', 'alpha', 'tracking_error',
+                                                   'information_ratio', 'up_capture', 'down_capture'],
+                            dtype='float64')
+
+    # 先整体去均值再做累加，减小大数相减的精度损失（协方差不受平移影响）
+    s_shift, b_shift = s.mean(), b.mean()
+    sc, bc = s - s_shift, b - b_shift
+    d = sc - bc
+
+    sum_s, sum_b, sum_d = rolling_sum(sc, window), rolling_sum(bc, window), rolling_sum(d, window)
+    mean_s, mean_b, mean_d = sum_s / window + s_shift, sum_b / window + b_shift, sum_d / window + (s_shift - b_shift)
+    var_s = (rolling_sum(sc * sc, window) - sum_s ** 2 / window) / (window - 1)
+    var_b = (rolling_sum(bc * bc, window) - sum_b ** 2 / window) / (window - 1)
+    var_d = (rolling_sum(d * d, window) - sum_d ** 2 / window) / (window - 1)
+    cov_sb = (rolling_sum(sc * bc, window) - sum_s * sum_b / window) / (window - 1)
+
+    std_s = np.sqrt(np.maximum(var_s, 0))
+    std_d = np.sqrt(np.maximum(var_d, 0))
+    annual = np.sqrt(periods_per_year)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = cov_sb / var_b
+        sharpe = mean_s / std_s * annual
+        information_ratio = mean_d / std_d * annual
+
+        # 上行/下行捕获率：基准上涨（下跌）日策略平均收益 / 基准平均收益
+        up, down = (b > 0).astype(np.float64), (b < 0).astype(np.float64)
+        up_capture = rolling_sum(s * up, window) / rolling_sum(b * up, window)
+        down_capture = rolling_sum(s * down, window) / rolling_sum(b * down, window)
+
+    return pd.DataFrame({
+        'sharpe': sharpe,
+        'volatility': std_s * annual,
+        'beta': beta,
+        'alpha': (mean_s - beta * mean_b) * periods_per_year,
+        'tracking_error': std_d * annual,
+        'information_ratio': information_ratio,
+        'up_capture': up_capture,
+        'down_capture': down_capture,
+    }, index=index)
+
 
 class PerformanceAnalysis:
-    def __init__(self, account):
+    def __init__(self, account, benchmark_returns=None):
+        """
+        :param account: 回测账户
+        :param benchmark_returns: 基准日收益率Series（按日期索引），不提供时使用DataHandler预加载的中证500指数
+        """
         self.account = account
+        self.benchmark_returns = benchmark_returns
         self.strategy_returns = None
         self.cumulative_returns = None
         self.cumulative_net_assets = None
@@ -72,27 +203,88 @@ class PerformanceAnalysis:
         excess_returns = self.strategy_returns - risk_free_rate / 252  # 假设252个交易日
         return excess_returns.mean() / excess_returns.std() * (252 ** 0.5)
 
+    def get_volatility(self):
+        """计算年化波动率"""
+        if self.strategy_returns is None:
+            self.calculate_returns()
+
+        if self.strategy_returns is None or len(self.strategy_returns) < 2:
+            return 0.0
+        return self.strategy_returns.std() * (252 ** 0.5) * 100  # 转换为百分比
+
+    def get_calmar_ratio(self):
+        """计算卡玛比率（年化收益率 / 最大回撤）"""
+        max_drawdown = self.get_max_drawdown()
+        if max_drawdown <= 0:
+            return 0.0
+        return self.get_annualized_return() / max_drawdown
+
+    def get_benchmark_returns(self):
+        """获取与回测区间对齐的基准日收益率"""
+        if self.benchmark_returns is None:
+            from Data_Handling import get_data_handler
+            dh = get_data_handler()
+            if dh is None or dh.index_data is None or not self.account.dates:
+                return None
+            close = dh.index_data['close']
+            self.benchmark_returns = close.pct_change().reindex(pd.DatetimeIndex(self.account.dates))
+        return self.benchmark_returns
+
+    def get_rolling_metrics(self, windows=(20, 60, 120), periods_per_year=252):
+        """
+        计算相对基准的滚动指标（滚动夏普、波动率、贝塔、阿尔法、跟踪误差、信息比率、上下行捕获率）
+        :param windows: 滚动窗口长度列表（交易日）
+        :return: dict {窗口长度: DataFrame}
+        """
+        if self.strategy_returns is None:
+            self.calculate_returns()
+
+        benchmark_returns = self.get_benchmark_returns()
+        if benchmark_returns is None or self.strategy_returns is None or self.strategy_returns.empty:
+            return {}
+        benchmark_returns = benchmark_returns.dropna()
+        return {window: rolling_metrics(self.strategy_returns, benchmark_returns, window, periods_per_year)
+                for window in windows}
+
     def get_max_drawdown(self):
         """计算最大回撤"""
         if self.cumulative_net_assets is None:
             self.calculate_cumulative_returns()
 
-        if len(self.cumulative_net_assets) == 0:
+        if self.cumulative_net_assets is None or len(self.cumulative_net_assets) == 0:
             return 0.0
 
-        # 使用累计净值计算回撤
-        cumulative_values = self.cumulative_net_assets.values
-        peak = cumulative_values[0]
-        max_drawdown = 0
+        # 使用累计净值的运行最大值计算回撤
+        underwater = underwater_curve(self.cumulative_net_assets.values)
+        return float(-underwater.min()) * 100  # 转换为百分比
 
-        for value in cumulative_values:
-            if value > peak:
-                peak = value
-            drawdown = (peak - value) / peak
-            if drawdown > max_drawdown:
-                max_drawdown = drawdown
+    def get_drawdown_details(self):
+        """
+        计算回撤详情：最大回撤及其峰值/谷底/恢复日期、最长水下期和完整水下曲线
+
+        返回:
+        dict: 最大回撤为百分比，恢复日期未恢复时为None，最长水下期以交易日计，
+              underwater为按日期索引的水下曲线（小数）
+        """
+        if self.cumulative_net_assets is None:
+            self.calculate_cumulative_returns()
 
-        return max_drawdown * 100  # 转换为百分比
+        if self.cumulative_net_assets is None or len(self.cumulative_net_assets) == 0:
+            return None
+
+        dates = self.cumulative_net_assets.index
+        details = drawdown_details(self.cumulative_net_assets.values)
+        end = details['longest_underwater_end']
+        return {
+            'max_drawdown': details['max_drawdown'] * 100,
+            'peak_date': dates[details['peak']],
+            'trough_date': dates[details['trough']],
+            'recovery_date': dates[details['recovery']] if details['recovery'] is not None else None,
+            'longest_underwater_days': details['longest_underwater'],
+            'longest_underwater_start': dates[details['longest_underwater_start']] if end else None,
+            'longest_underwater_end': dates[end - 1] if end else None,
+            'underwater': pd.Series(details['underwater'], index=dates),
+        }
 
     def get_trade_count(self):
         """获取总交易次数"""
@@ -119,7 +311,8 @@ class PerformanceAnalysis:
             winning_trades = len(sell_trades[sell_trades['profit'] > 0])
             return (winning_trades / len(sell_trades)) * 100
         else:
-            return 0.0
+            # 成交记录中没有盈亏字段时，按FIFO批次匹配计算回合胜率
+            return self.get_trade_analysis().get_win_rate()
 
     def get_avg_trade_return(self):
         """计算平均交易收益率"""
@@ -130,7 +323,28 @@ class PerformanceAnalysis:
         if 'return_rate' in trades.columns:
             return trades['return_rate'].mean() * 100
         else:
-            return 0.0
+            return self.get_trade_analysis().get_avg_trade_return()
+
+    def get_trade_analysis(self):
+        """获取交易级分析（FIFO批次匹配，结果缓存）"""
+        if getattr(self, '_trade_analysis', None) is None:
+            from Trade_Analysis import TradeAnalysis
+            self._trade_analysis = TradeAnalysis(self.account.trade_history)
+        return self._trade_analysis
+
+    def get_bootstrap_analysis(self, n_resamples=5000, block_size=20, method='stationary', seed=None,
+                               n_workers=None):
+        """
+        区块自助法估计夏普、年化收益、最大回撤的置信区间及相对基准的p值
+        :return: 已完成重采样的BootstrapAnalysis
+        """
+        from Bootstrap_Analysis import BootstrapAnalysis
+        benchmark = self.get_benchmark_returns()
+        if benchmark is not None:
+            benchmark = benchmark.fillna(0)
+        analysis = BootstrapAnalysis(self.strategy_returns, benchmark, method=method, block_size=block_size)
+        analysis.run(n_resamples=n_resamples, seed=seed, n_workers=n_workers)
+        return analysis
 
     def validate_data(self):
         """验证数据完整性"""
@@ -155,7 +369,7 @@ class PerformanceAnalysis:
         # 首先验证数据
         data_issues = self.validate_data()
         if data_issues:
-            print(f"数据警告: {', '.join(data_issues)}")
+            log.warning("数据警告: %s", ', '.join(data_issues))
 
         total_return = self.get_total_return()
         annual_return = self.get_annualized_return()
@@ -169,11 +383,10 @@ class PerformanceAnalysis:
         avg_trade_return = self.get_avg_trade_return()
 
         # 调试信息
-        print(f"调试信息:")
-        print(f"  初始资产: {self.account.total_assets[0] if self.account.total_assets else 'N/A'}")
-        print(f"  最终资产: {self.account.total_assets[-1] if self.account.total_assets else 'N/A'}")
-        print(f"  交易日数: {len(self.account.dates)}")
-        print(f"  收益率序列长度: {len(self.strategy_returns) if self.strategy_returns is not None else 0}")
+        log.debug("调试信息: 初始资产=%s, 最终资产=%s, 交易日数=%s, 收益率序列长度=%s",
+                  self.account.total_assets[0] if self.account.total_assets else 'N/A',
+                  self.account.total_assets[-1] if self.account.total_assets else 'N/A',
+                  len(self.account.dates), len(self.strategy_returns) if self.strategy_returns is not None else 0)
 
         summary = {
             '总收益率 (%)': round(total_return, 2),
@@ -189,4 +402,254 @@ class PerformanceAnalysis:
             '平均交易收益率 (%)': round(avg_trade_return, 2)
         }
 
-        return summary
\ No newline at end of file
+        return summary
+
+
+class StreamingMetrics:
+    def __init__(self, periods_per_year=252):
+        """
+        逐日在线更新的绩效指标累加器，每次更新O(1)
+        由回测引擎每个交易日喂入一次总资产和基准收盘价，运行中即可读取夏普、回撤等指标
+
+        参数:
+        periods_per_year: 年化使用的交易日数
+        """
+        self.periods_per_year = periods_per_year
+        self.days = 0
+        self.start_date = None
+        self.current_date = None
+        self.first_nav = None
+        self.last_nav = None
+
+        # 日收益率的均值和离差平方和（Welford算法）
+        self.return_mean = 0.0
+        self.return_m2 = 0.0
+
+        # 相对基准超额日收益率的均值和离差平方和
+        self.excess_count = 0
+        self.excess_mean = 0.0
+        self.excess_m2 = 0.0
+
+        # 运行峰值和回撤
+        self.peak = None
+        self.drawdown = 0.0
+        self.max_drawdown = 0.0
+
+        self.first_benchmark = None
+        self.last_benchmark = None
+
+    def update(self, date, nav, benchmark_close=None):
+        """
+        喂入一个交易日的数据
+        :param date: 交易日
+        :param nav: 当日总资产
+        :param benchmark_close: 当日基准收盘价（可选）
+        """
+        if self.days == 0:
+            self.start_date = date
+            self.first_nav = nav
+            self.peak = nav
+            daily_return = 0.0  # 与PerformanceAnalysis一致，首日收益率记为0
+        else:
+            daily_return = nav / self.last_nav - 1 if self.last_nav else 0.0
+
+        self.days += 1
+        delta = daily_return - self.return_mean
+        self.return_mean += delta / self.days
+        self.return_m2 += delta * (daily_return - self.return_mean)
+
+        if benchmark_close:
+            if self.last_benchmark:
+                excess = daily_return - (benchmark_close / self.last_benchmark - 1)
+                self.excess_count += 1
+                delta = excess - self.excess_mean
+                self.excess_mean += delta / self.excess_count
+                self.excess_m2 += delta * (excess - self.excess_mean)
+            else:
+                self.first_benchmark = benchmark_close
+            self.last_benchmark = benchmark_close
+
+        if nav > self.peak:
+            self.peak = nav
+        self.drawdown = (self.peak - nav) / self.peak if self.peak else 0.0
+        if self.drawdown > self.max_drawdown:
+            self.max_drawdown = self.drawdown
+
+        self.current_date = date
+        self.last_nav = nav
+
+    @property
+    def total_return(self):
+        """累计收益率（小数）"""
+        return self.last_nav / self.first_nav - 1 if self.first_nav else 0.0
+
+    @property
+    def annual_return(self):
+        """年化收益率（小数，按自然日计算，与PerformanceAnalysis一致）"""
+        if self.days < 2:
+            return 0.0
+        total_days = (pd.Timestamp(self.current_date) - pd.Timestamp(self.start_date)).days
+        if total_days == 0:
+            return 0.0
+        return (1 + self.total_return) ** (365 / total_days) - 1
+
+    @property
+    def volatility(self):
+        """年化波动率（小数）"""
+        if self.days < 2:
+            return 0.0
+        return (self.return_m2 / (self.days - 1)) ** 0.5 * self.periods_per_year ** 0.5
+
+    @property
+    def sharpe_ratio(self):
+        """夏普比率（无风险利率为0）"""
+        volatility = self.volatility
+        return self.return_mean * self.periods_per_year / volatility if volatility > 0 else 0.0
+
+    @property
+    def calmar_ratio(self):
+        """卡玛比率：年化收益率 / 最大回撤"""
+        return self.annual_return / self.max_drawdown if self.max_drawdown > 0 else 0.0
+
+    @property
+    def benchmark_return(self):
+        """基准累计收益率（小数）"""
+        return self.last_benchmark / self.first_benchmark - 1 if self.first_benchmark else 0.0
+
+    @property
+    def excess_return(self):
+        """相对基准的累计超额收益（小数）"""
+        return self.total_return - self.benchmark_return
+
+    @property
+    def information_ratio(self):
+        """信息比率（超额日收益率的年化均值/年化跟踪误差）"""
+        if self.excess_count < 2:
+            return 0.0
+        tracking_error = (self.excess_m2 / (self.excess_count - 1)) ** 0.5
+        return self.excess_mean / tracking_error * self.periods_per_year ** 0.5 if tracking_error > 0 else 0.0
+
+    def snapshot(self):
+        """返回当前全部指标"""
+        return {
+            'days': self.days,
+            'total_return': self.total_return,
+            'annual_return': self.annual_return,
+            'volatility': self.volatility,
+            'sharpe_ratio': self.sharpe_ratio,
+            'drawdown': self.drawdown,
+            'max_drawdown': self.max_drawdown,
+            'calmar_ratio': self.calmar_ratio,
+            'benchmark_return': self.benchmark_return,
+            'excess_return': self.excess_return,
+            'information_ratio': self.information_ratio,
+        }
+
+
+class CrossRunAnalysis:
+    def __init__(self, nav, benchmark=None, dates=None, labels=None, periods_per_year=252, chunk_size=2000):
+        """
+        多次回测净值曲线的横向分析（如参数扫描结果），所有指标对全部曲线一次向量化计算
+
+        参数:
+        nav: (回测次数, 天数) 净值或总资产矩阵
+        benchmark: (天数,) 基准收盘价或净值（可选）
+        dates: 交易日序列（可选，提供时按自然日年化，与PerformanceAnalysis一致）
+        labels: 每次回测的参数，DataFrame或dict列表（可选，会拼接到指标表中）
+        periods_per_year: 年化使用的交易日数
+        chunk_size: 分块计算的曲线数量，控制中间数组的内存占用
+        """
+        self.nav = np.asarray(nav, dtype=np.float64)
+        if self.nav.ndim != 2:
+            raise ValueError("nav必须为(回测次数, 天数)的二维数组")
+        self.benchmark = None if benchmark is None else np.asarray(benchmark, dtype=np.float64)
+        self.dates = None if dates is None else pd.DatetimeIndex(dates)
+        self.labels = None if labels is None else pd.DataFrame(labels).reset_index(drop=True)
+        self.periods_per_year = periods_per_year
+        self.chunk_size = chunk_size
+        self.metrics = None
+
+    def get_returns(self):
+        """日收益率矩阵（首日为0）"""
+        returns = np.zeros_like(self.nav)
+        returns[:, 1:] = self.nav[:, 1:] / self.nav[:, :-1] - 1
+        return returns
+
+    def _year_fraction(self):
+        """回测区间的年数"""
+        n_days = self.nav.shape[1]
+        if self.dates is not None and len(self.dates) >= 2:
+            return max((self.dates[-1] - self.dates[0]).days, 1) / 365
+        return max(n_days - 1, 1) / self.periods_per_year
+
+    def _chunk_metrics(self, nav):
+        """计算一块曲线的全部指标"""
+        returns = np.zeros_like(nav)
+        returns[:, 1:] = nav[:, 1:] / nav[:, :-1] - 1
+        total_return = nav[:, -1] / nav[:, 0] - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annual_return = np.power(1 + total_return, 1 / self._year_fraction()) - 1
+            std = returns.std(axis=1, ddof=1)
+            sharpe = returns.mean(axis=1) / std * np.sqrt(self.periods_per_year)
+            max_drawdown = -underwater_curve(nav).min(axis=1)
+            calmar = np.where(max_drawdown > 0, annual_return / max_drawdown, 0.0)
+
+        result = {
+            'total_return': total_return,
+            'annual_return': annual_return,
+            'volatility': std * np.sqrt(self.periods_per_year),
+            'sharpe_ratio': np.nan_to_num(sharpe),
+            'max_drawdown': max_drawdown,
+            'calmar_ratio': calmar,
+        }
+
+        if self.benchmark is not None:
+            benchmark_returns = np.zeros(len(self.benchmark))
+            benchmark_returns[1:] = self.benchmark[1:] / self.benchmark[:-1] - 1
+            excess = returns - benchmark_returns[None, :]
+            tracking_error = excess.std(axis=1, ddof=1) * np.sqrt(self.periods_per_year)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                information_ratio = excess.mean(axis=1) * self.periods_per_year / tracking_error
+            result['excess_return'] = total_return - (self.benchmark[-1] / self.benchmark[0] - 1)
+            result['tracking_error'] = tracking_error
+            result['information_ratio'] = np.nan_to_num(information_ratio)
+        return result
+
+    def get_metrics(self):
+        """
+        计算每次回测的指标（均为小数）
+        :return: DataFrame，每行一次回测，含总收益、年化收益、波动率、夏普、最大回撤、卡玛，
+                 有基准时另含超额收益、跟踪误差、信息比率
+        """
+        if self.metrics is None:
+            chunks = [self._chunk_metrics(self.nav[start:start + self.chunk_size])
+                      for start in range(0, len(self.nav), self.chunk_size)]
+            metrics = pd.DataFrame({key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]})
+            if self.labels is not None:
+                metrics = pd.concat([self.labels, metrics], axis=1)
+            self.metrics = metrics
+        return self.metrics
+
+    def rank(self, by='sharpe_ratio', ascending=False, top=None):
+        """
+        按指定指标排序
+        :param by: 指标名
+        :param ascending: 是否升序
+        :param top: 只返回前top行
+        """
+        ranked = self.get_metrics().sort_values(by, ascending=ascending, kind='stable')
+        return ranked.head(top) if top else ranked
+
+    def filter(self, **bounds):
+        """
+        按指标上下限筛选，例如 filter(max_drawdown=(None, 0.2), sharpe_ratio=(1.0, None))
+        :return: 满足全部条件的行
+        """
+        metrics = self.get_metrics()
+        mask = np.ones(len(metrics), dtype=bool)
+        for name, (lower, upper) in bounds.items():
+            if lower is not None:
+                mask &= metrics[name].to_numpy() >= lower
+            if upper is not None:
+                mask &= metrics[name].to_numpy() <= upper
+        return metrics[mask]
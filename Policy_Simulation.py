@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from Agent import _flat_states
+
+
+def index_proxy_action_returns(open_, close):
+    """
+    以指数本身近似成分股篮子，计算每个动作的当日组合收益率（相对前收盘总资产）
+    与WeightBasedStrategy的仓位安排一致：平时持有半仓底仓，
+    动作1（看多做T）开盘再买半仓、收盘卖回；动作0（看空做T）开盘卖出底仓、收盘买回
+
+    参数:
+    open_, close: 指数开盘价、收盘价数组（按交易日排列）
+
+    返回:
+    (action_returns, benchmark_returns): (天数-1, 2) 动作收益率和 (天数-1,) 指数收益率，对应第2天起的每个交易日
+    """
+    prev_close = close[:-1]
+    gap = open_[1:] / prev_close - 1  # 隔夜收益
+    intraday = close[1:] / open_[1:] - 1  # 日内收益
+    close_to_close = close[1:] / prev_close - 1
+
+    action_returns = np.column_stack([
+        0.5 * gap,  # 动作0：底仓只赚隔夜，日内空仓
+        0.5 * close_to_close + 0.5 * intraday,  # 动作1：底仓全天 + 等额加仓部分赚日内
+    ])
+    return action_returns, close_to_close
+
+
+def basket_action_returns(data_handler, weights, dates):
+    """
+    由成分股面板计算加权篮子的动作收益率（仓位安排同index_proxy_action_returns）
+
+    参数:
+    data_handler: DataHandler实例
+    weights: 成分股权重，dict或Series（股票代码 -> 权重）
+    dates: 交易日序列
+
+    返回:
+    np.ndarray: (天数-1, 2) 动作收益率
+    """
+    weights = pd.Series(weights, dtype='float64')
+    weights = weights / weights.sum()
+    dates = pd.DatetimeIndex(dates)
+    panel = data_handler.all_stock_data[['open', 'close']]
+    open_ = panel['open'].unstack('ts_code').reindex(index=dates, columns=weights.index)
+    close = panel['close'].unstack('ts_code').reindex(index=dates, columns=weights.index)
+
+    # 缺失行情按0收益处理（停牌），权重按当日有数据的股票重新归一
+    gap = (open_.values[1:] / close.values[:-1] - 1)
+    intraday = (close.values[1:] / open_.values[1:] - 1)
+    close_to_close = (close.values[1:] / close.values[:-1] - 1)
+    valid = np.isfinite(gap) & np.isfinite(intraday) & np.isfinite(close_to_close)
+    w = np.where(valid, weights.values[None, :], 0.0)
+    w = w / np.maximum(w.sum(axis=1, keepdims=True), 1e-12)
+
+    basket_gap = np.sum(w * np.where(valid, gap, 0.0), axis=1)
+    basket_cc = np.sum(w * np.where(valid, close_to_close, 0.0), axis=1)
+    basket_intraday = np.sum(w * np.where(valid, intraday, 0.0), axis=1)
+    return np.column_stack([0.5 * basket_gap, 0.5 * basket_cc + 0.5 * basket_intraday])
+
+
+class IndexPolicySimulator:
+    def __init__(self, states, action_returns, benchmark_returns, dates=None):
+        """
+        只基于指数状态的快速策略模拟器
+        Agent的决策只依赖指数状态、奖励只依赖超额收益，因此无需逐只股票撮合即可评估策略
+
+        参数:
+        states: (天数,) 每个交易日开盘前观察到的扁平状态下标
+        action_returns: (天数, 动作数) 每个动作当日的组合收益率
+        benchmark_returns: (天数,) 基准当日收益率
+        dates: 交易日序列（可选，仅用于结果展示）
+        """
+        self.states = np.asarray(states, dtype=np.int64)
+        self.action_returns = np.asarray(action_returns, dtype=np.float64)
+        self.benchmark_returns = np.asarray(benchmark_returns, dtype=np.float64)
+        self.excess_returns = self.action_returns - self.benchmark_returns[:, None]
+        self.dates = dates
+        self.n_states = int(self.states.max()) + 1 if len(self.states) else 0
+
+    @classmethod
+    def from_environment(cls, env, start_date, end_date, action_returns=None):
+        """
+        基于DiscreteIndexEnvironment的预计算状态表构造模拟器
+        未提供action_returns时使用指数近似（index_proxy_action_returns）
+
+        参数:
+        env: DiscreteIndexEnvironment实例
+        start_date, end_date: 模拟区间，格式'YYYYMMDD'或datetime
+        action_returns: (区间天数-1, 动作数) 自定义动作收益率，如basket_action_returns的结果
+        """
+        lo = env.dates.searchsorted(pd.to_datetime(start_date), side='left')
+        hi = env.dates.searchsorted(pd.to_datetime(end_date), side='right')
+        proxy_returns, benchmark_returns = index_proxy_action_returns(env.open[lo:hi], env.close[lo:hi])
+        if action_returns is None:
+            action_returns = proxy_returns
+
+        # 第t日开盘前的决策依据为第t日的状态（与Agent.receive一致）
+        flat_states = _flat_states(env.state_table[lo:hi], env.state_shape)
+        simulator = cls(flat_states[1:], action_returns, benchmark_returns, env.dates[lo + 1:hi])
+        simulator.n_states = int(np.prod(env.state_shape))
+        return simulator
+
+    def rollout(self, n_rollouts=1000, epsilon=0.1, alpha=0.1, reward_scale=10.0, initial_value=None,
+                learn=True, seed=None):
+        """
+        同时模拟多条带随机种子的在线学习轨迹（按交易日循环，对所有轨迹向量化）
+
+        每日：按ε-贪心（价值为0时随机）选择动作，得到当日超额收益；
+        下一日用 放大后的超额收益 更新前一日状态的价值，与WeightBasedStrategy的在线学习一致
+        （策略通过Agent.feedback学习，pre_action从不赋值，奖励不随动作取反）
+
+        参数:
+        n_rollouts: 轨迹数量
+        epsilon, alpha: 探索率和学习率
+        reward_scale: 奖励放大倍数
+        initial_value: 初始价值函数（扁平数组或价值数组），默认全零
+        learn: 是否在线更新价值函数
+        seed: 随机种子
+
+        返回:
+        dict: actions (轨迹数, 天数)、excess_returns (轨迹数, 天数)、final_values (轨迹数, 状态数)
+        """
+        rng = np.random.default_rng(seed)
+        n_days = len(self.states)
+        values = np.zeros((n_rollouts, self.n_states))
+        if initial_value is not None:
+            values += np.asarray(initial_value, dtype=np.float64).reshape(-1)[None, :self.n_states]
+
+        actions = np.empty((n_rollouts, n_days), dtype=np.int8)
+        excess = np.empty((n_rollouts, n_days))
+        rows = np.arange(n_rollouts)
+        explore = rng.random((n_days, n_rollouts)) < epsilon
+        random_actions = rng.integers(0, 2, size=(n_days, n_rollouts))
+
+        for t in range(n_days):
+            state = self.states[t]
+            state_values = values[:, state]
+            greedy = np.where(state_values == 0, random_actions[t], state_values > 0)
+            action = np.where(explore[t], random_actions[t], greedy)
+            actions[:, t] = action
+            excess[:, t] = self.excess_returns[t, action]
+
+            if learn:
+                reward = reward_scale * excess[:, t]
+                values[rows, state] += alpha * (reward - values[rows, state])
+
+        return {'actions': actions, 'excess_returns': excess, 'final_values': values}
+
+    def evaluate(self, n_rollouts=1000, n_workers=None, seed=None, **kwargs):
+        """
+        评估策略的超额收益分布，可选用进程池并行（每个进程负责一部分轨迹）
+
+        参数:
+        n_rollouts: 轨迹总数
+        n_workers: 进程数，None或1时在当前进程计算
+        seed: 随机种子，各进程的种子由其派生
+        kwargs: 传给rollout的其他参数
+
+        返回:
+        dict: cumulative_excess (轨迹数,) 累计超额收益、bullish_ratio 看多比例、summary 分布统计
+        """
+        if n_workers and n_workers > 1:
+            chunks = np.array_split(np.arange(n_rollouts), n_workers)
+            seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = [pool.submit(_rollout_chunk, self, len(chunk), child, kwargs)
+                           for chunk, child in zip(chunks, seeds) if len(chunk)]
+                parts = [future.result() for future in futures]
+            cumulative = np.concatenate([part[0] for part in parts])
+            bullish = np.concatenate([part[1] for part in parts])
+        else:
+            cumulative, bullish = _rollout_chunk(self, n_rollouts, seed, kwargs)
+
+        return {
+            'cumulative_excess': cumulative,
+            'bullish_ratio': bullish,
+            'summary': pd.Series(cumulative).describe(percentiles=[0.05, 0.25, 0.5, 0.75, 0.95]),
+        }
+
+
+def _rollout_chunk(simulator, n_rollouts, seed, kwargs):
+    """进程池任务：模拟一批轨迹，只返回汇总结果以减少进程间传输"""
+    result = simulator.rollout(n_rollouts=n_rollouts, seed=seed, **kwargs)
+    cumulative = np.prod(1 + result['excess_returns'], axis=1) - 1
+    return cumulative, result['actions'].mean(axis=1)
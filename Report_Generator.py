@@ -0,0 +1,342 @@
+import json
+import html
+import numpy as np
+import pandas as pd
+from Performance_Analysis import PerformanceAnalysis
+from Visualization import lttb_downsample
+
+# 指标表的列：(字段, 表头, 小数位)
+METRIC_COLUMNS = [
+    ('total_return', '总收益率 (%)', 2),
+    ('annual_return', '年化收益率 (%)', 2),
+    ('sharpe_ratio', '夏普比率', 3),
+    ('max_drawdown', '最大回撤 (%)', 2),
+    ('volatility', '年化波动率 (%)', 2),
+    ('calmar_ratio', 'Calmar比率', 3),
+    ('trade_count', '交易次数', 0),
+    ('win_rate', '胜率 (%)', 2),
+]
+
+
+def encode_curve(dates, values, max_points=400, scale=10000):
+    """
+    把净值曲线压缩为紧凑的整数差分编码
+    先做LTTB降采样，日期记为相对首日的天数差分，净值乘以scale取整后差分
+
+    返回:
+    dict: t0首日(YYYY-MM-DD)、dx天数差分、dy净值差分、scale
+    """
+    dates = pd.DatetimeIndex(dates)
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.isfinite(values)
+    dates, values = dates[valid], values[valid]
+    if len(values) == 0:
+        return None
+
+    keep = lttb_downsample(dates.asi8, values, max_points)
+    dates, values = dates[keep], values[keep]
+    days = ((dates - dates[0]) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+    ticks = np.round(values * scale).astype(np.int64)
+    return {
+        't0': dates[0].strftime('%Y-%m-%d'),
+        'dx': np.diff(days, prepend=0).tolist(),
+        'dy': np.diff(ticks, prepend=0).tolist(),
+        'scale': scale,
+    }
+
+
+def _clean(value):
+    """转换为可JSON序列化的Python对象（NaN/inf/NaT记为None）"""
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value) if np.isfinite(value) else None
+    if isinstance(value, np.ndarray):
+        return [_clean(v) for v in value.tolist()]
+    if isinstance(value, (list, tuple)):
+        return [_clean(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _clean(v) for k, v in value.items()}
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return None if pd.isna(value) else str(pd.Timestamp(value))
+    return value
+
+
+class ReportGenerator:
+    def __init__(self, title='回测结果报告', max_points=400):
+        """
+        批量回测结果的单文件HTML报告（无需服务器，数据以紧凑JSON内嵌）
+
+        参数:
+        title: 报告标题
+        max_points: 每条净值曲线保留的点数（LTTB降采样）
+        """
+        self.title = title
+        self.max_points = max_points
+        self.runs = []
+        self.benchmarks = []  # 区间相同的回测共享同一条基准曲线
+        self._benchmark_keys = {}
+
+    def add_run(self, account, label=None, params=None, performance=None, agent=None, benchmark_returns=None):
+        """
+        加入一次回测
+        :param account: 回测账户
+        :param label: 显示名称
+        :param params: 本次回测的参数字典
+        :param performance: 已计算的PerformanceAnalysis（传入时复用）
+        :param agent: 提供get_learning_status的Agent（可选）
+        :param benchmark_returns: 基准日收益率
+        """
+        performance = performance or PerformanceAnalysis(account, benchmark_returns)
+        dates = pd.DatetimeIndex(account.dates)
+        nav = np.asarray(account.total_assets, dtype=np.float64)
+
+        record = {
+            'label': label or f'run {len(self.runs) + 1}',
+            'params': {key: _clean(value) for key, value in (params or {}).items()},
+            'metrics': self._metrics(performance) if len(nav) else {},
+            'trades': {},
+            'learning': None,
+            'nav': encode_curve(dates, nav / nav[0], self.max_points) if len(nav) else None,
+            'benchmark': None,
+        }
+
+        if account.trade_history:
+            record['trades'] = {key: _clean(value)
+                                for key, value in performance.get_trade_analysis().get_summary().items()}
+
+        if len(nav):
+            record['benchmark'] = self._benchmark_curve(performance, dates)
+
+        if agent is not None and hasattr(agent, 'get_learning_status'):
+            record['learning'] = agent.get_learning_status()
+
+        self.runs.append(record)
+        return record
+
+    def _benchmark_curve(self, performance, dates):
+        """基准累计净值曲线在self.benchmarks中的编号（同一日期区间只编码一次）"""
+        key = (dates[0], dates[-1], len(dates))
+        if key not in self._benchmark_keys:
+            benchmark = performance.get_benchmark_returns()
+            if benchmark is None:
+                return None
+            benchmark = benchmark.reindex(dates).fillna(0)
+            benchmark.iloc[0] = 0
+            self._benchmark_keys[key] = len(self.benchmarks)
+            self.benchmarks.append(encode_curve(dates, (1 + benchmark).cumprod().to_numpy(), self.max_points))
+        return self._benchmark_keys[key]
+
+    def add_engine(self, engine, label=None, params=None):
+        """加入一个已运行完成的BacktestEngine"""
+        agent = getattr(getattr(engine, 'strategy', None), 'agent', None)
+        return self.add_run(engine.account, label=label, params=params or getattr(engine, 'strategy_params', None),
+                            performance=engine.performance, agent=agent)
+
+    def _metrics(self, performance):
+        """指标表的一行"""
+        metrics = {
+            'total_return': performance.get_total_return(),
+            'annual_return': performance.get_annualized_return(),
+            'sharpe_ratio': performance.get_sharpe_ratio(),
+            'max_drawdown': performance.get_max_drawdown(),
+            'volatility': performance.get_volatility(),
+            'calmar_ratio': performance.get_calmar_ratio(),
+            'trade_count': performance.get_trade_count(),
+            'win_rate': performance.get_win_rate(),
+        }
+        return {key: _clean(value) for key, value in metrics.items()}
+
+    def to_json(self):
+        """报告数据的紧凑JSON"""
+        payload = {
+            'title': self.title,
+            'columns': [{'key': key, 'name': name, 'digits': digits} for key, name, digits in METRIC_COLUMNS],
+            'runs': self.runs,
+            'benchmarks': self.benchmarks,
+        }
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+
+    def write(self, path):
+        """写出单个HTML文件"""
+        data = self.to_json().replace('</', '<\\/')  # 避免提前结束<script>
+        page = _TEMPLATE.replace('__TITLE__', html.escape(self.title)).replace('__DATA__', data)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(page)
+        return path
+
+
+_TEMPLATE = r'''<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { font-family: -apple-system, "Microsoft YaHei", sans-serif; margin: 16px; color: #222; }
+h1 { font-size: 20px; }
+#chart { width: 100%; height: 360px; border: 1px solid #ddd; }
+#chart text { font-size: 11px; fill: #666; }
+table { border-collapse: collapse; font-size: 12px; margin-top: 12px; }
+th, td { border: 1px solid #ddd; padding: 3px 8px; text-align: right; white-space: nowrap; }
+th { background: #f4f4f4; cursor: pointer; position: sticky; top: 0; }
+td:first-child, th:first-child { text-align: left; }
+tr.selected td { background: #eef5ff; }
+#filter { margin-top: 8px; width: 320px; }
+#detail { font-size: 12px; margin-top: 8px; white-space: pre-wrap; }
+.swatch { display: inline-block; width: 10px; height: 10px; margin-right: 4px; }
+</style>
+</head>
+<body>
+<h1>__TITLE__</h1>
+<svg id="chart"></svg>
+<div id="legend"></div>
+<input id="filter" placeholder="按名称或参数筛选">
+<div id="detail"></div>
+<table id="runs"><thead></thead><tbody></tbody></table>
+<script type="application/json" id="report-data">__DATA__</script>
+<script>
+(function () {
+  var data = JSON.parse(document.getElementById('report-data').textContent);
+  var colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#17becf'];
+  var selected = [], sortKey = 'sharpe_ratio', sortDesc = true, DAY = 86400000;
+
+  // 解码差分编码的曲线
+  function decode(c) {
+    if (!c) return null;
+    var t = Date.parse(c.t0), v = 0, d = 0, xs = [], ys = [];
+    for (var i = 0; i < c.dx.length; i++) {
+      d += c.dx[i]; v += c.dy[i];
+      xs.push(t + d * DAY); ys.push(v / c.scale);
+    }
+    return {x: xs, y: ys};
+  }
+
+  function fmt(v, digits) {
+    return v === null || v === undefined ? '' : Number(v).toFixed(digits);
+  }
+
+  function draw() {
+    var svg = document.getElementById('chart'), w = svg.clientWidth, h = svg.clientHeight, pad = 40;
+    var curves = [];
+    selected.forEach(function (i, k) {
+      var run = data.runs[i];
+      curves.push({c: decode(run.nav), color: colors[k % colors.length], dash: ''});
+      if (k === 0 && run.benchmark !== null) curves.push({c: decode(data.benchmarks[run.benchmark]), color: '#999', dash: '4,3'});
+    });
+    curves = curves.filter(function (s) { return s.c; });
+    var parts = [], legend = [];
+    if (curves.length) {
+      var x0 = Infinity, x1 = -Infinity, y0 = Infinity, y1 = -Infinity;
+      curves.forEach(function (s) {
+        x0 = Math.min(x0, s.c.x[0]); x1 = Math.max(x1, s.c.x[s.c.x.length - 1]);
+        y0 = Math.min(y0, Math.min.apply(null, s.c.y)); y1 = Math.max(y1, Math.max.apply(null, s.c.y));
+      });
+      if (x1 === x0) x1 = x0 + DAY;
+      if (y1 === y0) y1 = y0 + 0.01;
+      var sx = function (x) { return pad + (x - x0) / (x1 - x0) * (w - 2 * pad); };
+      var sy = function (y) { return h - pad + (y0 - y) / (y1 - y0) * (h - 2 * pad); };
+      for (var g = 0; g <= 4; g++) {
+        var yv = y0 + (y1 - y0) * g / 4, xv = x0 + (x1 - x0) * g / 4;
+        parts.push('<line x1="' + pad + '" x2="' + (w - pad) + '" y1="' + sy(yv) + '" y2="' + sy(yv) + '" stroke="#eee"/>');
+        parts.push('<text x="2" y="' + (sy(yv) + 4) + '">' + yv.toFixed(3) + '</text>');
+        parts.push('<text x="' + (sx(xv) - 30) + '" y="' + (h - 12) + '">' + new Date(xv).toISOString().slice(0, 10) + '</text>');
+      }
+      curves.forEach(function (s) {
+        var pts = s.c.x.map(function (x, j) { return sx(x).toFixed(1) + ',' + sy(s.c.y[j]).toFixed(1); });
+        parts.push('<polyline fill="none" stroke-width="1.5" stroke="' + s.color + '" stroke-dasharray="' + s.dash + '" points="' + pts.join(' ') + '"/>');
+      });
+      selected.forEach(function (i, k) {
+        legend.push('<span class="swatch" style="background:' + colors[k % colors.length] + '"></span>' + escape(data.runs[i].label));
+      });
+      if (data.runs[selected[0]].benchmark !== null) legend.push('<span class="swatch" style="background:#999"></span>CSI 500');
+    }
+    svg.innerHTML = parts.join('');
+    document.getElementById('legend').innerHTML = legend.join(' &nbsp; ');
+  }
+
+  function escape(s) {
+    return String(s).replace(/[&<>"]/g, function (c) { return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c]; });
+  }
+
+  function showDetail(i) {
+    var run = data.runs[i], lines = [run.label];
+    if (Object.keys(run.params).length) lines.push('参数: ' + JSON.stringify(run.params));
+    if (Object.keys(run.trades).length) lines.push('交易统计: ' + JSON.stringify(run.trades));
+    if (run.learning) {
+      var l = run.learning;
+      lines.push('学习进度: ' + (l.progress * 100).toFixed(2) + '% (' + l.learned_states + '/' + l.total_states + ' 状态已学习)');
+      lines.push('价值函数范围: [' + l.value_min.toFixed(6) + ', ' + l.value_max.toFixed(6) + ']  学习更新次数: ' + l.learning_updates + '  累计奖励: ' + l.total_reward.toFixed(6));
+      l.examples.forEach(function (e) { lines.push('  状态[' + e.state.join(', ') + ']: 价值' + e.value.toFixed(6)); });
+    }
+    document.getElementById('detail').textContent = lines.join('\n');
+  }
+
+  function render() {
+    var head = '<tr><th data-key="label">名称</th>' + data.columns.map(function (c) {
+      return '<th data-key="' + c.key + '">' + c.name + (c.key === sortKey ? (sortDesc ? ' ▼' : ' ▲') : '') + '</th>';
+    }).join('') + '</tr>';
+    document.querySelector('#runs thead').innerHTML = head;
+
+    var query = document.getElementById('filter').value.toLowerCase();
+    var order = data.runs.map(function (r, i) { return i; }).filter(function (i) {
+      var r = data.runs[i];
+      return !query || (r.label + JSON.stringify(r.params)).toLowerCase().indexOf(query) >= 0;
+    });
+    order.sort(function (a, b) {
+      var va = sortKey === 'label' ? data.runs[a].label : data.runs[a].metrics[sortKey];
+      var vb = sortKey === 'label' ? data.runs[b].label : data.runs[b].metrics[sortKey];
+      if (va === vb) return 0;
+      if (va === null || va === undefined) return 1;
+      if (vb === null || vb === undefined) return -1;
+      return (va < vb ? -1 : 1) * (sortDesc ? -1 : 1);
+    });
+    document.querySelector('#runs tbody').innerHTML = order.map(function (i) {
+      var r = data.runs[i];
+      return '<tr data-i="' + i + '"' + (selected.indexOf(i) >= 0 ? ' class="selected"' : '') + '><td>' + escape(r.label) + '</td>' +
+        data.columns.map(function (c) { return '<td>' + fmt(r.metrics[c.key], c.digits) + '</td>'; }).join('') + '</tr>';
+    }).join('');
+  }
+
+  document.querySelector('#runs thead').addEventListener('click', function (e) {
+    var key = e.target.getAttribute('data-key');
+    if (!key) return;
+    sortDesc = key === sortKey ? !sortDesc : true;
+    sortKey = key;
+    render();
+  });
+  document.querySelector('#runs tbody').addEventListener('click', function (e) {
+    var row = e.target.closest('tr');
+    if (!row) return;
+    var i = Number(row.getAttribute('data-i')), k = selected.indexOf(i);
+    if (k >= 0) selected.splice(k, 1); else selected.push(i);
+    if (selected.length > colors.length) selected.shift();
+    showDetail(i);
+    render();
+    draw();
+  });
+  document.getElementById('filter').addEventListener('input', render);
+  window.addEventListener('resize', draw);
+
+  render();
+  if (data.runs.length) {
+    var sharpe = function (i) {
+      var v = data.runs[i].metrics.sharpe_ratio;
+      return v === null || v === undefined ? -Infinity : v;
+    };
+    var best = data.runs.map(function (r, i) { return i; }).sort(function (a, b) {
+      return sharpe(b) - sharpe(a);
+    })[0];
+    selected = [best];
+    showDetail(best);
+    render();
+    draw();
+  }
+})();
+</script>
+</body>
+</html>
+'''
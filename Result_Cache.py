@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import pickle
+import hashlib
+import logging
+import importlib
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# 回测结果依赖的源码模块（任一模块改动都会使旧缓存失效）：策略与Agent、撮合与账户、
+# 取价（get_price/get_daily_bars）以及BacktestResult中指标的计算（StreamingMetrics）
+CODE_MODULES = ('Strategy_Core', 'Agent', 'Backtest_Engine', 'trading_function', 'Data_Handling',
+                'Performance_Analysis')
+
+# 每写入这么多次做一次完整扫描，纠正其他进程写入造成的容量估计偏差
+RESCAN_EVERY = 100
+# 淘汰时删到上限的这一比例以下，缓存满后不会每次写入都触发扫描
+EVICT_TO = 0.9
+
+_code_versions = {}
+
+
+def code_version(modules=CODE_MODULES):
+    """
+    源码版本：各模块源文件内容的哈希（进程内缓存）
+    :param modules: 模块名列表
+    """
+    modules = tuple(modules)
+    if modules not in _code_versions:
+        digest = hashlib.sha256()
+        for name in modules:
+            module = sys.modules.get(name) or importlib.import_module(name)
+            digest.update(name.encode())
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        _code_versions[modules] = digest.hexdigest()
+    return _code_versions[modules]
+
+
+def data_fingerprint(data_handler):
+    """
+    数据指纹：数据文件的路径、大小、修改时间以及加载后的日期范围和行数
+    只读取文件元信息，不对全部数据做哈希；结果缓存在data_handler上
+    """
+    fingerprint = getattr(data_handler, '_fingerprint', None)
+    if fingerprint is None:
+        parts = []
+        for path in (data_handler.file_path, data_handler.index_file_path):
+            if path and os.path.exists(path):
+                stat = os.stat(path)
+                parts.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+            else:
+                parts.append([path, None, None])
+        dates = data_handler.dates
+        parts.append([str(dates.min()), str(dates.max()), len(data_handler.all_stock_data)])
+        fingerprint = hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+        data_handler._fingerprint = fingerprint
+    return fingerprint
+
+
+class ResultCache:
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        """
+        以内容哈希为键的回测结果磁盘缓存，超过容量时按最近使用时间(LRU)淘汰
+
+        参数:
+        cache_dir: 缓存目录（多个进程可共享）
+        max_bytes: 缓存总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # 缓存总大小的估计：首次写入时扫描一次，之后按本进程的写入累加，避免每次写入都遍历全部文件
+        self._size = None
+        self._puts = 0
+
+    @staticmethod
+    def make_key(params, start_date, end_date, data_handler=None, **extra):
+        """
+        缓存键：策略参数、源码版本、回测区间、数据指纹及其他影响结果的设置（如初始资金、种子）的哈希
+        """
+        payload = {
+            'params': params,
+            'start_date': str(pd.to_datetime(start_date).date()) if start_date else None,
+            'end_date': str(pd.to_datetime(end_date).date()) if end_date else None,
+            'code': code_version(),
+            'data': data_fingerprint(data_handler) if data_handler is not None else None,
+            'extra': extra,
+        }
+        text = json.dumps(payload, sort_keys=True, default=str, separators=(',', ':'))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        """按键的前两位分子目录，避免单个目录文件过多"""
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        """
+        读取缓存结果，命中时刷新修改时间（作为LRU的最近使用时间）
+        :return: BacktestResult，未命中返回None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning("缓存文件损坏，已忽略: %s (%s)", path, e)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """
+        写入缓存（临时文件+原子替换）
+        容量按累计估计检查，只有估计超过上限（或每RESCAN_EVERY次写入）时才扫描整个目录
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        written = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        self._puts += 1
+        if self._size is None or self._puts % RESCAN_EVERY == 0:
+            self._size = self.size()
+        else:
+            self._size += written - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def get_or_run(self, key, func):
+        """命中则返回缓存结果，否则调用func()计算并写入缓存"""
+        result = self.get(key)
+        if result is None:
+            result = func()
+            self.put(key, result)
+        return result
+
+    def _entries(self):
+        """全部缓存文件的(最近使用时间, 大小, 路径)"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.pkl'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:  # 其他进程刚刚淘汰
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        """缓存当前总大小（字节）"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """总大小超过上限时，从最久未使用的条目开始删除，直到不超过上限的EVICT_TO"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        self._size = total
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+        return removed
+
+    def clear(self):
+        """清空缓存"""
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
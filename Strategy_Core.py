@@ -1,13 +1,42 @@
 from Utilities import log
+import logging
 import pandas as pd
 import numpy as np
+from types import SimpleNamespace
 from Data_Handling import get_weight, get_price, get_index_price
 from Agent import Agent  # 导入Agent类
 
+# 策略可调参数的默认值（参数优化的搜索对象）
+DEFAULT_PARAMS = {
+    'high_trigger': 0.005,  # 看多时指数最高涨幅达到该值，按成本价上浮卖出
+    'low_trigger': 0.005,  # 看空时指数最低跌幅达到该值，按成本价下浮买入
+    'sell_markup': 1.005,  # 目标卖出价 = 成本价 × sell_markup
+    'buy_markdown': 0.995,  # 目标买入价 = 成本价 × buy_markdown
+    'half_ratio': 0.5,  # 底仓使用初始资金的比例
+    'epsilon': 0.1,  # Agent探索率
+    'alpha': 0.1,  # Agent学习率
+    'reward_scale': 10,  # 超额收益奖励的放大倍数
+}
+
+
 class WeightBasedStrategy:
-    def __init__(self, context):
+    def __init__(self, context, agent_model_dir=None, agent_training_window=('20160102', '20180101'), params=None,
+                 seed=None):
+        """
+        :param context: 回测上下文
+        :param agent_model_dir: Agent预训练价值表目录，设置后初始化时热启动（无存档则离线学习并保存）
+        :param agent_training_window: 离线学习区间(开始日期, 结束日期)，格式'YYYYMMDD'
+        :param params: 覆盖DEFAULT_PARAMS中的策略参数
+        :param seed: Agent随机种子
+        """
+        unknown = set(params or {}) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise ValueError(f"未知的策略参数: {sorted(unknown)}")
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
         self.context = context
-        self.g = type('Global', (object,), {})()  # 模拟全局变量
+        self.agent_model_dir = agent_model_dir
+        self.agent_training_window = agent_training_window
+        self.g = SimpleNamespace()  # 模拟全局变量（可序列化，便于保存和续跑回测）
         self.g.securities = []  # 中证500成分股
         self.g.weights = {}  # 股票权重
         self.g.is_initial_purchase_done = False  # 初始半仓标记
@@ -18,8 +47,9 @@ class WeightBasedStrategy:
         self.agent = Agent(
             account=context['account'],
             data_handler=context['data_handler'],
-            Epsilon=0.1,
-            Alpha=0.1
+            Epsilon=self.params['epsilon'],
+            Alpha=self.params['alpha'],
+            seed=seed
         )
 
         # 学习相关变量
@@ -36,7 +66,11 @@ class WeightBasedStrategy:
             weight_df = get_weight()
             self.g.securities = weight_df['ts_code'].unique().tolist()
             self.g.weights = dict(zip(weight_df['ts_code'], weight_df['weight']))
-            log.info(f"股票池包含 {len(self.g.securities)} 只中证500成分股")
+            log.info("股票池包含 %s 只中证500成分股", len(self.g.securities))
+
+            # 从预训练价值表热启动Agent
+            if self.agent_model_dir:
+                self.agent.warm_start(self.agent_model_dir, *self.agent_training_window)
 
             # 初始化学习记录
             self.g.last_assets = self.context['account'].initial_cash
@@ -45,7 +79,7 @@ class WeightBasedStrategy:
             self.g.last_state = None
 
         except Exception as e:
-            log.error(f"初始化失败：{str(e)}")
+            log.error("初始化失败：%s", e)
 
     def before_market_open(self, date):
         """开盘前决策：根据Agent输出确定当日策略"""
@@ -60,13 +94,13 @@ class WeightBasedStrategy:
 
             # Agent决策（1=看多做T，0=看空做T）
             self.g.agent_decision = self.agent.decide(state)
-            log.info(f"Agent决策：状态{state} -> 决策{self.g.agent_decision}（1=看多做T，0=看空做T）")
+            log.info("Agent决策：状态%s -> 决策%s（1=看多做T，0=看空做T）", state, self.g.agent_decision)
 
             # 记录当前状态用于明天学习
             self.g.last_state = state
 
         except Exception as e:
-            log.error(f"开盘前决策错误：{e}")
+            log.error("开盘前决策错误：%s", e)
             self.g.agent_decision = 1  # 默认看多
 
     def market_open(self, date):
@@ -121,10 +155,10 @@ class WeightBasedStrategy:
             self.g.last_date = date
             self.g.last_benchmark_price = benchmark_price
 
-            log.info(f"记录学习数据: 日期{date}, 总资产={current_assets:.2f}, 基准价={benchmark_price}")
+            log.info("记录学习数据: 日期%s, 总资产=%.2f, 基准价=%s", date, current_assets, benchmark_price)
 
         except Exception as e:
-            log.error(f"记录数据错误: {e}")
+            log.error("记录数据错误: %s", e)
 
     def _learn_from_previous_day(self):
         """从前一日的表现中学习"""
@@ -153,17 +187,17 @@ class WeightBasedStrategy:
             # 计算超额收益作为奖励
             reward = daily_return - benchmark_return
 
-            # 放大奖励信号（乘以10让学习更明显）
-            amplified_reward = reward * 10
+            # 放大奖励信号（默认乘以10让学习更明显）
+            amplified_reward = reward * self.params['reward_scale']
 
-            log.info(f"学习计算: 日期={self.g.last_date}, 策略收益={daily_return:.4f}, "
-                     f"基准收益={benchmark_return:.4f}, 原始奖励={reward:.4f}, 放大奖励={amplified_reward:.4f}")
+            log.info("学习计算: 日期=%s, 策略收益=%.4f, 基准收益=%.4f, 原始奖励=%.4f, 放大奖励=%.4f",
+                     self.g.last_date, daily_return, benchmark_return, reward, amplified_reward)
 
             # 给Agent反馈
             self.agent.feedback(amplified_reward)
 
         except Exception as e:
-            log.error(f"学习过程错误: {e}")
+            log.error("学习过程错误: %s", e)
 
     def _get_benchmark_close_price(self, date):
         """获取基准指数收盘价"""
@@ -181,10 +215,10 @@ class WeightBasedStrategy:
             if not index_data.empty and 'close' in index_data.columns:
                 return index_data['close'].iloc[0]
             else:
-                log.warning(f"无法获取 {date} 的基准收盘价")
+                log.warning("无法获取 %s 的基准收盘价", date)
                 return None
         except Exception as e:
-            log.error(f"获取基准收盘价错误: {e}")
+            log.error("获取基准收盘价错误: %s", e)
             return None
 
     def _get_index_performance(self, date):
@@ -214,13 +248,13 @@ class WeightBasedStrategy:
 
             return high_increase, low_decrease
         except Exception as e:
-            log.error(f"获取指数表现失败: {e}")
+            log.error("获取指数表现失败: %s", e)
             return 0, 0
 
     def _initial_half_position(self, date):
         """建立初始半仓（50%仓位）"""
         account = self.context['account']
-        total_cash = account.initial_cash * 0.5  # 仅用一半资金
+        total_cash = account.initial_cash * self.params['half_ratio']  # 默认仅用一半资金
         total_weight = sum(self.g.weights.values())
 
         if total_weight <= 0:
@@ -267,10 +301,10 @@ class WeightBasedStrategy:
             if account.buy(date, security, current_price, buy_amount):
                 total_buy_value += target_value
                 successful_buys += 1
-                log.info(f"看多策略开盘买入 {security}：{buy_amount}股 @ {current_price:.2f}")
+                log.info("看多策略开盘买入 %s：%s股 @ %.2f", security, buy_amount, current_price)
 
         if successful_buys > 0:
-            log.info(f"看多策略开盘买入完成: 成功买入{successful_buys}只股票, 总价值{total_buy_value:.2f}")
+            log.info("看多策略开盘买入完成: 成功买入%s只股票, 总价值%.2f", successful_buys, total_buy_value)
 
     def _open_sell_half(self, date):
         """开盘卖出全部初始半仓 - 使用开盘价"""
@@ -286,10 +320,10 @@ class WeightBasedStrategy:
                 if account.sell(date, security, current_price, amount):
                     total_sell_value += amount * current_price
                     successful_sells += 1
-                    log.info(f"看空策略开盘卖出 {security}：{amount}股 @ {current_price:.2f}")
+                    log.info("看空策略开盘卖出 %s：%s股 @ %.2f", security, amount, current_price)
 
         if successful_sells > 0:
-            log.info(f"看空策略开盘卖出完成: 成功卖出{successful_sells}只股票, 总价值{total_sell_value:.2f}")
+            log.info("看空策略开盘卖出完成: 成功卖出%s只股票, 总价值%.2f", successful_sells, total_sell_value)
 
     def _close_sell_by_index_performance(self, date):
         """收盘时根据指数表现决定卖出价格 - 使用收盘价"""
@@ -297,7 +331,7 @@ class WeightBasedStrategy:
 
         # 获取指数表现
         high_increase, low_decrease = self._get_index_performance(date)
-        log.info(f"指数表现: 最高涨幅={high_increase:.2%}, 最低跌幅={low_decrease:.2%}")
+        log.info("指数表现: 最高涨幅=%.2f%%, 最低跌幅=%.2f%%", high_increase * 100, low_decrease * 100)
 
         total_sell_value = 0
         successful_sells = 0
@@ -308,15 +342,15 @@ class WeightBasedStrategy:
                 continue
 
             # 如果指数最高涨幅超过0.8%，使用成本价*1.008作为卖出价，否则使用收盘价
-            if high_increase >= 0.005:
-                # 使用成本价的1.007倍作为卖出价
+            if high_increase >= self.params['high_trigger']:
+                # 使用成本价上浮后的价格作为卖出价
                 cost_price = self.g.initial_prices.get(security, 0)
-                target_sell_price = cost_price * 1.005
-                log.info(f"指数涨幅达{high_increase:.2%}，使用目标卖出价: {target_sell_price:.2f}")
+                target_sell_price = cost_price * self.params['sell_markup']
+                log.info("指数涨幅达%.2f%%，使用目标卖出价: %.2f", high_increase * 100, target_sell_price)
             else:
                 # 使用收盘价
                 target_sell_price = self._get_current_price(security, date)
-                log.info(f"指数涨幅{high_increase:.2%}未达1%，使用收盘价: {target_sell_price:.2f}")
+                log.info("指数涨幅%.2f%%未达1%%，使用收盘价: %.2f", high_increase * 100, target_sell_price)
 
             if not target_sell_price or target_sell_price <= 0:
                 continue
@@ -325,10 +359,10 @@ class WeightBasedStrategy:
             if account.sell(date, security, target_sell_price, sell_amount):
                 total_sell_value += sell_amount * target_sell_price
                 successful_sells += 1
-                log.info(f"收盘卖出 {security}：{sell_amount}股 @ {target_sell_price:.2f}")
+                log.info("收盘卖出 %s：%s股 @ %.2f", security, sell_amount, target_sell_price)
 
         if successful_sells > 0:
-            log.info(f"收盘卖出完成: 成功卖出{successful_sells}只股票, 总价值{total_sell_value:.2f}")
+            log.info("收盘卖出完成: 成功卖出%s只股票, 总价值%.2f", successful_sells, total_sell_value)
 
     def _close_buy_by_index_performance(self, date):
         """收盘时根据指数表现决定买入价格 - 使用收盘价"""
@@ -336,7 +370,7 @@ class WeightBasedStrategy:
 
         # 获取指数表现
         high_increase, low_decrease = self._get_index_performance(date)
-        log.info(f"指数表现: 最高涨幅={high_increase:.2%}, 最低跌幅={low_decrease:.2%}")
+        log.info("指数表现: 最高涨幅=%.2f%%, 最低跌幅=%.2f%%", high_increase * 100, low_decrease * 100)
 
         total_buy_value = 0
         successful_buys = 0
@@ -344,13 +378,13 @@ class WeightBasedStrategy:
         # 无论指数跌幅是否达到0.7%，都执行买入，只是价格不同
         for security, initial_amount in self.g.initial_half_pos.items():
             # 如果指数跌幅超过0.7%，使用成本价*0.993作为买入价，否则使用收盘价
-            if low_decrease >= 0.005:
+            if low_decrease >= self.params['low_trigger']:
                 cost_price = self.g.initial_prices.get(security, 0)
-                target_buy_price = cost_price * 0.995
-                log.info(f"指数跌幅达{low_decrease:.2%}，使用目标买入价: {target_buy_price:.2f}")
+                target_buy_price = cost_price * self.params['buy_markdown']
+                log.info("指数跌幅达%.2f%%，使用目标买入价: %.2f", low_decrease * 100, target_buy_price)
             else:
                 target_buy_price = self._get_current_price(security, date)
-                log.info(f"指数跌幅{low_decrease:.2%}未达1%，使用收盘价: {target_buy_price:.2f}")
+                log.info("指数跌幅%.2f%%未达1%%，使用收盘价: %.2f", low_decrease * 100, target_buy_price)
 
             if not target_buy_price or target_buy_price <= 0:
                 continue
@@ -364,10 +398,10 @@ class WeightBasedStrategy:
             if account.buy(date, security, target_buy_price, buy_amount):
                 total_buy_value += target_value
                 successful_buys += 1
-                log.info(f"收盘买入 {security}：{buy_amount}股 @ {target_buy_price:.2f}")
+                log.info("收盘买入 %s：%s股 @ %.2f", security, buy_amount, target_buy_price)
 
         if successful_buys > 0:
-            log.info(f"收盘买入完成: 成功买入{successful_buys}只股票, 总价值{total_buy_value:.2f}")
+            log.info("收盘买入完成: 成功买入%s只股票, 总价值%.2f", successful_buys, total_buy_value)
 
     def _get_current_price(self, security, date):
         """获取股票当前价格（收盘价）"""
@@ -379,7 +413,7 @@ class WeightBasedStrategy:
             data = get_price(security, count=1, fields=['close'], end_date=date)
             return data['close'].iloc[-1] if len(data) > 0 else None
         except Exception as e:
-            log.error(f"获取 {security} 价格失败: {e}")
+            log.error("获取 %s 价格失败: %s", security, e)
             return None
 
     def _get_open_price(self, security, date):
@@ -392,11 +426,13 @@ class WeightBasedStrategy:
             data = get_price(security, count=1, fields=['open'], end_date=date)
             return data['open'].iloc[-1] if len(data) > 0 else None
         except Exception as e:
-            log.error(f"获取 {security} 开盘价失败: {e}")
+            log.error("获取 %s 开盘价失败: %s", security, e)
             return None
 
     def _print_account_status(self, date):
         """打印账户状态"""
+        if not log.isEnabledFor(logging.INFO):  # 持仓市值只用于日志，关闭INFO时不计算
+            return
         account = self.context['account']
         cash = account.cash
         position_value = sum(
@@ -405,7 +441,7 @@ class WeightBasedStrategy:
             if self._get_current_price(sec, date)
         )
         total_assets = cash + position_value
-        log.info(f"[{date}] 现金: {cash:.2f}, 持仓市值: {position_value:.2f}, 总资产: {total_assets:.2f}")
+        log.info("[%s] 现金: %.2f, 持仓市值: %.2f, 总资产: %.2f", date, cash, position_value, total_assets)
 
     def calculate_buy_amount(self, target_value, price):
         """计算可买入数量（不考虑手续费）"""
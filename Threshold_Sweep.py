@@ -0,0 +1,287 @@
+import itertools
+import logging
+import numpy as np
+import pandas as pd
+from Agent import Agent, DiscreteIndexEnvironment, MAX_DENSE_STATES
+from Performance_Analysis import CrossRunAnalysis
+from Strategy_Core import DEFAULT_PARAMS
+
+log = logging.getLogger(__name__)
+
+# 可按数组扫描的阈值参数（收盘时按指数表现决定挂单价格的部分）
+SWEEP_PARAMS = ('high_trigger', 'low_trigger', 'sell_markup', 'buy_markdown')
+
+
+def sequential_buys(cash, cost):
+    """
+    按股票顺序逐笔买入、资金不足的那笔跳过（与Account.buy的逐笔循环一致），对全部网格点同时计算
+    资金足够买下全部的网格点直接全部成交，只有资金不足的网格点才逐笔判断
+
+    参数:
+    cash: (网格点数,) 可用资金
+    cost: (网格点数, 股票数) 每笔买入金额，0表示不买
+
+    返回:
+    (网格点数, 股票数) 是否成交
+    """
+    wanted = cost > 0
+    filled = wanted & (cost.sum(axis=1) <= cash)[:, None]
+    for g in np.flatnonzero(cost.sum(axis=1) > cash):
+        remaining = cash[g]
+        for s in np.flatnonzero(wanted[g]):
+            if remaining >= cost[g, s]:
+                remaining -= cost[g, s]
+                filled[g, s] = True
+    return filled
+
+
+class ThresholdSweep:
+    def __init__(self, data_handler, start_date, end_date, grid, initial_cash=100000, params=None, seed=None,
+                 agent_model_dir=None, agent_training_window=('20160102', '20180101')):
+        """
+        阈值扫描：一次遍历数据同时回测WeightBasedStrategy在一组阈值下的表现
+
+        每个网格点有独立的账户（现金、持仓）和独立学习的Agent价值表，每日的开盘/收盘交易、
+        指数涨跌幅条件和挂单价格对全部网格点向量化计算。逐日语义与BacktestEngine+WeightBasedStrategy一致：
+        - 状态、奖励（前一日超额收益×reward_scale）和学习顺序与策略相同，每个网格点的随机数流与单独回测时相同；
+        - 收盘交易使用前一交易日的指数高开低数据（首日为当日），未触发阈值时的"当前价"
+          对开盘前已持有的股票为开盘价、否则为收盘价（与策略的_get_current_price一致）；
+        - 缺失价格用此前最近的价格填充（与get_price的回退一致）。
+        近似之处：价格缺失（上市前）的股票直接跳过，不复现单次回测中因NaN价格导致当日中断的情况；
+        批量计算的现金扣减顺序与逐笔扣减在浮点上可能有1e-9量级的差异。
+
+        参数:
+        data_handler: 已预加载数据的DataHandler
+        start_date, end_date: 回测区间
+        grid: dict {参数名: 数组}，参数名取自SWEEP_PARAMS，各数组广播为同一长度（未给出的取params/默认值）
+        initial_cash: 初始资金
+        params: 其他策略参数（标量，覆盖DEFAULT_PARAMS）
+        seed: Agent随机种子（全部网格点相同，便于只比较阈值的影响）
+        agent_model_dir, agent_training_window: 同WeightBasedStrategy，用于热启动Agent
+        """
+        unknown = set(grid) - set(SWEEP_PARAMS)
+        if unknown:
+            raise ValueError(f"只支持扫描以下参数: {SWEEP_PARAMS}，未知参数: {sorted(unknown)}")
+        self.data_handler = data_handler
+        self.start_date = pd.to_datetime(start_date)
+        self.end_date = pd.to_datetime(end_date)
+        self.initial_cash = initial_cash
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        self.seed = seed
+        self.agent_model_dir = agent_model_dir
+        self.agent_training_window = agent_training_window
+
+        arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(grid.get(name, self.params[name]), dtype=np.float64))
+                                       for name in SWEEP_PARAMS])
+        self.grid = pd.DataFrame({name: values for name, values in zip(SWEEP_PARAMS, arrays)})
+        self.n_points = len(self.grid)
+
+        self.dates = None
+        self.nav = None
+        self.decisions = None
+        self.values = None
+        self.results = None
+
+    @classmethod
+    def from_product(cls, data_handler, start_date, end_date, initial_cash=100000, params=None, seed=None,
+                     agent_model_dir=None, agent_training_window=('20160102', '20180101'), **axes):
+        """由各参数的取值列表生成笛卡尔积网格（其他参数同构造函数）"""
+        names = list(axes)
+        combos = list(itertools.product(*[np.atleast_1d(axes[name]) for name in names]))
+        grid = {name: np.array([combo[i] for combo in combos]) for i, name in enumerate(names)}
+        return cls(data_handler, start_date, end_date, grid, initial_cash=initial_cash, params=params, seed=seed,
+                   agent_model_dir=agent_model_dir, agent_training_window=agent_training_window)
+
+    def _template_agent(self):
+        """按策略的方式构造（并热启动）Agent，作为所有网格点的初始状态"""
+        agent = Agent(account=None, data_handler=self.data_handler, Epsilon=self.params['epsilon'],
+                      Alpha=self.params['alpha'], seed=self.seed)
+        if self.agent_model_dir:
+            agent.warm_start(self.agent_model_dir, *self.agent_training_window)
+        if agent.value.size > MAX_DENSE_STATES:
+            raise ValueError(f"状态空间过大({agent.value.size})，阈值扫描只支持稠密价值表")
+        return agent
+
+    def _universe(self):
+        """股票池与权重（与策略initialize一致）"""
+        weight_df = self.data_handler.get_weight()
+        securities = weight_df['ts_code'].unique().tolist()
+        weights = dict(zip(weight_df['ts_code'], weight_df['weight']))
+        return securities, np.array([weights.get(s, 0) for s in securities], dtype=np.float64)
+
+    def run(self):
+        """
+        运行扫描
+        :return: DataFrame，每行一个网格点（阈值+绩效指标）
+        """
+        dh = self.data_handler
+        dates = dh.dates[(dh.dates >= self.start_date) & (dh.dates <= self.end_date)]
+        if len(dates) == 0:
+            raise ValueError("没有找到符合条件的交易日期，请检查日期范围是否在数据范围内")
+        securities, weights = self._universe()
+        n_days, n_sec, n_points = len(dates), len(securities), self.n_points
+
+        open_ = dh.get_price_panel(securities, dates, field='open').to_numpy(dtype=np.float64)
+        close = dh.get_price_panel(securities, dates, field='close').to_numpy(dtype=np.float64)
+        index = dh.index_data.reindex(dates)
+        index_open, index_high, index_low, index_close = (index[c].to_numpy(dtype=np.float64)
+                                                          for c in ('open', 'high', 'low', 'close'))
+
+        # Agent：价值表(网格点, 状态数)，每个网格点一个随机数生成器（初始状态与单次回测的Agent相同）
+        agent = self._template_agent()
+        shape = agent.value.shape
+        values = np.zeros((n_points, int(np.prod(shape))))
+        flat_index, flat_values = agent.value.items()
+        values[:, flat_index] = flat_values
+        rngs = []
+        for _ in range(n_points):
+            rng = np.random.default_rng()
+            rng.bit_generator.state = agent.rng.bit_generator.state
+            rngs.append(rng)
+        env = agent.env if isinstance(agent.env, DiscreteIndexEnvironment) else DiscreteIndexEnvironment.from_data_handler(dh)
+        neutral = np.ravel_multi_index([n // 2 for n in shape], shape)
+        epsilon, alpha, reward_scale = self.params['epsilon'], self.params['alpha'], self.params['reward_scale']
+
+        high_trigger, low_trigger = self.grid['high_trigger'].to_numpy(), self.grid['low_trigger'].to_numpy()
+        sell_markup, buy_markdown = self.grid['sell_markup'].to_numpy(), self.grid['buy_markdown'].to_numpy()
+
+        cash = np.full(n_points, float(self.initial_cash))
+        positions = np.zeros((n_points, n_sec), dtype=np.int64)
+        base_amount = np.zeros(n_sec, dtype=np.int64)
+        base_price = np.zeros(n_sec)
+        nav = np.empty((n_points, n_days))
+        decisions = np.empty((n_points, n_days), dtype=np.int8)
+
+        current_state = pre_state = None
+        last_assets = None
+
+        for i, date in enumerate(dates):
+            # 开盘前：状态、学习（前一日的超额收益）、决策
+            ranks = env.get_state(date)
+            if ranks is not None:
+                current_state = int(np.ravel_multi_index(
+                    np.clip(ranks.astype(np.int64) - 1, 0, np.array(shape) - 1), shape))
+            state = current_state if ranks is not None else neutral
+
+            if i > 0:
+                previous_assets = nav[:, i - 1]
+                daily_return = np.where(last_assets > 0, (previous_assets - last_assets) / np.where(
+                    last_assets > 0, last_assets, 1), 0.0)
+                benchmark_now = index_close[i - 1]
+                benchmark_last = index_close[i - 2] if i > 1 else index_close[0]
+                benchmark_return = ((benchmark_now - benchmark_last) / benchmark_last
+                                    if benchmark_last and benchmark_now and benchmark_last > 0 else 0.0)
+                reward = (daily_return - benchmark_return) * reward_scale
+                if pre_state is not None and current_state is not None:
+                    values[:, pre_state] += alpha * (reward - values[:, pre_state])
+                pre_state = current_state
+
+            state_values = values[:, state]
+            for g in range(n_points):
+                rng = rngs[g]
+                if rng.random() < epsilon or state_values[g] == 0:
+                    decisions[g, i] = rng.integers(0, 2)
+                else:
+                    decisions[g, i] = 1 if state_values[g] > 0 else 0
+            bullish = decisions[:, i] == 1
+
+            day_open, day_close = open_[i], close[i]
+            open_ok = np.isfinite(day_open) & (day_open > 0)
+            held_at_open = positions > 0
+            last_assets = nav[:, i - 1] if i > 0 else np.full(n_points, float(self.initial_cash))
+
+            # 开盘：首日建立底仓，之后看多再买一份底仓、看空卖出底仓
+            if i == 0:
+                target = self.initial_cash * self.params['half_ratio'] * weights / weights.sum() \
+                    if weights.sum() > 0 else np.zeros(n_sec)
+                amount = np.where(open_ok & (weights > 0),
+                                  np.floor(target / np.where(open_ok, day_open, 1)), 0).astype(np.int64)
+                cost = np.broadcast_to(amount * np.where(open_ok, day_open, 0), (n_points, n_sec))
+                filled = sequential_buys(cash, cost)
+                bought = np.where(filled, amount, 0)
+                positions += bought
+                cash -= (bought * np.where(open_ok, day_open, 0)).sum(axis=1)
+                base_amount = bought[0]
+                base_price = np.where(base_amount > 0, day_open, 0)
+            else:
+                base = base_amount > 0
+                # 看多：按底仓价值买入
+                amount = np.where(base & open_ok, np.floor(base_amount * base_price / np.where(open_ok, day_open, 1)),
+                                  0).astype(np.int64)
+                cost = np.where(bullish[:, None], amount * np.where(open_ok, day_open, 0), 0)
+                filled = sequential_buys(cash, cost)
+                positions += np.where(filled, amount, 0)
+                cash -= np.where(filled, cost, 0).sum(axis=1)
+                # 看空：持仓不少于底仓的卖出底仓数量
+                sell = (~bullish[:, None]) & base & open_ok & (positions >= base_amount)
+                positions -= np.where(sell, base_amount, 0)
+                cash += np.where(sell, base_amount * np.where(open_ok, day_open, 0), 0).sum(axis=1)
+
+            # 收盘：按（前一交易日的）指数表现决定价格
+            k = i - 1 if i > 0 else 0
+            index_open_k = index_open[k]
+            high_increase = (index_high[k] - index_open_k) / index_open_k if index_open_k > 0 else 0
+            low_decrease = (index_open_k - index_low[k]) / index_open_k if index_open_k > 0 else 0
+            current_price = np.where(held_at_open & (i > 0), day_open, day_close)
+            base = base_amount > 0
+
+            # 看多：超出底仓的部分卖出
+            sell_price = np.where((high_increase >= high_trigger)[:, None], base_price * sell_markup[:, None],
+                                  current_price)
+            sell_ok = np.isfinite(sell_price) & (sell_price > 0)
+            sell_amount = positions - base_amount
+            sell = bullish[:, None] & base & (sell_amount > 0) & sell_ok
+            positions -= np.where(sell, sell_amount, 0)
+            cash += np.where(sell, sell_amount * np.where(sell_ok, sell_price, 0), 0).sum(axis=1)
+
+            # 看空：买回一份底仓价值
+            buy_price = np.where((low_decrease >= low_trigger)[:, None], base_price * buy_markdown[:, None],
+                                 current_price)
+            buy_ok = np.isfinite(buy_price) & (buy_price > 0)
+            safe_price = np.where(buy_ok, buy_price, 1)
+            amount = np.where(base & buy_ok, np.floor(base_amount * base_price / safe_price), 0).astype(np.int64)
+            cost = np.where((~bullish)[:, None], amount * np.where(buy_ok, buy_price, 0), 0)
+            filled = sequential_buys(cash, cost)
+            positions += np.where(filled, amount, 0)
+            cash -= np.where(filled, cost, 0).sum(axis=1)
+
+            # 收盘后计算总资产
+            nav[:, i] = cash + positions @ np.nan_to_num(day_close)
+
+        self.dates = dates
+        self.nav = nav
+        self.decisions = decisions
+        self.values = values.reshape((n_points,) + tuple(shape))
+
+        log.info("阈值扫描完成: %s个网格点, %s个交易日", n_points, n_days)
+        self.results = CrossRunAnalysis(nav, benchmark=index_close, dates=dates, labels=self.grid).get_metrics()
+        return self.results
+
+    def compare_with_engine(self, points=(0,)):
+        """
+        用BacktestEngine单独回测指定网格点（相同参数、种子和热启动设置），与扫描结果逐日比较总资产
+        用于验证向量化实现与逐笔撮合一致（需先调用run）
+        :param points: 要比较的网格点下标
+        :return: DataFrame，每行一个网格点：最大绝对误差、最大相对误差、双方最终总资产
+        """
+        from Backtest_Engine import BacktestEngine
+        from Strategy_Core import WeightBasedStrategy
+
+        if self.nav is None:
+            raise RuntimeError("请先调用run()")
+        rows = []
+        for g in points:
+            params = {**self.params, **self.grid.iloc[g].to_dict()}
+            strategy_params = {'params': params, 'seed': self.seed, 'agent_model_dir': self.agent_model_dir,
+                               'agent_training_window': self.agent_training_window}
+            engine = BacktestEngine(self.data_handler, WeightBasedStrategy, initial_cash=self.initial_cash,
+                                    strategy_params=strategy_params)
+            engine.run(self.start_date, self.end_date, analyze=False, progress=False)
+            engine_nav = pd.Series(engine.account.total_assets, index=pd.DatetimeIndex(engine.account.dates))
+            engine_nav = engine_nav.reindex(self.dates).to_numpy(dtype=np.float64)
+            error = np.abs(engine_nav - self.nav[g])
+            rows.append({'point': g, 'max_abs_error': np.nanmax(error),
+                         'max_rel_error': np.nanmax(error / np.abs(engine_nav)),
+                         'missing_days': int(np.isnan(engine_nav).sum()),
+                         'engine_final': engine_nav[-1], 'sweep_final': self.nav[g, -1]})
+        return pd.DataFrame(rows).set_index('point')
@@ -0,0 +1,161 @@
+import pandas as pd
+import numpy as np
+
+
+def match_fifo_lots(securities, is_buy, amounts):
+    """
+    按股票对买卖成交做先进先出(FIFO)批次匹配（全部向量化，不逐笔循环）
+
+    做法：把每只股票的买入数量依次排成区间[累计买入-本笔, 累计买入)，卖出同理；
+    所有股票首尾相接拼到同一数轴上，买卖区间边界合并排序后，
+    每个小段恰好对应"某笔买入批次被某笔卖出消耗的数量"，用searchsorted定位即可。
+
+    参数:
+    securities: (成交笔数,) 整数化的股票编号，已按股票、时间顺序排序
+    is_buy: (成交笔数,) 是否为买入
+    amounts: (成交笔数,) 成交数量（正数）
+
+    返回:
+    (buy_index, sell_index, quantity): 匹配段对应的买入成交下标、卖出成交下标和数量
+    """
+    amounts = np.asarray(amounts, dtype=np.int64)
+    buy_pos, sell_pos = np.flatnonzero(is_buy), np.flatnonzero(~is_buy)
+    n_groups = int(securities.max()) + 1 if len(securities) else 0
+
+    # 每只股票的买入总量决定其在全局数轴上的起点
+    total_buy = np.bincount(securities[buy_pos], weights=amounts[buy_pos], minlength=n_groups).astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(total_buy)[:-1]])
+
+    def group_cumsum(pos):
+        """同一股票内的累计数量"""
+        q = amounts[pos]
+        csum = np.cumsum(q)
+        g = securities[pos]
+        first = np.concatenate([[True], g[1:] != g[:-1]]) if len(pos) else np.zeros(0, dtype=bool)
+        base = np.where(first, csum - q, 0)
+        return csum - np.maximum.accumulate(base)
+
+    buy_end = offsets[securities[buy_pos]] + group_cumsum(buy_pos)
+
+    # 卖出超过买入的部分（如回测前已有持仓）无法匹配，截断到该股票买入总量
+    sell_groups = securities[sell_pos]
+    limit = offsets[sell_groups] + total_buy[sell_groups]
+    sell_cum = group_cumsum(sell_pos)
+    sell_end = np.minimum(offsets[sell_groups] + sell_cum, limit)
+    sell_start = np.minimum(offsets[sell_groups] + sell_cum - amounts[sell_pos], limit)
+
+    points = np.unique(np.concatenate([[0], buy_end, sell_start, sell_end]))
+    left, right = points[:-1], points[1:]
+    b = np.searchsorted(buy_end, left, side='right')
+    s = np.searchsorted(sell_end, left, side='right')
+    valid = (b < len(buy_pos)) & (s < len(sell_pos))
+    s_safe = np.minimum(s, max(len(sell_pos) - 1, 0))
+    valid &= (sell_start[s_safe] <= left) & (left < sell_end[s_safe]) if len(sell_pos) else False
+
+    return buy_pos[b[valid]], sell_pos[s_safe[valid]], (right - left)[valid]
+
+
+class TradeAnalysis:
+    def __init__(self, trade_history):
+        """
+        基于成交记录的交易级分析（FIFO批次匹配出每个回合的盈亏）
+        :param trade_history: Account.trade_history（字典列表）或同结构的DataFrame
+        """
+        trades = pd.DataFrame(trade_history)
+        self.trades = trades
+        self.round_trips = None
+        self.open_lots = None
+        if not trades.empty:
+            self._match()
+
+    def _match(self):
+        """执行FIFO匹配，生成回合明细和未平仓批次"""
+        trades = self.trades
+        security_ids, security_names = pd.factorize(trades['stock_code'])
+        sequence = np.arange(len(trades))
+        order = np.lexsort((sequence, security_ids))
+
+        ids = security_ids[order]
+        is_buy = (trades['action'].to_numpy() == 'buy')[order]
+        amounts = trades['amount'].to_numpy(dtype=np.int64)[order]
+        prices = trades['price'].to_numpy(dtype=np.float64)[order]
+        dates = pd.DatetimeIndex(trades['date']).to_numpy()[order]
+
+        # 含手续费的单位成本/单位收入（缺失时按成交价）
+        cost = trades['cost'].to_numpy(dtype=np.float64)[order] if 'cost' in trades else np.full(len(order), np.nan)
+        revenue = trades['revenue'].to_numpy(dtype=np.float64)[order] if 'revenue' in trades \
+            else np.full(len(order), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unit_cost = np.where(np.isnan(cost), prices, cost / amounts)
+            unit_revenue = np.where(np.isnan(revenue), prices, revenue / amounts)
+
+        buy_index, sell_index, quantity = match_fifo_lots(ids, is_buy, amounts)
+
+        buy_cost = unit_cost[buy_index]
+        sell_revenue = unit_revenue[sell_index]
+        buy_dates = dates[buy_index]
+        sell_dates = dates[sell_index]
+        self.round_trips = pd.DataFrame({
+            'stock_code': security_names[ids[buy_index]],
+            'buy_date': buy_dates,
+            'sell_date': sell_dates,
+            'amount': quantity,
+            'buy_price': prices[buy_index],
+            'sell_price': prices[sell_index],
+            'profit': quantity * (sell_revenue - buy_cost),
+            'return_rate': sell_revenue / buy_cost - 1,
+            'holding_days': (sell_dates - buy_dates).astype('timedelta64[D]').astype(np.int64),
+        })
+
+        # 未平仓批次：每笔买入减去已被卖出匹配的数量
+        matched = np.bincount(buy_index, weights=quantity, minlength=len(order)).astype(np.int64)
+        remaining = np.where(is_buy, amounts - matched, 0)
+        open_pos = np.flatnonzero(remaining > 0)
+        self.open_lots = pd.DataFrame({
+            'stock_code': security_names[ids[open_pos]],
+            'buy_date': dates[open_pos],
+            'amount': remaining[open_pos],
+            'buy_price': prices[open_pos],
+        })
+
+    def get_round_trips(self):
+        """获取回合明细（每行为一个买入批次被一笔卖出平掉的部分）"""
+        return self.round_trips if self.round_trips is not None else pd.DataFrame()
+
+    def get_open_lots(self):
+        """获取尚未平仓的买入批次"""
+        return self.open_lots if self.open_lots is not None else pd.DataFrame()
+
+    def get_win_rate(self):
+        """胜率（盈利回合占比，百分比）"""
+        if self.round_trips is None or self.round_trips.empty:
+            return 0.0
+        return float((self.round_trips['profit'] > 0).mean() * 100)
+
+    def get_profit_factor(self):
+        """盈亏比（总盈利 / 总亏损）"""
+        if self.round_trips is None or self.round_trips.empty:
+            return 0.0
+        profit = self.round_trips['profit']
+        gross_loss = -profit[profit < 0].sum()
+        return float(profit[profit > 0].sum() / gross_loss) if gross_loss > 0 else float('inf')
+
+    def get_avg_trade_return(self):
+        """按成交数量加权的平均回合收益率（百分比）"""
+        if self.round_trips is None or self.round_trips.empty:
+            return 0.0
+        weights = self.round_trips['amount'] * self.round_trips['buy_price']
+        return float(np.average(self.round_trips['return_rate'], weights=weights) * 100)
+
+    def get_summary(self):
+        """交易统计摘要"""
+        round_trips = self.get_round_trips()
+        return {
+            '回合数': len(round_trips),
+            '胜率 (%)': round(self.get_win_rate(), 2),
+            '盈亏比': round(self.get_profit_factor(), 3),
+            '总盈亏': round(float(round_trips['profit'].sum()), 2) if len(round_trips) else 0.0,
+            '平均回合收益率 (%)': round(self.get_avg_trade_return(), 4),
+            '平均持有天数': round(float(round_trips['holding_days'].mean()), 2) if len(round_trips) else 0.0,
+            '未平仓批次数': len(self.get_open_lots()),
+        }
@@ -1,18 +1,93 @@
-import pandas as pd
+import atexit
+import logging
+import logging.handlers
+import queue
 
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
 
-class Log:
-    @staticmethod
-    def info(msg):
-        print(f"[INFO] {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')} - {msg}")
+# setup_logging安装的处理器和后台写文件线程（重复调用时先移除）
+_handlers = []
+_listener = None
+
+
+def setup_logging(level=logging.INFO, log_file=None, console=True, file_level=None, async_file=True, fmt=LOG_FORMAT):
+    """
+    统一配置所有模块的日志（在主程序中调用一次；模块导入时不再自行配置）
+
+    参数:
+    level: 控制台日志级别，低于该级别的日志调用几乎没有开销（不格式化消息）
+    log_file: 日志文件路径（可选）
+    console: 是否输出到控制台
+    file_level: 文件日志级别，默认同level（可设为DEBUG，控制台只看INFO以上）
+    async_file: 是否在后台线程中写文件（QueueHandler + QueueListener），
+                日志文件在网络盘等慢速存储上时避免阻塞回测主循环；本地磁盘上直接写入的开销与入队相当
+    fmt: 日志格式
+    """
+    global _listener
+    root = logging.getLogger()
+    for handler in _handlers:
+        root.removeHandler(handler)
+        handler.close()
+    _handlers.clear()
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+    formatter = logging.Formatter(fmt)
+    levels = []
+    if console:
+        handler = logging.StreamHandler()
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+        _handlers.append(handler)
+        levels.append(level)
+    if log_file:
+        file_level = level if file_level is None else file_level
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        if async_file:
+            records = queue.SimpleQueue()
+            handler = logging.handlers.QueueHandler(records)
+            _listener = logging.handlers.QueueListener(records, file_handler)
+            _listener.start()
+        else:
+            handler = file_handler
+        handler.setLevel(file_level)
+        _handlers.append(handler)
+        levels.append(file_level)
 
-    @staticmethod
-    def error(msg):
-        print(f"[ERROR] {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')} - {msg}")
+    for handler in _handlers:
+        root.addHandler(handler)
+    # 根日志级别取各输出中最低的，使被全部输出过滤掉的日志在调用处就被丢弃
+    root.setLevel(min(levels) if levels else logging.WARNING)
+    return root
+
+
+@atexit.register
+def _stop_listener():
+    """退出时写完队列中剩余的日志"""
+    if _listener is not None:
+        _listener.stop()
+
+
+class Log:
+    def __init__(self, name='strategy'):
+        """
+        策略和交易函数使用的日志对象（保留log.info/log.warning/log.error的用法）
+        基于logging，按级别过滤，消息用%占位符惰性格式化：
+        log.info("买入 %s：%s股", security, amount)
+        """
+        self.logger = logging.getLogger(name)
+        self.debug = self.logger.debug
+        self.info = self.logger.info
+        self.warning = self.logger.warning
+        self.error = self.logger.error
+        self.isEnabledFor = self.logger.isEnabledFor
 
-    @staticmethod
-    def warning(msg):
-        print(f"[WARNING] {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')} - {msg}")
+    def setLevel(self, level):
+        self.logger.setLevel(level)
 
 
 log = Log()  # 实例化log，供策略调用
@@ -1,13 +1,202 @@
+import logging
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import pandas as pd
 import numpy as np
-from Performance_Analysis import PerformanceAnalysis
+from concurrent.futures import ProcessPoolExecutor
+from Performance_Analysis import PerformanceAnalysis, underwater_curve, rolling_metrics
+from Attribution_Analysis import daily_turnover
+
+log = logging.getLogger(__name__)
+
+
+def lttb_downsample(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets降采样：保留曲线形状（峰谷）的前提下把点数降到n_out
+    逐桶选点（桶数即输出点数），桶内三角形面积的计算是向量化的
+
+    参数:
+    x: (n,) 横坐标（数值，日期需先转为整数）
+    y: (n,) 纵坐标
+    n_out: 输出点数
+
+    返回:
+    (n_out,) 被保留的点的下标
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # 首尾点固定保留，中间的点均分到n_out-2个桶；各桶均值一次算好（末尾补上最后一点作为最后一个"下一桶"）
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(np.append(edges, n))
+    avg_x = np.add.reduceat(x, edges) / counts
+    avg_y = np.add.reduceat(y, edges) / counts
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一个桶的平均点作为三角形的第三个顶点
+        area = np.abs((x[previous] - avg_x[i + 1]) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (avg_y[i + 1] - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def _downsample_series(series, max_points):
+    """对按日期索引的Series做LTTB降采样（缺失值先去除）"""
+    series = series.dropna()
+    if max_points is None or len(series) <= max_points:
+        return series
+    keep = lttb_downsample(series.index.asi8 if isinstance(series.index, pd.DatetimeIndex) else np.arange(len(series)),
+                           series.to_numpy(), max_points)
+    return series.iloc[keep]
+
+
+def rolling_sharpe(returns, window, periods_per_year=252):
+    """滚动夏普比率（取rolling_metrics的sharpe列；夏普与基准无关，基准传全零序列）"""
+    flat = pd.Series(0.0, index=returns.index)
+    return rolling_metrics(returns, flat, window, periods_per_year)['sharpe']
+
+
+def render_report(path, nav, benchmark_returns=None, turnover=None, title=None, rolling_window=60,
+                  max_points=2000, dpi=100):
+    """
+    在非交互后端上绘制多面板回测报告并写入文件（PNG/SVG由扩展名决定），不依赖pyplot全局状态，可在多进程中并行调用
+
+    参数:
+    path: 输出文件路径
+    nav: 策略净值或总资产Series（按日期索引）
+    benchmark_returns: 基准日收益率Series
+    turnover: 每日换手率Series
+    title: 报告标题
+    rolling_window: 滚动夏普窗口
+    max_points: 每条曲线最多绘制的点数（超过时LTTB降采样）
+    """
+    nav = nav.dropna()
+    nav = nav / nav.iloc[0]
+    returns = nav.pct_change().fillna(0)
+    drawdown = pd.Series(underwater_curve(nav.to_numpy()), index=nav.index)
+
+    panels = 4 if turnover is not None else 3
+    fig = Figure(figsize=(12, 3 * panels), dpi=dpi)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(panels, 1, sharex=True)
+
+    ax = axes[0]
+    ax.plot(*_xy(_downsample_series(nav - 1, max_points)), label='Strategy', linewidth=1.5)
+    if benchmark_returns is not None:
+        benchmark = benchmark_returns.reindex(nav.index).fillna(0)
+        benchmark.iloc[0] = 0  # 与策略曲线同起点
+        ax.plot(*_xy(_downsample_series((1 + benchmark).cumprod() - 1, max_points)),
+                label='CSI 500 Index', linewidth=1.5)
+    ax.set_ylabel('Cumulative Return')
+    ax.legend(loc='upper left')
+    ax.set_title(title or f'Total Return: {(nav.iloc[-1] - 1) * 100:.2f}%')
+
+    ax = axes[1]
+    x, y = _xy(_downsample_series(drawdown, max_points))
+    ax.fill_between(x, y, 0, color='tab:red', alpha=0.3)
+    ax.plot(x, y, color='tab:red', linewidth=1)
+    ax.set_ylabel('Drawdown')
+
+    ax = axes[2]
+    ax.plot(*_xy(_downsample_series(rolling_sharpe(returns, rolling_window), max_points)), linewidth=1)
+    ax.axhline(0, color='gray', linewidth=0.8)
+    ax.set_ylabel(f'Rolling Sharpe ({rolling_window}d)')
+
+    if turnover is not None:
+        ax = axes[3]
+        ax.plot(*_xy(_downsample_series(turnover.reindex(nav.index).fillna(0), max_points)), linewidth=1)
+        ax.set_ylabel('Turnover')
+
+    for ax in axes:
+        ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+
+def _xy(series):
+    """Series拆分为绘图用的横纵坐标"""
+    return series.index, series.to_numpy()
+
+
+def _render_job(job):
+    """进程池任务：job为render_report的关键字参数字典"""
+    return render_report(**job)
+
+
+def render_reports(jobs, n_workers=None):
+    """
+    并行渲染一批回测报告
+    :param jobs: render_report关键字参数字典的列表（可由BacktestVisualization.report_job生成）
+    :param n_workers: 进程数，None或1时在当前进程顺序渲染
+    :return: 输出文件路径列表
+    """
+    if n_workers and n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            return list(pool.map(_render_job, jobs))
+    return [_render_job(job) for job in jobs]
 
 
 class BacktestVisualization:
-    def __init__(self, account, strategy_returns=None):
+    def __init__(self, account, strategy_returns=None, performance=None, benchmark_returns=None):
+        """
+        :param account: 回测账户
+        :param strategy_returns: 策略日收益率
+        :param performance: 已计算好的PerformanceAnalysis（传入时直接复用，不再重建）
+        :param benchmark_returns: 已有的基准日收益率（传入时不再读取基准CSV）
+        """
         self.account = account
         self.strategy_returns = strategy_returns
+        self.performance = performance
+        self.benchmark_returns = benchmark_returns
+
+    def get_performance(self):
+        """获取绩效分析对象（优先复用）"""
+        if self.performance is None:
+            self.performance = PerformanceAnalysis(self.account, self.benchmark_returns)
+        return self.performance
+
+    def get_benchmark_returns(self):
+        """获取基准日收益率：优先使用已有序列，其次预加载的指数数据，最后读取基准CSV"""
+        if self.benchmark_returns is None:
+            self.benchmark_returns = self.get_performance().get_benchmark_returns()
+        if self.benchmark_returns is None and self.account.dates:
+            self.benchmark_returns = self.calculate_benchmark_returns(self.account.dates[0], self.account.dates[-1])
+        return self.benchmark_returns
+
+    def get_turnover(self):
+        """每日换手率（成交额/昨日总资产，与PositionAttribution.get_turnover一致）"""
+        if not self.account.trade_history or not self.account.dates:
+            return None
+        trades = pd.DataFrame(self.account.trade_history)
+        traded_value = (trades['price'] * trades['amount']).groupby(pd.to_datetime(trades['date'])).sum()
+        assets = pd.Series(self.account.total_assets, index=pd.DatetimeIndex(self.account.dates))
+        return daily_turnover(traded_value, assets, self.account.initial_cash)
+
+    def report_job(self, path, title=None, rolling_window=60, max_points=2000):
+        """生成render_report的参数字典（只含序列数据，可传给进程池）"""
+        return {
+            'path': path,
+            'nav': pd.Series(self.account.total_assets, index=pd.DatetimeIndex(self.account.dates)),
+            'benchmark_returns': self.get_benchmark_returns(),
+            'turnover': self.get_turnover(),
+            'title': title,
+            'rolling_window': rolling_window,
+            'max_points': max_points,
+        }
+
+    def save_report(self, path, title=None, rolling_window=60, max_points=2000):
+        """绘制多面板报告（净值、回撤、滚动夏普、换手率）并写入文件"""
+        return render_report(**self.report_job(path, title, rolling_window, max_points))
 
     def calculate_returns(self):
         """计算策略收益率"""
@@ -35,7 +224,7 @@ class BacktestVisualization:
 
             return benchmark_data
         except Exception as e:
-            print(f"加载基准数据失败: {e}")
+            log.error("加载基准数据失败: %s", e)
             return None
 
     def calculate_benchmark_returns(self, start_date, end_date):
@@ -56,10 +245,18 @@ class BacktestVisualization:
 
         return benchmark_returns
 
-    def plot_results(self):
-        """绘制回测结果 - 修复版本"""
-        # 创建绩效分析对象
-        performance = PerformanceAnalysis(self.account)
+    def plot_results(self, save_path=None, show=True, max_points=2000):
+        """
+        绘制回测结果
+        :param save_path: 传入时在非交互后端绘制多面板报告并写入文件，不弹出窗口
+        :param show: 未传save_path时是否调用plt.show()
+        :param max_points: 写文件时每条曲线最多绘制的点数
+        """
+        if save_path is not None:
+            return self.save_report(save_path, max_points=max_points)
+
+        # 绩效分析对象（优先复用）
+        performance = self.get_performance()
 
         # 使用PerformanceAnalysis类的方法获取收益率数据
         strategy_returns = performance.strategy_returns
@@ -67,22 +264,26 @@ class BacktestVisualization:
         # 计算每日累计收益率
         strategy_cumulative = performance.cumulative_returns
 
-        # 调试信息
-        print("=== 调试信息 ===")
-        print(f"总资产序列长度: {len(self.account.total_assets)}")
-        print(f"日期序列长度: {len(self.account.dates)}")
-        print(f"收益率序列长度: {len(strategy_returns)}")
-        print(f"累计收益率序列长度: {len(strategy_cumulative)}")
-        print(f"总资产范围: {min(self.account.total_assets):.2f} ~ {max(self.account.total_assets):.2f}")
-        print(f"收益率范围: {strategy_returns.min():.4f} ~ {strategy_returns.max():.4f}")
-        print(f"累计收益率范围: {strategy_cumulative.min():.4f} ~ {strategy_cumulative.max():.4f}")
+        # 调试信息（区间统计只在DEBUG时计算）
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("总资产序列长度: %s, 日期序列长度: %s, 收益率序列长度: %s, 累计收益率序列长度: %s",
+                      len(self.account.total_assets), len(self.account.dates), len(strategy_returns),
+                      len(strategy_cumulative))
+            log.debug("总资产范围: %.2f ~ %.2f", min(self.account.total_assets), max(self.account.total_assets))
+            log.debug("收益率范围: %.4f ~ %.4f", strategy_returns.min(), strategy_returns.max())
+            log.debug("累计收益率范围: %.4f ~ %.4f", strategy_cumulative.min(), strategy_cumulative.max())
 
         # 获取回测时间范围
         start_date = self.account.dates[0]
         end_date = self.account.dates[-1]
 
-        # 计算中证500指数收益率
-        benchmark_returns = self.calculate_benchmark_returns(start_date, end_date)
+        # 中证500指数收益率（优先复用已有序列）
+        benchmark_returns = self.get_benchmark_returns()
+        if benchmark_returns is not None:
+            benchmark_returns = benchmark_returns[(benchmark_returns.index >= start_date) &
+                                                  (benchmark_returns.index <= end_date)].fillna(0)
+            if len(benchmark_returns) > 0:
+                benchmark_returns.iloc[0] = 0  # 与策略曲线同起点
 
         plt.figure(figsize=(12, 6))
 
@@ -106,13 +307,13 @@ class BacktestVisualization:
         plt.grid(True, alpha=0.3)
 
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
 
     def print_performance(self):
         """打印绩效指标"""
-        # 创建PerformanceAnalysis实例
-        from Performance_Analysis import PerformanceAnalysis
-        performance_analyzer = PerformanceAnalysis(self.account)
+        # 复用PerformanceAnalysis实例
+        performance_analyzer = self.get_performance()
 
         # 使用PerformanceAnalysis计算各项指标
         total_return = performance_analyzer.get_total_return()
@@ -122,14 +323,14 @@ class BacktestVisualization:
         trade_count = performance_analyzer.get_trade_count()
         buy_count, sell_count = performance_analyzer.get_buy_sell_count()
 
-        print(f"\n绩效指标:")
-        print(f"总收益率: {total_return:.2f}%")
-        print(f"年化收益率: {annualized_return:.2f}%")
-        print(f"夏普比率: {sharpe_ratio:.2f}")
-        print(f"最大回撤: {max_drawdown:.2f}%")
-        print(f"交易次数: {trade_count}")
+        log.info("绩效指标:")
+        log.info("总收益率: %.2f%%", total_return)
+        log.info("年化收益率: %.2f%%", annualized_return)
+        log.info("夏普比率: %.2f", sharpe_ratio)
+        log.info("最大回撤: %.2f%%", max_drawdown)
+        log.info("交易次数: %s", trade_count)
 
         # 打印交易统计
-        print(f"\n交易统计:")
-        print(f"买入次数: {buy_count}")
-        print(f"卖出次数: {sell_count}")
\ No newline at end of file
+        log.info("交易统计:")
+        log.info("买入次数: %s", buy_count)
+        log.info("卖出次数: %s", sell_count)
\ No newline at end of file
@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import uuid
+import pickle
+import socket
+import logging
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+log = logging.getLogger(__name__)
+
+# 任务文件所在的子目录：待领取、运行中、已完成、失败
+PENDING, RUNNING, RESULTS, FAILED = 'pending', 'running', 'results', 'failed'
+
+
+def _atomic_dump(obj, path):
+    """写入临时文件后原子替换，读者不会看到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def make_worker_id():
+    """工作进程标识：主机名-进程号-随机后缀（不含'.'，用于文件名）"""
+    host = socket.gethostname().replace('.', '-')
+    return f"{host}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class Lease:
+    def __init__(self, task_id, attempt, path, payload):
+        """
+        一次任务领取（租约）
+        :param path: running目录下的任务文件，其修改时间即租约的最近心跳时间
+        """
+        self.task_id = task_id
+        self.attempt = attempt
+        self.path = path
+        self.payload = payload
+        self.lost = False  # 租约过期被其他进程重新入队
+
+    def heartbeat(self):
+        """刷新租约，返回租约是否仍然有效"""
+        try:
+            os.utime(self.path)
+            return True
+        except FileNotFoundError:
+            self.lost = True
+            return False
+
+
+class Heartbeat:
+    def __init__(self, lease, interval):
+        """任务运行期间在后台线程中定期刷新租约（with语句使用）"""
+        self.lease = lease
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.lease.heartbeat():
+                log.warning("任务 %s 的租约已失效（已被重新入队）", self.lease.task_id)
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class WorkQueue:
+    def __init__(self, queue_dir, lease_seconds=None, max_attempts=None):
+        """
+        基于共享目录的任务队列：任意多台机器上的任意多个工作进程只要能访问同一目录即可领取任务
+
+        - 领取：把任务文件从pending原子重命名到running（文件名带工作进程标识），同一任务只有一个进程能成功；
+        - 租约：运行中的工作进程定期刷新running文件的修改时间，超过lease_seconds未刷新视为进程已崩溃，
+          任务被重新放回pending（尝试次数+1），超过max_attempts次后移入failed；
+        - 结果：先写临时文件再原子替换到results目录，然后删除running文件。
+        任务是(函数, 参数)，函数需可在工作进程中按模块名导入（不能是lambda或局部函数）。
+
+        参数:
+        queue_dir: 队列目录（首次创建时写入配置，之后的进程沿用配置）
+        lease_seconds: 租约时长（秒），默认300
+        max_attempts: 每个任务最多尝试次数，默认3
+        """
+        self.queue_dir = queue_dir
+        for name in (PENDING, RUNNING, RESULTS, FAILED):
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+        config_path = os.path.join(queue_dir, 'config.json')
+        config = {}
+        if os.path.exists(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        if lease_seconds is not None:
+            config['lease_seconds'] = lease_seconds
+        if max_attempts is not None:
+            config['max_attempts'] = max_attempts
+        config.setdefault('lease_seconds', 300)
+        config.setdefault('max_attempts', 3)
+        if lease_seconds is not None or max_attempts is not None or not os.path.exists(config_path):
+            tmp_path = f"{config_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(config, f)
+            os.replace(tmp_path, config_path)
+        self.lease_seconds = config['lease_seconds']
+        self.max_attempts = config['max_attempts']
+
+    def _dir(self, name):
+        return os.path.join(self.queue_dir, name)
+
+    def _files(self, name):
+        """子目录中的任务文件（忽略写入中的临时文件）"""
+        try:
+            return sorted(f for f in os.listdir(self._dir(name)) if f.endswith('.pkl'))
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _parse(filename):
+        """任务文件名 -> (任务编号, 尝试次数, 工作进程标识)"""
+        parts = filename[:-len('.pkl')].split('.')
+        return parts[0], int(parts[1]) if len(parts) > 1 else 0, parts[2] if len(parts) > 2 else None
+
+    def set_setup(self, func, args=()):
+        """设置工作进程启动时执行一次的初始化（如加载数据）"""
+        _atomic_dump((func, tuple(args)), os.path.join(self.queue_dir, 'setup.pkl'))
+
+    def get_setup(self):
+        path = os.path.join(self.queue_dir, 'setup.pkl')
+        return _load(path) if os.path.exists(path) else None
+
+    def put(self, task_id, func, args=(), kwargs=None):
+        """
+        加入任务（已完成、排队中或运行中的同编号任务不重复加入；此前失败的任务重新加入）
+        :param task_id: 任务编号（字符串，不能含'.'）
+        :return: 是否加入
+        """
+        task_id = str(task_id)
+        if '.' in task_id:
+            raise ValueError(f"任务编号不能包含'.': {task_id}")
+        if os.path.exists(os.path.join(self._dir(RESULTS), f"{task_id}.pkl")):
+            return False
+        prefix = f"{task_id}."
+        if any(f.startswith(prefix) for name in (PENDING, RUNNING) for f in self._files(name)):
+            return False
+        try:
+            os.remove(os.path.join(self._dir(FAILED), f"{task_id}.pkl"))
+        except FileNotFoundError:
+            pass
+        _atomic_dump((func, tuple(args), kwargs or {}), os.path.join(self._dir(PENDING), f"{task_id}.0.pkl"))
+        return True
+
+    def claim(self, worker_id):
+        """
+        领取一个待运行任务
+        :return: Lease，没有可领取的任务时返回None
+        """
+        for filename in self._files(PENDING):
+            task_id, attempt, _ = self._parse(filename)
+            source = os.path.join(self._dir(PENDING), filename)
+            if os.path.exists(os.path.join(self._dir(RESULTS), f"{task_id}.pkl")):
+                # 租约过期后被重新入队、但原进程最终完成了的任务
+                try:
+                    os.remove(source)
+                except FileNotFoundError:
+                    pass
+                continue
+            target = os.path.join(self._dir(RUNNING), f"{task_id}.{attempt}.{worker_id}.pkl")
+            try:
+                os.rename(source, target)
+            except FileNotFoundError:  # 被其他进程抢先领取
+                continue
+            os.utime(target)  # 租约从领取时刻开始计算
+            try:
+                payload = _load(target)
+            except Exception as e:
+                log.error("任务 %s 文件损坏: %s", task_id, e)
+                self._move_to_failed(target, task_id, f"任务文件损坏: {e}")
+                continue
+            return Lease(task_id, attempt, target, payload)
+        return None
+
+    def complete(self, lease, result):
+        """写入任务结果并释放租约（租约在最后一次尝试时过期被移入failed的，以结果为准删除失败记录）"""
+        _atomic_dump(result, os.path.join(self._dir(RESULTS), f"{lease.task_id}.pkl"))
+        for path in (lease.path, os.path.join(self._dir(FAILED), f"{lease.task_id}.pkl")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # 租约已过期被重新入队，结果仍然有效
+                pass
+
+    def fail(self, lease, error):
+        """任务抛出异常：记录错误并移入failed（不再重试）"""
+        self._move_to_failed(lease.path, lease.task_id, error)
+
+    def _move_to_failed(self, path, task_id, error):
+        # 保留任务参数，汇总时可据此还原失败的是哪个任务（任务文件损坏时为None）
+        try:
+            args = _load(path)[1]
+        except Exception:
+            args = None
+        _atomic_dump({'task_id': task_id, 'error': error, 'args': args},
+                     os.path.join(self._dir(FAILED), f"{task_id}.pkl"))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _now(self):
+        """
+        共享文件系统的当前时间：刷新队列目录下本主机的时钟文件并读取其修改时间
+        租约的心跳时间同样由文件系统写入，两者比较不受各主机本地时钟偏差的影响
+        """
+        path = os.path.join(self.queue_dir, f".clock-{socket.gethostname().replace('.', '-')}")
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            open(path, 'a').close()
+        return os.stat(path).st_mtime
+
+    def requeue_expired(self):
+        """
+        把租约过期（工作进程崩溃或失联）的任务放回pending，超过最大尝试次数的移入failed
+        租约时长按文件系统的时间计算（见_now），而不是本机的time.time()
+        :return: 重新入队的任务数
+        """
+        now = self._now()
+        requeued = 0
+        for filename in self._files(RUNNING):
+            path = os.path.join(self._dir(RUNNING), filename)
+            try:
+                if now - os.stat(path).st_mtime <= self.lease_seconds:
+                    continue
+            except FileNotFoundError:
+                continue
+            task_id, attempt, worker_id = self._parse(filename)
+            if attempt + 1 >= self.max_attempts:
+                log.error("任务 %s 已尝试%s次仍未完成，放弃", task_id, attempt + 1)
+                self._move_to_failed(path, task_id, f"租约过期{attempt + 1}次（最后的工作进程: {worker_id}）")
+                continue
+            try:
+                os.rename(path, os.path.join(self._dir(PENDING), f"{task_id}.{attempt + 1}.pkl"))
+            except FileNotFoundError:  # 已完成或已被其他进程重新入队
+                continue
+            log.warning("任务 %s 的租约已过期（工作进程: %s），重新入队", task_id, worker_id)
+            requeued += 1
+        return requeued
+
+    def status(self):
+        """各状态的任务数"""
+        return {name: len(self._files(name)) for name in (PENDING, RUNNING, RESULTS, FAILED)}
+
+    def is_finished(self):
+        """没有待运行和运行中的任务"""
+        return not self._files(PENDING) and not self._files(RUNNING)
+
+    def wait(self, poll_interval=5.0, timeout=None):
+        """
+        等待全部任务结束（期间负责回收过期租约）
+        :return: 是否在超时前全部结束
+        """
+        started = time.time()
+        while True:
+            self.requeue_expired()
+            if self.is_finished():
+                return True
+            if timeout is not None and time.time() - started > timeout:
+                return False
+            time.sleep(poll_interval)
+
+    def results(self):
+        """{任务编号: 结果}"""
+        results = {}
+        for filename in self._files(RESULTS):
+            try:
+                results[filename[:-len('.pkl')]] = _load(os.path.join(self._dir(RESULTS), filename))
+            except Exception as e:
+                log.warning("读取结果失败 %s: %s", filename, e)
+        return results
+
+    def failures(self, with_args=False):
+        """{任务编号: 错误信息}；with_args=True时为{任务编号: (错误信息, 任务的args)}"""
+        records = (_load(os.path.join(self._dir(FAILED), f)) for f in self._files(FAILED))
+        if with_args:
+            return {record['task_id']: (record['error'], record.get('args')) for record in records}
+        return {record['task_id']: record['error'] for record in records}
+
+
+def run_worker(queue_dir, poll_interval=2.0, max_tasks=None, worker_id=None):
+    """
+    工作进程主循环：领取任务、运行、写回结果，直到队列中没有待运行和运行中的任务
+    （其他进程的任务仍在运行时继续等待，以便接手它们过期的租约）
+    :param max_tasks: 最多运行的任务数（None为不限）
+    :return: 本进程完成的任务数
+    """
+    queue = WorkQueue(queue_dir)
+    worker_id = worker_id or make_worker_id()
+    setup = queue.get_setup()
+    if setup is not None:
+        func, args = setup
+        func(*args)
+
+    done = 0
+    while max_tasks is None or done < max_tasks:
+        queue.requeue_expired()
+        lease = queue.claim(worker_id)
+        if lease is None:
+            if queue.is_finished():
+                break
+            time.sleep(poll_interval)
+            continue
+
+        func, args, kwargs = lease.payload
+        with Heartbeat(lease, max(queue.lease_seconds / 3, 0.1)):
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                log.error("任务 %s 运行失败", lease.task_id)
+                queue.fail(lease, traceback.format_exc())
+                continue
+        queue.complete(lease, result)
+        done += 1
+    return done
+
+
+def run_local_workers(queue_dir, n_workers, poll_interval=2.0):
+    """在本机启动n_workers个工作进程并等待结束"""
+    processes = [multiprocessing.Process(target=run_worker, args=(queue_dir, poll_interval))
+                 for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="从共享目录的任务队列中领取并运行任务")
+    parser.add_argument('queue_dir', help="队列目录")
+    parser.add_argument('--workers', type=int, default=1, help="本机启动的工作进程数")
+    parser.add_argument('--poll', type=float, default=2.0, help="没有任务时的轮询间隔（秒）")
+    parser.add_argument('--status', action='store_true', help="只打印队列状态")
+    cli_args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if cli_args.status:
+        print(WorkQueue(cli_args.queue_dir).status())
+    elif cli_args.workers > 1:
+        run_local_workers(cli_args.queue_dir, cli_args.workers, cli_args.poll)
+    else:
+        run_worker(cli_args.queue_dir, cli_args.poll)
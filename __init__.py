@@ -1,8 +1,14 @@
+import logging
 import pandas as pd
+from Utilities import setup_logging
 from Data_Handling import DataHandler, get_data_handler
 from Backtest_Engine import BacktestEngine
 from Strategy_Core import WeightBasedStrategy
 
+# 0. 配置日志：控制台输出INFO及以上；只需要文件日志时可用
+#    setup_logging(logging.WARNING, log_file='backtest.log', file_level=logging.INFO)，写文件在后台线程进行
+setup_logging(logging.INFO)
+
 # 1. 初始化数据处理器（全局单例，预加载所有数据）
 file_path = r"D:\read\task\机器学习数据.pkl"
 data_handler = DataHandler(file_path)
@@ -1,15 +1,18 @@
+import itertools
 import pandas as pd
 import numpy as np
 from Utilities import log
+from Data_Handling import resolve_field
 
 
 class Order:
-    """订单类，用于记录订单信息"""
-    ORDER_ID = 0  # 类变量，用于生成唯一订单ID
+    """订单类，用于记录订单信息（使用__slots__，避免每个订单携带__dict__）"""
+    __slots__ = ('order_id', 'security', 'amount', 'original_amount', 'style', 'side', 'pindex',
+                 'close_today', 'status', 'filled_amount', 'filled_price', 'create_time', 'fill_time')
 
-    def __init__(self, security, amount, style=None, side='long', pindex=0, close_today=False):
-        Order.ORDER_ID += 1
-        self.order_id = Order.ORDER_ID
+    def __init__(self, order_id, security, amount, style=None, side='long', pindex=0, close_today=False,
+                 create_time=None):
+        self.order_id = order_id  # 订单ID（由所属TradingFunctions实例分配）
         self.security = security  # 股票代码
         self.amount = amount  # 数量（正数为买入，负数为卖出）
         self.original_amount = amount  # 原始委托数量
@@ -20,7 +23,7 @@ class Order:
         self.status = 'open'  # 订单状态：open, filled, cancelled, partial
         self.filled_amount = 0  # 已成交数量
         self.filled_price = 0.0  # 成交均价
-        self.create_time = pd.Timestamp.now()  # 创建时间
+        self.create_time = create_time  # 创建时间（回测模拟时钟current_dt）
         self.fill_time = None  # 成交时间
 
     def __repr__(self):
@@ -28,18 +31,213 @@ class Order:
                 f"status={self.status}, filled={self.filled_amount})")
 
 
+class MarketOrderStyle:
+    """市价单：下单时按当前收盘价立即成交（默认方式）"""
+    __slots__ = ()
+
+
+class OpenOrderStyle:
+    """开盘市价单：挂入待成交队列，按下一根K线的开盘价成交"""
+    __slots__ = ('expire_bars',)
+
+    def __init__(self, expire_bars=1):
+        self.expire_bars = expire_bars  # 最多等待的K线数量，None表示一直有效
+
+
+class LimitOrderStyle:
+    """限价单：买单在最低价触及限价时成交，卖单在最高价触及限价时成交"""
+    __slots__ = ('limit_price', 'expire_bars')
+
+    def __init__(self, limit_price, expire_bars=None):
+        self.limit_price = limit_price
+        self.expire_bars = expire_bars
+
+
+class StopOrderStyle:
+    """止损/止盈单：买单在最高价触及触发价时成交，卖单在最低价触及触发价时成交"""
+    __slots__ = ('stop_price', 'expire_bars')
+
+    def __init__(self, stop_price, expire_bars=None):
+        self.stop_price = stop_price
+        self.expire_bars = expire_bars
+
+
+class PendingOrderQueue:
+    """
+    待成交订单队列（列式存储）
+    所有挂单的代码、类型、价格、剩余数量保存在NumPy数组中，
+    每根K线只做一次向量化撮合，挂单数量再多每根K线的开销也基本不变
+    """
+    KIND_OPEN = 0
+    KIND_LIMIT = 1
+    KIND_STOP = 2
+
+    def __init__(self):
+        self.order_ids = np.empty(0, dtype=np.int64)
+        self.orders = np.empty(0, dtype=object)
+        self.securities = np.empty(0, dtype=object)
+        self.kinds = np.empty(0, dtype=np.int8)
+        self.prices = np.empty(0, dtype=np.float64)
+        self.remaining = np.empty(0, dtype=np.int64)  # 剩余数量（正数为买入，负数为卖出）
+        self.bars_left = np.empty(0, dtype=np.int64)  # 剩余有效K线数，-1表示一直有效
+        self._new_orders = []  # 新挂单先缓存，撮合前一次性并入数组
+        self._cancelled_ids = set()
+
+    def __len__(self):
+        return len(self.order_ids) + len(self._new_orders)
+
+    def add(self, order):
+        """挂入一笔订单"""
+        style = order.style
+        if isinstance(style, LimitOrderStyle):
+            kind, price = self.KIND_LIMIT, style.limit_price
+        elif isinstance(style, StopOrderStyle):
+            kind, price = self.KIND_STOP, style.stop_price
+        else:
+            kind, price = self.KIND_OPEN, np.nan
+        expire_bars = getattr(style, 'expire_bars', None)
+        self._new_orders.append((order.order_id, order, order.security, kind, price, order.amount,
+                                 -1 if expire_bars is None else expire_bars))
+
+    def cancel(self, order):
+        """标记撤单，下一次撮合时移出队列"""
+        self._cancelled_ids.add(order.order_id)
+
+    def _flush(self):
+        """将新挂单并入列式数组"""
+        if not self._new_orders:
+            return
+        ids, orders, securities, kinds, prices, amounts, bars = zip(*self._new_orders)
+        new_orders = np.empty(len(orders), dtype=object)
+        new_orders[:] = orders
+        self.order_ids = np.concatenate([self.order_ids, np.asarray(ids, dtype=np.int64)])
+        self.orders = np.concatenate([self.orders, new_orders])
+        self.securities = np.concatenate([self.securities, np.asarray(securities, dtype=object)])
+        self.kinds = np.concatenate([self.kinds, np.asarray(kinds, dtype=np.int8)])
+        self.prices = np.concatenate([self.prices, np.asarray(prices, dtype=np.float64)])
+        self.remaining = np.concatenate([self.remaining, np.asarray(amounts, dtype=np.int64)])
+        self.bars_left = np.concatenate([self.bars_left, np.asarray(bars, dtype=np.int64)])
+        self._new_orders = []
+
+    def _keep(self, mask):
+        """按掩码压缩队列"""
+        self.order_ids = self.order_ids[mask]
+        self.orders = self.orders[mask]
+        self.securities = self.securities[mask]
+        self.kinds = self.kinds[mask]
+        self.prices = self.prices[mask]
+        self.remaining = self.remaining[mask]
+        self.bars_left = self.bars_left[mask]
+
+    def match(self, bars, volume_ratio=None):
+        """
+        按当根K线对所有挂单做一次向量化撮合
+        :param bars: 当日全部股票的K线数据（DataFrame，索引为股票代码，含open/high/low/vol列）
+        :param volume_ratio: 单笔订单每根K线最多成交的成交量比例，None表示不限制
+        :return: (触发订单的下标, 成交价, 成交数量)，数量为正数买入、负数卖出
+        """
+        self._flush()
+        if self._cancelled_ids:
+            self._keep(~np.isin(self.order_ids, list(self._cancelled_ids)))
+            self._cancelled_ids.clear()
+
+        n = len(self.order_ids)
+        if n == 0 or bars is None or len(bars) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64)
+
+        # 将当日行情按挂单的股票代码对齐（缺失行情的挂单本根K线不成交）
+        pos = bars.index.get_indexer(self.securities)
+        has_bar = pos >= 0
+        safe_pos = np.where(has_bar, pos, 0)
+
+        def column(name):
+            if name not in bars.columns:
+                return np.full(n, np.nan)
+            values = bars[name].to_numpy(dtype=np.float64)[safe_pos]
+            values[~has_bar] = np.nan
+            return values
+
+        open_, high, low, vol = column('open'), column('high'), column('low'), column('vol')
+
+        is_buy = self.remaining > 0
+        is_open = self.kinds == self.KIND_OPEN
+        is_limit = self.kinds == self.KIND_LIMIT
+        is_stop = self.kinds == self.KIND_STOP
+
+        # 触发条件：限价买/止损卖看最低价，限价卖/止损买看最高价（NaN比较结果为False）
+        touch_low = low <= self.prices
+        touch_high = high >= self.prices
+        triggered = (is_open |
+                     (is_limit & np.where(is_buy, touch_low, touch_high)) |
+                     (is_stop & np.where(is_buy, touch_high, touch_low)))
+
+        # 成交价：开盘跳空越过委托价时按开盘价成交
+        better_for_buyer = np.fmin(open_, self.prices)
+        better_for_seller = np.fmax(open_, self.prices)
+        fill_price = np.where(is_open, open_,
+                              np.where(is_limit,
+                                       np.where(is_buy, better_for_buyer, better_for_seller),
+                                       np.where(is_buy, better_for_seller, better_for_buyer)))
+        triggered &= has_bar & (fill_price > 0)
+
+        # 成交量约束：tushare的vol单位为手（100股）
+        fill_amount = np.abs(self.remaining)
+        if volume_ratio is not None:
+            capacity = np.floor(np.nan_to_num(vol) * 100 * volume_ratio).astype(np.int64)
+            fill_amount = np.minimum(fill_amount, capacity)
+        triggered &= fill_amount > 0
+
+        index = np.flatnonzero(triggered)
+        return index, fill_price[index], np.where(is_buy[index], fill_amount[index], -fill_amount[index])
+
+    def settle(self, index, filled):
+        """
+        根据实际成交数量更新剩余数量，处理到期订单并压缩队列
+        :param index: match返回的订单下标
+        :param filled: 每笔订单实际成交数量（带符号）
+        :return: 本次到期的订单列表
+        """
+        self.remaining[index] -= filled
+        self.bars_left[self.bars_left > 0] -= 1
+        done = self.remaining == 0
+        expired = ~done & (self.bars_left == 0)
+        expired_orders = list(self.orders[expired])
+        self._keep(~(done | expired))
+        return expired_orders
+
+
 class TradingFunctions:
-    def __init__(self, context):
+    def __init__(self, context, volume_ratio=None):
+        """
+        :param context: 回测上下文
+        :param volume_ratio: 挂单每根K线最多成交当日成交量的比例（部分成交），None表示不限制
+        """
         self.context = context
         self.orders = []  # 所有订单列表
         self.trades = []  # 所有成交记录
+        self._order_ids = itertools.count(1)  # 每个实例独立的订单ID计数器，并行回测互不干扰
+        self.pending = PendingOrderQueue()  # 待成交订单队列（开盘/限价/止损单）
+        self.volume_ratio = volume_ratio
+
+    def __getstate__(self):
+        """序列化时把订单ID计数器保存为下一个ID（itertools.count的序列化在新版本Python中已移除）"""
+        next_id = next(self._order_ids)
+        self._order_ids = itertools.count(next_id)
+        state = self.__dict__.copy()
+        state['_order_ids'] = next_id
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._order_ids = itertools.count(state['_order_ids'])
 
     def order(self, security, amount, style=None, side='long', pindex=0, close_today=False):
         """
         按股数下单
         :param security: 股票代码
         :param amount: 下单数量（正数为买入，负数为卖出）
-        :param style: 下单方式
+        :param style: 下单方式（None/MarketOrderStyle立即成交；OpenOrderStyle、LimitOrderStyle、
+                      StopOrderStyle挂入待成交队列，从下一根K线开始撮合）
         :param side: 多空方向
         :param pindex: 价格指数
         :param close_today: 是否平今
@@ -49,21 +247,27 @@ class TradingFunctions:
             log.warning("下单数量不能为0")
             return None
 
-        # 创建订单
+        # 创建订单（时间戳使用回测引擎的模拟时钟）
         order = Order(
+            order_id=next(self._order_ids),
             security=security,
             amount=amount,
             style=style,
             side=side,
             pindex=pindex,
-            close_today=close_today
+            close_today=close_today,
+            create_time=self.context.get('current_dt')
         )
 
-        # 尝试立即成交（简化处理，实际回测中可能需要根据市场情况处理）
-        self._execute_order(order)
+        if style is None or isinstance(style, MarketOrderStyle):
+            # 市价单立即按当前收盘价成交
+            self._execute_order(order)
+        else:
+            # 其余方式挂单，由引擎在后续K线统一撮合
+            self.pending.add(order)
 
         self.orders.append(order)
-        log.info(f"创建订单: {order}")
+        log.info("创建订单: %s", order)
         return order
 
     def order_target(self, security, amount, style=None, side='long', pindex=0, close_today=False):
@@ -81,7 +285,7 @@ class TradingFunctions:
         current_amount = account.positions.get(security, 0)
         order_amount = amount - current_amount
         if order_amount == 0:
-            log.info(f"目标持仓已达，无需下单: {security}")
+            log.info("目标持仓已达，无需下单: %s", security)
             return None
         return self.order(security, order_amount, style, side, pindex, close_today)
 
@@ -100,22 +304,20 @@ class TradingFunctions:
             log.warning("下单金额不能为0")
             return None
 
-        # 获取当前价格
-        from Data_Handling import get_price
-        current_data = get_price(security, count=1, fields=['Clsprc'], end_date=self.context['current_dt'])
-        if len(current_data) == 0:
-            log.error(f"无法获取 {security} 价格数据，下单失败")
+        # 获取当前价格（优先使用引擎提供的当日截面）
+        current_price = self._get_current_price(security)
+        if current_price is None:
+            log.error("无法获取 %s 价格数据，下单失败", security)
             return None
 
-        current_price = current_data['Clsprc'].iloc[-1]
         if current_price <= 0:
-            log.error(f"无效价格: {current_price}，下单失败")
+            log.error("无效价格: %s，下单失败", current_price)
             return None
 
         # 计算股数（向下取整，确保金额不超过指定值）
         amount = int(abs(value) / current_price)
         if amount <= 0:
-            log.warning(f"计算出的下单数量为0: {security}")
+            log.warning("计算出的下单数量为0: %s", security)
             return None
 
         # 保持与价值相同的方向（正为买，负为卖）
@@ -133,22 +335,54 @@ class TradingFunctions:
         :param close_today: 是否平今
         :return: 订单对象
         """
-        # 获取当前价格
-        from Data_Handling import get_price
-        current_data = get_price(security, count=1, fields=['Clsprc'], end_date=self.context['current_dt'])
-        if len(current_data) == 0:
-            log.error(f"无法获取 {security} 价格数据，下单失败")
+        # 获取当前价格（优先使用引擎提供的当日截面）
+        current_price = self._get_current_price(security)
+        if current_price is None:
+            log.error("无法获取 %s 价格数据，下单失败", security)
             return None
 
-        current_price = current_data['Clsprc'].iloc[-1]
         if current_price <= 0:
-            log.error(f"无效价格: {current_price}，下单失败")
+            log.error("无效价格: %s，下单失败", current_price)
             return None
 
         # 计算目标股数
         target_amount = int(abs(value) / current_price) if current_price != 0 else 0
         return self.order_target(security, target_amount, style, side, pindex, close_today)
 
+    def order_target_values(self, targets, style=None, side='long', pindex=0, close_today=False):
+        """
+        批量目标价值下单（按当日截面一次性计算所有股票的目标股数）
+        先下卖单再下买单，使卖出释放的现金可用于买入
+        :param targets: 目标持仓价值，dict或Series（股票代码 -> 目标价值）
+        :param style: 下单方式
+        :param side: 多空方向
+        :param pindex: 价格指数
+        :param close_today: 是否平今
+        :return: 订单对象列表
+        """
+        targets = pd.Series(targets, dtype='float64')
+        if targets.empty:
+            return []
+
+        prices = self._get_current_prices(targets.index)
+        valid = prices > 0
+        if not valid.all():
+            log.error("无法获取 %s 只股票的有效价格，已跳过", int((~valid).sum()))
+        targets, prices = targets[valid], prices[valid]
+
+        positions = self.context['account'].positions
+        target_amounts = np.floor(targets.abs().to_numpy() / prices.to_numpy()).astype(np.int64)
+        current_amounts = np.fromiter((positions.get(security, 0) for security in targets.index),
+                                      dtype=np.int64, count=len(targets))
+        deltas = target_amounts - current_amounts
+
+        orders = []
+        for k in np.concatenate([np.flatnonzero(deltas < 0), np.flatnonzero(deltas > 0)]):
+            order = self.order(targets.index[k], int(deltas[k]), style, side, pindex, close_today)
+            if order is not None:
+                orders.append(order)
+        return orders
+
     def cancel_order(self, order):
         """
         撤单
@@ -160,13 +394,65 @@ class TradingFunctions:
             return False
 
         if order.status != 'open' and order.status != 'partial':
-            log.warning(f"订单 {order.order_id} 无法撤销，当前状态: {order.status}")
+            log.warning("订单 %s 无法撤销，当前状态: %s", order.order_id, order.status)
             return False
 
         order.status = 'cancelled'
-        log.info(f"订单已撤销: {order}")
+        self.pending.cancel(order)
+        log.info("订单已撤销: %s", order)
         return True
 
+    def has_pending_orders(self):
+        """是否存在待撮合的挂单"""
+        return len(self.pending) > 0
+
+    def match_pending_orders(self, date, bars):
+        """
+        撮合待成交队列（由回测引擎每根K线调用一次）
+        :param date: 当前K线日期
+        :param bars: 当日全部股票的K线数据（DataFrame，索引为股票代码）
+        :return: 本次成交的订单数量
+        """
+        index, prices, amounts = self.pending.match(bars, self.volume_ratio)
+
+        # 成交判断已向量化完成，这里只对触发的订单逐笔记账（现金和持仓随成交变化）
+        filled = np.zeros(len(index), dtype=np.int64)
+        for k in range(len(index)):
+            order = self.pending.orders[index[k]]
+            filled[k] = self._apply_fill(order, int(amounts[k]), float(prices[k]), date)
+
+        for order in self.pending.settle(index, filled):
+            order.status = 'expired'
+            log.info("订单已过期: %s", order)
+
+        return int(np.count_nonzero(filled))
+
+    def _apply_fill(self, order, amount, price, date):
+        """
+        按给定价格成交订单的一部分，受现金和持仓约束
+        :param amount: 拟成交数量（正数买入，负数卖出）
+        :return: 实际成交数量（带符号）
+        """
+        account = self.context['account']
+        if amount > 0:
+            fill_amount = min(amount, self._calculate_max_buy_amount(account.cash, price))
+            if fill_amount <= 0 or not account.buy(date, order.security, price, fill_amount):
+                return 0
+            signed_amount = fill_amount
+        else:
+            fill_amount = min(-amount, account.positions.get(order.security, 0))
+            if fill_amount <= 0 or not account.sell(date, order.security, price, fill_amount):
+                return 0
+            signed_amount = -fill_amount
+
+        self._record_trade(order, signed_amount, price, date)
+        total_filled = order.filled_amount + fill_amount
+        order.filled_price = (order.filled_price * order.filled_amount + price * fill_amount) / total_filled
+        order.filled_amount = total_filled
+        order.fill_time = date
+        order.status = 'filled' if total_filled == abs(order.original_amount) else 'partial'
+        return signed_amount
+
     def get_open_orders(self):
         """
         获取未完成订单
@@ -209,15 +495,12 @@ class TradingFunctions:
         date = self.context['current_dt']
 
         # 获取当前价格
-        from Data_Handling import get_price
-        current_data = get_price(order.security, count=1, fields=['Clsprc'], end_date=date)
-        if len(current_data) == 0:
+        current_price = self._get_current_price(order.security)
+        if current_price is None:
             order.status = 'failed'
-            log.error(f"订单执行失败，无法获取 {order.security} 价格数据")
+            log.error("订单执行失败，无法获取 %s 价格数据", order.security)
             return
 
-        current_price = current_data['Clsprc'].iloc[-1]
-
         # 处理买入订单
         if order.amount > 0:
             # 计算可买入数量（考虑手续费）
@@ -263,7 +546,54 @@ class TradingFunctions:
                 order.fill_time = date
                 order.status = 'filled' if fill_amount == sell_amount else 'partial'
 
+    def _get_current_price(self, security, field='Clsprc'):
+        """
+        获取单只股票的当前价格
+        优先从引擎每根K线提供的截面（context['current_bars']）中读取，缺失时再回退到逐只查询
+        :param field: 价格字段，支持CSMAR字段名（Clsprc、Opnprc等）或tushare字段名
+        :return: 价格，无法获取时返回None
+        """
+        column = resolve_field(field)
+        bars = self.context.get('current_bars')
+        if bars is not None and column in bars.columns:
+            try:
+                price = bars.at[security, column]
+                if not pd.isna(price):
+                    return float(price)
+            except KeyError:
+                pass
+
+        from Data_Handling import get_price
+        current_data = get_price(security, count=1, fields=[column], end_date=self.context['current_dt'])
+        if len(current_data) == 0 or column not in current_data.columns:
+            return None
+        return float(current_data[column].iloc[-1])
+
+    def _get_current_prices(self, securities, field='Clsprc'):
+        """
+        批量获取多只股票的当前价格（基于当日截面向量化对齐）
+        :return: Series（股票代码 -> 价格），缺失价格为NaN
+        """
+        column = resolve_field(field)
+        bars = self.context.get('current_bars')
+        if bars is not None and column in bars.columns:
+            return bars[column].reindex(securities).astype('float64')
+
+        prices = [self._get_current_price(security, field) for security in securities]
+        return pd.Series(prices, index=securities, dtype='float64')
+
     def _calculate_max_buy_amount(self, cash, price):
         """计算最大可买入数量（考虑手续费）"""
         if price <= 0 or cash <= 0:
-            return 0
\ No newline at end of file
+            return 0
+        return int(cash // price)
+
+    def _record_trade(self, order, amount, price, date):
+        """记录成交（数量为正数买入、负数卖出）"""
+        self.trades.append({
+            'order_id': order.order_id,
+            'security': order.security,
+            'amount': amount,
+            'price': price,
+            'date': date
+        })